@@ -15,6 +15,25 @@ CREATE TABLE public.langchain_pg_embedding (
 	cmetadata json NULL,
 	custom_id varchar NULL,
 	"uuid" uuid NOT NULL,
+	embedding_shadow public.vector NULL,
 	CONSTRAINT langchain_pg_embedding_pkey PRIMARY KEY (uuid),
 	CONSTRAINT langchain_pg_embedding_collection_id_fkey FOREIGN KEY (collection_id) REFERENCES public.langchain_pg_collection("uuid") ON DELETE CASCADE
 );
+
+
+-- 知识库当前使用的嵌入模型；target_model 非空表示有迁移（新向量写在 embedding_shadow 中），
+-- migration_status 为 running/cancelled/failed，只有 running 的迁移在重启后继续
+CREATE TABLE public.collection_embedding_model (
+	collection_id uuid NOT NULL,
+	model varchar NOT NULL,
+	target_model varchar NULL,
+	migration_status varchar NULL,
+	migration_error text NULL,
+	updated_at timestamp DEFAULT CURRENT_TIMESTAMP,
+	CONSTRAINT collection_embedding_model_pkey PRIMARY KEY (collection_id),
+	CONSTRAINT collection_embedding_model_collection_id_fkey FOREIGN KEY (collection_id) REFERENCES public.langchain_pg_collection("uuid") ON DELETE CASCADE
+);
+-- 手动建表时，把已有知识库登记为它们入库时使用的模型（即修改配置之前 config.json 中的 embedding_model）；
+-- 由应用自动建表时会自动登记
+-- INSERT INTO public.collection_embedding_model (collection_id, model)
+-- SELECT "uuid", '<当前的 embedding_model>' FROM public.langchain_pg_collection ON CONFLICT DO NOTHING;
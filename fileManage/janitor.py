@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from fileManage.uploadStore import UploadStore, BLOB_DIR_NAME
+from fileManage.resumableUpload import ResumableUploads
+
+logger = logging.getLogger(__name__)
+
+# 清理周期
+JANITOR_INTERVAL_SECONDS = 300
+# 上传文件、Parquet和图表合计的磁盘配额，超出后按最近使用时间淘汰
+DISK_QUOTA_BYTES = 20 * 1024 * 1024 * 1024
+# 未被任何会话引用的图表（会话过期后只剩图表目录自身一个链接）的保留时间，
+# 同时覆盖图表生成到挂入会话目录之间的窗口；/charts 响应的 max-age 与之一致，
+# 缓存过期后浏览器凭ETag重新验证，不会长期持有已删除图表的链接
+UNREFERENCED_CHART_GRACE_SECONDS = 10 * 60
+
+SESSION_CHARTS_DIR_NAME = "charts"
+# 接收键过期事件需要的 notify-keyspace-events 标志：E=keyevent频道，x=过期事件
+EXPIRED_EVENT_FLAGS = "Ex"
+
+
+def session_id_of(path: Path) -> Optional[str]:
+    """会话目录以会话UUID命名；其它目录（.blobs、duckdb临时目录等）返回None"""
+    try:
+        return str(UUID(path.name))
+    except ValueError:
+        return None
+
+
+def link_chart_to_session(session_dir: Path, chart_file: str):
+    """把图表硬链接进会话目录，会话存在期间图表不会作为无主文件被清理"""
+    target_dir = Path(session_dir) / SESSION_CHARTS_DIR_NAME
+    target = target_dir / os.path.basename(chart_file)
+    if target.exists() or not os.path.exists(chart_file):
+        return
+    target_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(chart_file, target)
+    except OSError:
+        pass  # 不支持硬链接时图表仅受图表TTL管理
+
+
+def merge_notify_flags(current: str, required: str = EXPIRED_EVENT_FLAGS) -> str:
+    """在现有 notify-keyspace-events 设置上补充所需标志，不影响其他订阅者"""
+    # A 是 "g$lshzxe" 的别名，已包含 x
+    have = set(current) | (set("g$lshzxe") if "A" in current else set())
+    return current + "".join(flag for flag in required if flag not in have)
+
+
+def _last_used(path: Path) -> float:
+    """目录内最近一次修改时间，作为LRU依据"""
+    latest = path.stat().st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+            except OSError:
+                continue
+    return latest
+
+
+class TempFileJanitor:
+    """会话临时文件生命周期管理
+
+    - Redis中会话键过期（或注销）后，删除该会话目录：上传文件、Parquet/manifest、图表链接
+    - 删除不再被任何路径引用的上传blob、无主图表和超时未完成的分片上传
+    - 总占用超过配额时，按最近使用时间淘汰会话目录和图表
+    上传blob以硬链接共享，占用按inode去重统计。
+    """
+
+    def __init__(self, backend, session_root: Path, upload_stores: List[UploadStore],
+                 resumable_uploads: List[ResumableUploads], charts_dir: Path,
+                 quota_bytes: int = DISK_QUOTA_BYTES, interval_seconds: float = JANITOR_INTERVAL_SECONDS):
+        self.backend = backend
+        self.session_root = Path(session_root)
+        self.upload_stores = upload_stores
+        self.resumable_uploads = resumable_uploads
+        self.charts_dir = Path(charts_dir)
+        self.quota_bytes = quota_bytes
+        self.interval_seconds = interval_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._lock = asyncio.Lock()
+        self.stats = {"last_run": None, "sessions_removed": 0, "charts_removed": 0,
+                      "blobs_removed": 0, "evicted": 0}
+
+    def start(self):
+        self._tasks.append(asyncio.create_task(self._run_periodically()))
+        self._tasks.append(asyncio.create_task(self._listen_expired()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run_periodically(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("临时文件清理失败")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def _listen_expired(self):
+        """订阅Redis键过期事件，会话过期后立即清理；服务器未开启通知时仅依赖定期扫描"""
+        try:
+            await self.backend.connect()
+            redis = self.backend.redis_pool
+            # 服务器级设置，只追加缺少的标志，保留其他应用需要的通知
+            current = (await redis.config_get("notify-keyspace-events")).get("notify-keyspace-events", "")
+            flags = merge_notify_flags(current)
+            if flags != current:
+                await redis.config_set("notify-keyspace-events", flags)
+            pubsub = redis.pubsub()
+            await pubsub.psubscribe("__keyevent@*__:expired")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"未启用Redis过期通知，按周期扫描清理: {str(e)}")
+            return
+        try:
+            async for message in pubsub.listen():
+                key = message.get("data")
+                if message.get("type") == "pmessage" and isinstance(key, str) and key.startswith("session:"):
+                    await self.remove_session(key[len("session:"):])
+        finally:
+            await pubsub.close()
+
+    async def remove_session(self, session_id: str):
+        """删除一个会话的全部临时文件"""
+        session_dir = self.session_root / str(session_id)
+        if session_dir.is_dir():
+            async with self._lock:
+                await asyncio.to_thread(shutil.rmtree, session_dir, True)
+                await asyncio.to_thread(self._collect_orphans)
+            self.stats["sessions_removed"] += 1
+            logger.info(f"已清理会话临时文件: {session_id}")
+
+    async def sweep(self):
+        """一次完整清理：过期会话 -> 无主文件 -> 磁盘配额"""
+        for session_dir in await asyncio.to_thread(self._session_dirs):
+            if not await self.backend.exists(session_id_of(session_dir)):
+                await self.remove_session(session_id_of(session_dir))
+
+        async with self._lock:
+            await asyncio.to_thread(self._collect_orphans)
+            await asyncio.to_thread(self._enforce_quota)
+        self.stats["last_run"] = time.time()
+
+    def _session_dirs(self) -> List[Path]:
+        if not self.session_root.is_dir():
+            return []
+        return [p for p in self.session_root.iterdir() if p.is_dir() and session_id_of(p)]
+
+    def _collect_orphans(self):
+        for manager in self.resumable_uploads:
+            manager.collect_expired()
+        for store in self.upload_stores:
+            self.stats["blobs_removed"] += store.collect_orphans()
+
+        # 只剩图表目录自身一个链接的图表已无会话引用
+        cutoff = time.time() - UNREFERENCED_CHART_GRACE_SECONDS
+        for chart in self._chart_files():
+            try:
+                st = chart.stat()
+                if st.st_nlink <= 1 and st.st_mtime < cutoff:
+                    chart.unlink()
+                    self.stats["charts_removed"] += 1
+            except OSError:
+                continue
+
+    def _chart_files(self) -> List[Path]:
+        if not self.charts_dir.is_dir():
+            return []
+        return [p for p in self.charts_dir.iterdir() if p.is_file()]
+
+    def _enforce_quota(self):
+        usage = self.disk_usage()["total_bytes"]
+        if usage <= self.quota_bytes:
+            return
+
+        candidates = []
+        for session_dir in self._session_dirs():
+            try:
+                candidates.append((_last_used(session_dir), session_dir))
+            except OSError:
+                continue
+        for chart in self._chart_files():
+            try:
+                candidates.append((chart.stat().st_mtime, chart))
+            except OSError:
+                continue
+
+        for _, path in sorted(candidates, key=lambda item: item[0]):
+            if usage <= self.quota_bytes:
+                break
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            self.stats["evicted"] += 1
+            # 删除会话目录后其blob可能变为无主，重新统计
+            for store in self.upload_stores:
+                store.collect_orphans()
+            usage = self.disk_usage()["total_bytes"]
+        logger.warning(f"磁盘占用超过配额，已按LRU淘汰，当前 {usage / 1024 / 1024:.0f}MB")
+
+    def disk_usage(self) -> Dict:
+        """各类临时文件的占用（字节），硬链接只计一次"""
+        seen = set()
+        usage = {"sessions": 0, "session_bytes": 0, "parquet_bytes": 0, "blob_bytes": 0,
+                 "chart_bytes": 0, "charts": 0}
+
+        def count(path: str, key: str):
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            inode = (st.st_dev, st.st_ino)
+            if inode in seen:
+                return
+            seen.add(inode)
+            usage[key] += st.st_size
+
+        # 先统计图表目录，会话目录中的图表链接不再重复计入
+        for chart in self._chart_files():
+            usage["charts"] += 1
+            count(str(chart), "chart_bytes")
+
+        roots = [self.session_root] + [store.root for store in self.upload_stores]
+        for root in dict.fromkeys(roots):
+            if not root.is_dir():
+                continue
+            for dirpath, _, files in os.walk(root):
+                in_blobs = BLOB_DIR_NAME in Path(dirpath).parts
+                for name in files:
+                    path = os.path.join(dirpath, name)
+                    if in_blobs:
+                        count(path, "blob_bytes")
+                    elif name.endswith((".parquet", ".manifest.json")):
+                        count(path, "parquet_bytes")
+                    else:
+                        count(path, "session_bytes")
+
+        usage["sessions"] = len(self._session_dirs())
+        usage["total_bytes"] = (usage["session_bytes"] + usage["parquet_bytes"]
+                                + usage["blob_bytes"] + usage["chart_bytes"])
+        usage["quota_bytes"] = self.quota_bytes
+        return {**usage, **self.stats}
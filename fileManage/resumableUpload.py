@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import aiofiles
+
+from fileManage.uploadStore import UploadStore, StoredUpload, UploadTooLarge, safe_filename
+
+logger = logging.getLogger(__name__)
+
+# 默认分片大小，客户端可在上限内自行指定
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+MAX_CHUNK_BYTES = 64 * 1024 * 1024
+MIN_CHUNK_BYTES = 256 * 1024
+# 未完成的上传保留时间，超时后可被清理
+UPLOAD_SESSION_TTL_SECONDS = 24 * 3600
+
+RESUMABLE_DIR_NAME = ".resumable"
+
+
+class ResumableUploadError(Exception):
+    """断点续传协议错误，status_code 对应返回给客户端的HTTP状态码"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ResumableUploads:
+    """分片断点续传上传
+
+    init 时按文件总大小预分配一个 data.part 文件，每个分片直接写入其偏移位置，
+    因此分片可以并行、乱序、重复上传，finalize 时无需拼接复制；
+    data.part 校验后作为blob交给 UploadStore 去重并链接到目标路径。
+    已收到的分片以 chunks/<序号> 标记文件记录（内容为分片的SHA-256），供 status 查询续传。
+    """
+
+    def __init__(self, store: UploadStore):
+        self.store = store
+        self.root = store.root / RESUMABLE_DIR_NAME
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _dir(self, upload_id: str) -> Path:
+        # upload_id 由服务端生成，只允许十六进制，防止路径穿越
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise ResumableUploadError("无效的上传ID", 404)
+        return self.root / upload_id
+
+    def _load_meta(self, upload_id: str, owner: str) -> dict:
+        meta_path = self._dir(upload_id) / "meta.json"
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise ResumableUploadError("上传不存在或已过期", 404)
+        if meta["owner"] != owner:
+            raise ResumableUploadError("上传不存在或已过期", 404)
+        return meta
+
+    def init(self, filename: str, size: int, owner: str, sha256: Optional[str] = None,
+             chunk_size: int = DEFAULT_CHUNK_BYTES) -> dict:
+        """登记一次上传并预分配目标文件，返回上传ID和分片参数"""
+        if size < 0:
+            raise ResumableUploadError("文件大小无效")
+        if self.store.max_bytes is not None and size > self.store.max_bytes:
+            raise ResumableUploadError(str(UploadTooLarge(self.store.max_bytes)), 413)
+        chunk_size = min(max(int(chunk_size), MIN_CHUNK_BYTES), MAX_CHUNK_BYTES)
+
+        upload_id = uuid.uuid4().hex
+        upload_dir = self._dir(upload_id)
+        (upload_dir / "chunks").mkdir(parents=True)
+        with open(upload_dir / "data.part", "wb") as f:
+            f.truncate(size)
+
+        meta = {
+            "upload_id": upload_id,
+            "filename": safe_filename(filename),
+            "size": size,
+            "chunk_size": chunk_size,
+            "total_chunks": max((size + chunk_size - 1) // chunk_size, 1),
+            "sha256": sha256.lower() if sha256 else None,
+            "owner": owner,
+            "created_at": time.time()
+        }
+        with open(upload_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        logger.info(f"断点续传上传已创建: {upload_id} {meta['filename']} ({size} 字节, {meta['total_chunks']} 片)")
+        return {k: v for k, v in meta.items() if k != "owner"}
+
+    async def write_chunk(self, upload_id: str, index: int, owner: str, body: AsyncIterator[bytes],
+                          sha256: Optional[str] = None) -> dict:
+        """把一个分片流式写入其偏移位置，校验长度和可选的SHA-256后标记为已收到"""
+        meta = self._load_meta(upload_id, owner)
+        if not 0 <= index < meta["total_chunks"]:
+            raise ResumableUploadError(f"分片序号超出范围: {index}")
+        offset = index * meta["chunk_size"]
+        expected = min(meta["chunk_size"], meta["size"] - offset)
+
+        upload_dir = self._dir(upload_id)
+        digest = hashlib.sha256()
+        received = 0
+        async with aiofiles.open(upload_dir / "data.part", "r+b") as f:
+            await f.seek(offset)
+            async for piece in body:
+                received += len(piece)
+                if received > expected:
+                    raise ResumableUploadError(f"分片 {index} 超出应有长度 {expected}")
+                digest.update(piece)
+                await f.write(piece)
+
+        if received != expected:
+            raise ResumableUploadError(f"分片 {index} 长度不符: 收到 {received}，应为 {expected}")
+        chunk_sha256 = digest.hexdigest()
+        if sha256 and sha256.lower() != chunk_sha256:
+            raise ResumableUploadError(f"分片 {index} 校验和不符，请重传")
+
+        async with aiofiles.open(upload_dir / "chunks" / str(index), "w") as marker:
+            await marker.write(chunk_sha256)
+        return {"index": index, "offset": offset, "size": received, "sha256": chunk_sha256}
+
+    def status(self, upload_id: str, owner: str) -> dict:
+        """已收到和缺失的分片，客户端据此续传"""
+        meta = self._load_meta(upload_id, owner)
+        received = sorted(int(name) for name in os.listdir(self._dir(upload_id) / "chunks"))
+        received_set = set(received)
+        return {
+            "upload_id": upload_id,
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "chunk_size": meta["chunk_size"],
+            "total_chunks": meta["total_chunks"],
+            "received": received,
+            "missing": [i for i in range(meta["total_chunks"]) if i not in received_set]
+        }
+
+    async def finalize(self, upload_id: str, owner: str, dest_dir: Path,
+                       filename: Optional[str] = None) -> StoredUpload:
+        """所有分片到齐后校验整体哈希，把预分配文件原地交给 UploadStore 保存
+
+        filename 为空时使用 init 登记的文件名。
+        """
+        state = self.status(upload_id, owner)
+        if state["missing"]:
+            raise ResumableUploadError(f"还有 {len(state['missing'])} 个分片未上传", 409)
+        meta = self._load_meta(upload_id, owner)
+        upload_dir = self._dir(upload_id)
+        data_path = upload_dir / "data.part"
+
+        sha256 = await asyncio.to_thread(_file_sha256, data_path)
+        if meta["sha256"] and meta["sha256"] != sha256:
+            raise ResumableUploadError("文件整体校验和不符，请重新上传", 422)
+
+        # commit 持有文件锁并可能复制整个文件，放到线程中执行，不阻塞事件循环
+        stored = await asyncio.to_thread(self.store.commit, data_path, sha256, meta["size"],
+                                         Path(dest_dir) / safe_filename(filename or meta["filename"]))
+        await asyncio.to_thread(shutil.rmtree, upload_dir, ignore_errors=True)
+        return stored
+
+    def abort(self, upload_id: str, owner: str):
+        self._load_meta(upload_id, owner)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def collect_expired(self, ttl_seconds: float = UPLOAD_SESSION_TTL_SECONDS) -> int:
+        """清理超过保留时间仍未完成的上传"""
+        cutoff = time.time() - ttl_seconds
+        removed = 0
+        for upload_dir in self.root.iterdir():
+            try:
+                # data.part 的修改时间即最后一次收到分片的时间
+                data_path = upload_dir / "data.part"
+                last_active = (data_path if data_path.exists() else upload_dir).stat().st_mtime
+                if last_active < cutoff:
+                    shutil.rmtree(upload_dir, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+import aiofiles
+from fastapi import UploadFile
+from filelock import FileLock
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 每次从上传流读取/写盘的块大小
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# 各上传路由的请求体大小上限（字节）
+UPLOAD_SIZE_LIMITS = {
+    "/uploadcsvfile": 1024 * 1024 * 1024,  # 1GB，大文件走DuckDB查询
+    "/uploadragfile": 200 * 1024 * 1024,   # 200MB
+}
+
+BLOB_DIR_NAME = ".blobs"
+# Linux ioctl：在支持写时复制的文件系统（btrfs、XFS等）上克隆文件
+FICLONE = 0x40049409
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+class UploadTooLarge(Exception):
+    """上传内容超过大小上限"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"上传文件超过大小上限 {limit // 1024 // 1024}MB")
+        self.limit = limit
+
+
+@dataclass
+class StoredUpload:
+    path: str
+    sha256: str
+    size: int
+    deduplicated: bool
+
+
+def safe_filename(filename: Optional[str]) -> str:
+    """只保留文件名部分，防止通过 ../ 写到上传目录之外"""
+    name = Path(filename or "").name
+    return name or f"upload_{uuid.uuid4().hex}"
+
+
+class UploadStore:
+    """流式保存上传文件，边写边计算SHA-256，按内容去重
+
+    内容只在 <root>/.blobs/<sha256> 保存一份。各会话的目标路径互不影响：
+    - 优先用写时复制克隆（reflink），会话内原地修改文件不会影响其他副本
+    - 否则用硬链接，blob设为只读，修改须先删除再写新文件，不能原地改写
+    - 都不支持时退化为复制
+    commit 与 collect_orphans 由 <blob目录>/.lock 文件锁互斥（跨进程），
+    避免blob在替换和链接之间被当作无引用删除。
+    """
+
+    def __init__(self, root: Path, max_bytes: Optional[int] = None):
+        self.root = Path(root)
+        self.blob_dir = self.root / BLOB_DIR_NAME
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = FileLock(str(self.blob_dir / ".lock"))
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blob_dir / sha256
+
+    async def save(self, upload_file: UploadFile, dest_dir: Path, filename: Optional[str] = None) -> StoredUpload:
+        """把上传流分块异步写盘，不阻塞事件循环；超过上限立即中止"""
+        tmp_path = self.blob_dir / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as buffer:
+                while True:
+                    chunk = await upload_file.read(UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if self.max_bytes is not None and size > self.max_bytes:
+                        raise UploadTooLarge(self.max_bytes)
+                    digest.update(chunk)
+                    await buffer.write(chunk)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            await upload_file.close()
+
+        dest = Path(dest_dir) / safe_filename(filename or upload_file.filename)
+        return self.commit(tmp_path, digest.hexdigest(), size, dest)
+
+    def commit(self, tmp_path: Path, sha256: str, size: int, dest: Path) -> StoredUpload:
+        """把已写完的临时文件存为blob（已存在则丢弃临时文件），并链接到目标路径"""
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        blob = self.blob_path(sha256)
+        if dest.exists() or dest.is_symlink():
+            _remove(dest)
+
+        with self._lock:
+            deduplicated = blob.exists()
+            if deduplicated:
+                tmp_path.unlink(missing_ok=True)
+            else:
+                os.chmod(tmp_path, READ_ONLY)
+                os.replace(tmp_path, blob)
+            self._link(blob, dest)
+
+        logger.info(f"上传文件已保存: {dest} ({size} 字节, sha256={sha256[:12]}, 去重={deduplicated})")
+        return StoredUpload(path=str(dest), sha256=sha256, size=size, deduplicated=deduplicated)
+
+    @staticmethod
+    def _link(blob: Path, dest: Path):
+        if _clone(blob, dest):
+            return
+        try:
+            os.link(blob, dest)
+        except OSError:
+            # 跨设备或文件系统不支持硬链接；复制出的文件是独立的，可以写
+            shutil.copyfile(blob, dest)
+
+    def discard(self, path: str):
+        """删除一个上传文件，并清理不再被引用的blob"""
+        _remove(Path(path))
+        self.collect_orphans()
+
+    def collect_orphans(self) -> int:
+        """删除只剩blob自身一个链接的内容（所有上传路径都已删除或是克隆的副本）"""
+        removed = 0
+        with self._lock:
+            for blob in self.blob_dir.iterdir():
+                if blob.suffix:
+                    continue  # 写入中的 .part 临时文件和 .lock
+                try:
+                    if blob.stat().st_nlink <= 1:
+                        _remove(blob)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+
+def _clone(blob: Path, dest: Path) -> bool:
+    """写时复制克隆 blob 到 dest，文件系统不支持时返回False"""
+    if fcntl is None:
+        return False
+    try:
+        with open(blob, "rb") as src, open(dest, "xb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except FileExistsError:
+        raise
+    except OSError:
+        dest.unlink(missing_ok=True)
+        return False
+    return True
+
+
+def _remove(path: Path):
+    try:
+        path.unlink(missing_ok=True)
+    except PermissionError:
+        # Windows 不能删除只读文件
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        path.unlink(missing_ok=True)
+
+
+class UploadSizeLimitMiddleware:
+    """按路由限制请求体大小，在请求体读完之前拒绝超限上传
+
+    先检查 Content-Length；未声明长度（分块传输）时边接收边计数，
+    超限后不再交给应用，直接返回413。
+    """
+
+    def __init__(self, app, limits: Dict[str, int] = None):
+        self.app = app
+        self.limits = limits if limits is not None else UPLOAD_SIZE_LIMITS
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge(limit)
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # 超限后应用返回的任何响应（如请求体解析错误）都替换为413
+            if exceeded:
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send, limit)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not response_started:
+                await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": str(UploadTooLarge(limit))}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -12,6 +12,7 @@ from ddgs import DDGS
 import asyncio
 
 from llms.DeepSeekLLM import getDeepSeek
+from mcptools.toolExecutor import run_tool_calls_threaded
 # 初始化模型
 llm = getDeepSeek()
 
@@ -27,6 +28,11 @@ def web_search(query: str) -> str:
         return f"搜索错误: {str(e)}"
 
 tools = [web_search]
+
+# 单步内工具并发上限与单个工具超时（秒）
+TOOL_CONCURRENCY = 4
+TOOL_TIMEOUT_SECONDS = 30
+
 llm_with_tools = llm.bind_tools(tools)
 
 # 2. 定义Agent状态
@@ -55,31 +61,14 @@ def call_model(state: AgentState) -> dict:
 
 def call_tool(state: AgentState) -> dict:
     tool_calls = state["tool_calls"]
-    tool_responses = []
-
-    for tool_call in tool_calls:
-        tool_name = tool_call["name"]
-        tool_input = tool_call["args"]
-
-        # 查找并执行对应工具
-        selected_tool = next((t for t in tools if t.name == tool_name), None)
-        if not selected_tool:
-            result = f"未知工具: {tool_name}"
-        else:
-            try:
-                result = selected_tool.invoke(tool_input)
-            except Exception as e:
-                result = f"工具执行错误: {str(e)}"
-
-        tool_responses.append(ToolMessage(
-            tool_call_id=tool_call["id"],
-            content=str(result),
-            name=tool_name
-        ))
 
+    # 同一步的多个工具调用在线程池中并发执行，结果按原顺序返回
+    tool_responses = run_tool_calls_threaded(tools, tool_calls, TOOL_CONCURRENCY, TOOL_TIMEOUT_SECONDS)
+
+    for tool_call, response in zip(tool_calls, tool_responses):
         # 打印工具调用日志
-        print(f"\n🔧 工具调用: {tool_name}({tool_input})")
-        print(f"  结果: {str(result)[:200]}...")
+        print(f"\n🔧 工具调用: {tool_call['name']}({tool_call['args']})")
+        print(f"  结果: {str(response.content)[:200]}...")
 
     return {"messages": tool_responses, "tool_calls": []}
 
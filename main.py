@@ -13,8 +13,18 @@ from llmNoContextManage.dsTalkStream import stream_generator
 from llmWithContextManage.talkWithContext import stream_generator_ctx
 from fastapi import FastAPI, UploadFile, Form, File, HTTPException, Request
 import os
+import asyncio
 from rag_routes import create_rag_router  # 导入RAG路由
 from mcp_routes import create_mcp_router  # 导入RAG路由
+from upload_routes import create_upload_router  # 导入分片上传路由
+from fileManage.uploadStore import UploadSizeLimitMiddleware, UPLOAD_SIZE_LIMITS
+from fileManage.janitor import TempFileJanitor
+from mcptools.mcp import upload_dir as mcp_upload_dir, upload_store as mcp_upload_store, resumable_uploads as mcp_resumable_uploads
+from rag.initRAGDB_local_model_wf import upload_store as rag_upload_store, resumable_uploads as rag_resumable_uploads
+from mcptools.tools.chartStore import CHARTS_DIR
+from rag.ingestJobs import ingest_jobs, INGEST_QUEUE_BACKEND
+from rag.initRAGDB_local_model_wf import embedding_migrations
+from mcptools.toolRegistry import tool_registry
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +34,8 @@ logger = logging.getLogger("redis_session")
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+# 按路由限制上传大小，超限请求在读完请求体之前即被拒绝
+app.add_middleware(UploadSizeLimitMiddleware, limits=UPLOAD_SIZE_LIMITS)
 
 # 会话配置
 cookie_params = CookieParameters(secure=False)
@@ -38,10 +50,38 @@ cookie = SessionCookie(
 # 使用Redis作为会话存储后端
 backend = RedisBackend()
 
+# 会话过期后清理其上传文件、Parquet和图表，并控制总磁盘占用
+janitor = TempFileJanitor(
+    backend,
+    session_root=mcp_upload_dir,
+    upload_stores=[mcp_upload_store, rag_upload_store],
+    resumable_uploads=[mcp_resumable_uploads, rag_resumable_uploads],
+    charts_dir=CHARTS_DIR
+)
+
 # 应用生命周期事件
+@app.on_event("startup")
+async def startup_event():
+    janitor.start()
+    # 知识库入库任务队列（INGEST_QUEUE_BACKEND=redis 时多个节点共享队列）
+    ingest_jobs.start(backend if INGEST_QUEUE_BACKEND == "redis" else None)
+    # 继续重启前未完成的嵌入模型迁移
+    try:
+        await asyncio.to_thread(embedding_migrations.resume_pending)
+    except Exception:
+        logger.exception("恢复嵌入模型迁移失败")
+    # 预先启动pandas等远程MCP服务（及其沙箱进程池），首个请求无需等待
+    try:
+        await tool_registry.start()
+    except Exception:
+        logger.exception("启动MCP服务失败，将在首次请求时重试")
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时清理资源"""
+    await janitor.stop()
+    await ingest_jobs.stop()
+    await tool_registry.close()
     await backend.close()
     await close_pool()
     logger.info("应用资源已清理")
@@ -68,6 +108,11 @@ async def verify_admin(
         )
     return session_data
 
+# 临时文件磁盘占用
+@app.get("/admin/disk_usage")
+async def disk_usage(session_data: SessionData = Depends(verify_admin)):
+    return await asyncio.to_thread(janitor.disk_usage)
+
 # 创建并挂载RAG路由
 
 # 登录页面
@@ -137,6 +182,7 @@ async def profile_page(
 @app.post("/logout")
 async def logout(request: Request, session_id: UUID = Depends(cookie)):
     await backend.delete(session_id)
+    await janitor.remove_session(str(session_id))
     response = RedirectResponse(url="/", status_code=303)
     cookie.delete_from_response(response)
     return response
@@ -201,6 +247,9 @@ app.include_router(rag_router)
 mcp_router = create_mcp_router(templates, get_session_data, cookie ,backend)
 app.include_router(mcp_router)
 
+upload_router = create_upload_router(get_session_data, cookie)
+app.include_router(upload_router)
+
 
 if __name__ == "__main__":
     import uvicorn
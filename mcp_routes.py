@@ -1,8 +1,15 @@
-from fastapi import APIRouter, UploadFile, Form, File, HTTPException, Request, Depends
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import APIRouter, UploadFile, Form, File, HTTPException, Request, Depends, BackgroundTasks
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse, FileResponse, Response
 import logging
 from sessionManage.sessionObj import SessionData
-from mcptools.mcp import save_upload_file,call_tools,PandasQueryRequest
+from mcptools.mcp import save_upload_file,call_tools,PandasQueryRequest,get_tool_payload,resumable_uploads,upload_dir
+from mcptools.tools.columnarStore import convert_to_parquet
+from mcptools.tools.csvProfiler import profile_file, schema_summary
+from mcptools.tools.chartStore import CHART_ID_PATTERN, chart_path
+from fileManage.janitor import UNREFERENCED_CHART_GRACE_SECONDS
+from fileManage.uploadStore import UploadTooLarge
+from fileManage.resumableUpload import ResumableUploadError
+import asyncio
 import os
 # 配置日志
 logger = logging.getLogger("mcp_routes")
@@ -16,31 +23,64 @@ def create_mcp_router(templates, get_session_data, cookie, backend):
         """创建RAG页面"""
         return templates.TemplateResponse("mcp/mcppandas.html", {"request": request})
 
+    async def accept_data_file(file_path: str, session_id, session_data: SessionData,
+                               background_tasks: BackgroundTasks) -> dict:
+        """登记会话的数据文件：预读结构摘要，并在后台转换为Parquet"""
+        session_data.tmpfilepath = file_path
+        session_data.dataset_context = None
+        if file_path.lower().endswith(".csv"):
+            # 预先生成数据结构摘要，省去大模型首轮调用read_metadata
+            try:
+                profile = await asyncio.to_thread(profile_file, file_path, "fast")
+                session_data.dataset_context = schema_summary(profile)
+            except Exception as e:
+                logger.warning(f"数据结构预读取失败: {str(e)}")
+        await backend.update(session_id, session_data)
+        # 后台转换为Parquet列式文件，后续工具调用无需重复解析CSV
+        if file_path.lower().endswith(".csv"):
+            background_tasks.add_task(convert_to_parquet, file_path)
+        return {"filepath":file_path,"status":'success'}
+
     @router.post("/uploadcsvfile")
     async def uploadcsvfile(
+            background_tasks: BackgroundTasks,
             file: UploadFile = File(...),
             session_id: str = Depends(cookie),
             session_data: SessionData = Depends(get_session_data)
     ):
         """提交md文件，创建知识库"""
         try:
-            file_path = save_upload_file(file,session_id)
-            session_data.tmpfilepath = file_path
-            await backend.update(session_id, session_data)
-            result = {"filepath":file_path,"status":'success'}
-            return result
+            file_path = await save_upload_file(file,session_id)
+            return await accept_data_file(file_path, session_id, session_data, background_tasks)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             logger.error(f"文件处理错误: {str(e)}")
             result = {"filepath":str(e),"status":'fail'}
             raise HTTPException(status_code=500, detail=f"文件处理错误: {str(e)}")
 
+    @router.post("/uploadcsvfile/finalize/{upload_id}")
+    async def finalize_csv_upload(
+            upload_id: str,
+            background_tasks: BackgroundTasks,
+            session_id: str = Depends(cookie),
+            session_data: SessionData = Depends(get_session_data)
+    ):
+        """分片上传完成后组装文件，之后的处理与 /uploadcsvfile 相同"""
+        try:
+            stored = await resumable_uploads.finalize(upload_id, str(session_id), upload_dir / str(session_id))
+        except ResumableUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        return await accept_data_file(stored.path, session_id, session_data, background_tasks)
+
     @router.post("/query_pandas")
     async def query_rag_list(request: PandasQueryRequest,
+                             session_id: str = Depends(cookie),
                              session_data: SessionData = Depends(get_session_data)):
         try:
             # 返回流式响应
             return StreamingResponse(
-                call_tools(request.query_text, session_data.tmpfilepath),
+                call_tools(request.query_text, session_data.tmpfilepath, str(session_id), session_data.dataset_context),
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
@@ -53,20 +93,38 @@ def create_mcp_router(templates, get_session_data, cookie, backend):
             result = {"info": str(e), "status": 'fail'}
             return result
         finally:
+            # 临时文件由后台清理任务在会话过期后删除，这里只刷新会话目录的使用时间（磁盘配额按LRU淘汰）
             if session_data.tmpfilepath and os.path.exists(session_data.tmpfilepath):
                 try:
-                    # 获取文件所在目录路径
-                    # dir_path = os.path.dirname(session_data.tmpfilepath)
-                    # # 删除临时文件
-                    # os.remove(session_data.tmpfilepath)
-                    print(f"已删除临时文件: {session_data.tmpfilepath}")
-                    # 尝试删除所在目录（如果目录为空）
-                    # if os.path.exists(dir_path) and not os.listdir(dir_path):
-                    #     os.rmdir(dir_path)
-                    #     print(f"已删除空目录: {dir_path}")
-                    # elif os.path.exists(dir_path):
-                    #     print(f"目录非空，保留目录: {dir_path}")
-                except Exception as e:
-                    print(f"操作过程中出错: {e}")
+                    os.utime(os.path.dirname(session_data.tmpfilepath))
+                except OSError as e:
+                    logger.warning(f"刷新会话目录时间失败: {e}")
+
+    @router.get("/tool_output/{ref_id}")
+    async def tool_output(ref_id: str,
+                          session_id: str = Depends(cookie),
+                          session_data: SessionData = Depends(get_session_data)):
+        """按引用获取完整的工具调用结果；其他会话的结果同样返回404，不暴露其是否存在"""
+        content = get_tool_payload(ref_id, str(session_id))
+        if content is None:
+            raise HTTPException(status_code=404, detail="工具结果不存在或已过期")
+        return PlainTextResponse(content)
+
+    @router.get("/charts/{chart_id}")
+    async def get_chart(chart_id: str, request: Request):
+        """按内容哈希获取图表；内容不变，浏览器凭ETag只需下载一次"""
+        if not CHART_ID_PATTERN.match(chart_id):
+            raise HTTPException(status_code=404, detail="图表不存在")
+        path = chart_path(chart_id)
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="图表不存在或已过期")
+
+        headers = {
+            "ETag": f'"{chart_id}"',
+            "Cache-Control": f"public, max-age={UNREFERENCED_CHART_GRACE_SECONDS}"
+        }
+        if f'"{chart_id}"' in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type="text/html", headers=headers)
 
     return router
@@ -1,14 +1,26 @@
-from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.graph import StateGraph, MessagesState, START, END
-from langgraph.prebuilt import ToolNode
 from fastapi import UploadFile
 from pathlib import Path
-import shutil
 from uuid import UUID
 from pydantic import BaseModel
 from llms.DeepSeekLLM import getDeepSeek
 from typing import AsyncGenerator, List, Dict, Optional
 from langchain_core.messages import AIMessageChunk
+from langchain_core.callbacks import adispatch_custom_event
+from collections import OrderedDict
+import json
+import logging
+import time
+import uuid
+from mcptools.tools.resultEncoder import encode_tool_output
+from mcptools.toolExecutor import ConcurrentToolExecutor
+from mcptools.toolRegistry import tool_registry
+from fileManage.uploadStore import UploadStore, UPLOAD_SIZE_LIMITS
+from fileManage.resumableUpload import ResumableUploads
+from fileManage.janitor import link_chart_to_session
+from mcptools.tools.chartStore import CHART_ID_PATTERN, chart_path
+
+logger = logging.getLogger(__name__)
 
 class PandasQueryRequest(BaseModel):
     query_text: str
@@ -18,32 +30,105 @@ llm = getDeepSeek()
 
 upload_dir = Path('./mcptools/tmp')
 upload_dir.mkdir(exist_ok=True, parents=True)
+upload_store = UploadStore(upload_dir, UPLOAD_SIZE_LIMITS["/uploadcsvfile"])
+resumable_uploads = ResumableUploads(upload_store)
+
+# 每个工具结果回填给大模型前的token上限
+TOOL_RESULT_TOKEN_BUDGET = 1500
+
+# 同一步内多个tool_calls并发执行的上限，以及单个工具的超时（需大于沙箱执行超时）
+TOOL_CONCURRENCY = 4
+TOOL_TIMEOUT_SECONDS = 120
+
+# 超过该长度的工具结果不随事件流下发，只给出引用，客户端按需获取
+TOOL_PAYLOAD_INLINE_CHARS = 2000
+TOOL_PAYLOAD_PREVIEW_CHARS = 300
+TOOL_PAYLOAD_MAX_ENTRIES = 256
+TOOL_PAYLOAD_MAX_BYTES = 64 * 1024 * 1024
+# ref_id -> (所属会话, 内容, 字节数)；只在事件循环中访问，无需加锁
+_tool_payloads = OrderedDict()
+_tool_payload_bytes = 0
+
+
+def store_tool_payload(content: str, owner: str) -> Optional[str]:
+    """缓存完整的工具结果，返回引用ID；按条数和总字节数淘汰最早的结果，单条超过上限时不缓存"""
+    global _tool_payload_bytes
+    size = len(content.encode("utf-8"))
+    if size > TOOL_PAYLOAD_MAX_BYTES:
+        return None
+    ref_id = uuid.uuid4().hex
+    _tool_payloads[ref_id] = (owner, content, size)
+    _tool_payload_bytes += size
+    while len(_tool_payloads) > TOOL_PAYLOAD_MAX_ENTRIES or _tool_payload_bytes > TOOL_PAYLOAD_MAX_BYTES:
+        _, (_, _, evicted_size) = _tool_payloads.popitem(last=False)
+        _tool_payload_bytes -= evicted_size
+    return ref_id
+
+
+def get_tool_payload(ref_id: str, owner: str) -> Optional[str]:
+    """取回工具结果；只有产生该结果的会话可以读取"""
+    entry = _tool_payloads.get(ref_id)
+    if entry is None or entry[0] != owner:
+        return None
+    return entry[1]
+
+
+def sse_event(event: str, data: dict) -> str:
+    """格式化一条SSE事件，data统一为JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _tool_output_payload(output, owner: str) -> dict:
+    """小结果直接内联，大结果替换为引用（只有 owner 会话能取回）"""
+    content = getattr(output, "content", output)
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, default=str)
+    if len(content) <= TOOL_PAYLOAD_INLINE_CHARS:
+        return {"content": content}
+    payload = {
+        "preview": content[:TOOL_PAYLOAD_PREVIEW_CHARS],
+        "size": len(content)
+    }
+    ref_id = store_tool_payload(content, owner)
+    if ref_id:
+        payload["ref"] = f"/tool_output/{ref_id}"
+    return payload
+
+def _attach_chart(filepath: str, output):
+    """图表工具的结果链接进会话目录，会话过期时随会话一起清理"""
+    content = getattr(output, "content", None)
+    if not filepath or not isinstance(content, str) or "/charts/" not in content:
+        return
+    try:
+        url = json.loads(content).get("url", "")
+    except (ValueError, AttributeError):
+        return
+    chart_id = url.rsplit("/", 1)[-1]
+    if url.startswith("/charts/") and CHART_ID_PATTERN.match(chart_id):
+        link_chart_to_session(Path(filepath).parent, chart_path(chart_id))
 
 # Initialize the model
-async def call_tools(inputstr: str, filepath: str) -> AsyncGenerator[str, None]:
-    # Set up MCP client
-    client = MultiServerMCPClient(
-        {
-            "math": {
-                "command": "python",
-                # Make sure to update to the full absolute path to your math_server.py file
-                "args": ["./mcptools/tools/math_server.py"],
-                "transport": "stdio",
-            },
-            "pandas": {
-                "command": "python",
-                "args": ["./mcptools/tools/pandasMcp.py"],
-                "transport": "stdio",
-            }
-        }
-    )
-    tools = await client.get_tools()
+async def call_tools(inputstr: str, filepath: str, session_id: str,
+                     dataset_context: Optional[str] = None) -> AsyncGenerator[str, None]:
+    # 可信的轻量工具（如math）进程内直接调用，其余服务走应用级长连接的stdio子进程
+    tools = await tool_registry.load_tools()
 
     # Bind tools to model
     model_with_tools = llm.bind_tools(tools,stream = True)
 
-    # Create ToolNode
-    tool_node = ToolNode(tools)
+    # 并发执行同一步中的多个工具调用，结果按tool_calls原顺序返回
+    tool_executor = ConcurrentToolExecutor(tools, TOOL_CONCURRENCY, TOOL_TIMEOUT_SECONDS)
+
+    async def call_tool_node(state: MessagesState):
+        """执行工具，并把结果压缩编码后再回填给大模型"""
+        output = await tool_executor(state)
+        for msg in output["messages"]:
+            if isinstance(msg.content, str):
+                msg.content, stats = encode_tool_output(msg.content, TOOL_RESULT_TOKEN_BUDGET)
+                msg.response_metadata["encoding"] = stats
+                logger.info(f"工具 {msg.name} 结果压缩: {stats['tokens_before']} -> {stats['tokens_after']} tokens")
+                await adispatch_custom_event("tool_encoded", {"tool_call_id": msg.tool_call_id, "name": msg.name, **stats})
+        return output
 
     def should_continue(state: MessagesState):
         messages = state["messages"]
@@ -61,7 +146,7 @@ async def call_tools(inputstr: str, filepath: str) -> AsyncGenerator[str, None]:
     # Build the graph
     builder = StateGraph(MessagesState)
     builder.add_node("call_model", call_model)
-    builder.add_node("tools", tool_node)
+    builder.add_node("tools", call_tool_node)
 
     builder.add_edge(START, "call_model")
     builder.add_conditional_edges(
@@ -75,38 +160,49 @@ async def call_tools(inputstr: str, filepath: str) -> AsyncGenerator[str, None]:
 
     # Test the graph
 
-    inputs = {"messages": [{"role": "user", "content": f"{inputstr}；待处理的文件路径:{filepath}"}]}
-    async for event in graph.astream(inputs):
-        for node, output in event.items():
-            if node == "call_model":
-                # 提取流式内容
-                if isinstance(output, dict) and "messages" in output:
-                    last_msg = output["messages"][-1]
-                    # if isinstance(last_msg, AIMessageChunk):
-                    yield f"## 大模型调用: {last_msg.content}\n\n"
-            elif node == "tools":
-                yield f"## 工具调用: {output}\n\n"
-
-def save_upload_file(upload_file: UploadFile, sessionId: UUID) -> str:
-    """保存上传的文件并返回文件路径"""
+    content = f"{inputstr}；待处理的文件路径:{filepath}"
+    if dataset_context:
+        # 上传时已生成结构摘要，模型可直接写代码，无需先调用read_metadata
+        content += f"\n文件结构（已预先读取，无需再调用read_metadata）:\n{dataset_context}"
+    inputs = {"messages": [{"role": "user", "content": content}]}
+    # 事件类型: token(模型逐token输出) / tool_start / tool_end(含耗时) / tool_encoded(压缩统计) / done
+    tool_started_at = {}
+    async for event in graph.astream_events(inputs, version="v2"):
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            chunk = event["data"]["chunk"]
+            if chunk.content:
+                yield sse_event("token", {"content": chunk.content})
+        elif kind == "on_tool_start":
+            tool_started_at[event["run_id"]] = time.perf_counter()
+            yield sse_event("tool_start", {
+                "id": event["run_id"],
+                "name": event["name"],
+                "input": event["data"].get("input")
+            })
+        elif kind == "on_tool_end":
+            started = tool_started_at.pop(event["run_id"], None)
+            output = event["data"].get("output")
+            _attach_chart(filepath, output)
+            yield sse_event("tool_end", {
+                "id": event["run_id"],
+                "name": event["name"],
+                "tool_call_id": getattr(output, "tool_call_id", None),
+                "duration_ms": round((time.perf_counter() - started) * 1000) if started else None,
+                **_tool_output_payload(output, session_id)
+            })
+        elif kind == "on_custom_event" and event["name"] == "tool_encoded":
+            yield sse_event("tool_encoded", event["data"])
+    yield sse_event("done", {})
+
+async def save_upload_file(upload_file: UploadFile, sessionId: UUID) -> str:
+    """流式保存上传的文件并返回文件路径（相同内容在磁盘上只保存一份）"""
     try:
-        # 将 sessionId 转换为字符串
-        session_id_str = str(sessionId)
-        sesion_upload_dir = upload_dir / session_id_str
-
-        # 确保目录存在
-        sesion_upload_dir.mkdir(parents=True, exist_ok=True)
-
-        file_path = sesion_upload_dir / upload_file.filename
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
-        return str(file_path)
+        stored = await upload_store.save(upload_file, upload_dir / str(sessionId))
+        return stored.path
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("保存上传文件失败")
         raise e  # 重新抛出异常以便调用方处理
-    finally:
-        upload_file.file.close()
 
 # 启动事件循环
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Sequence
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool
+
+logger = logging.getLogger(__name__)
+
+# 单步内同时执行的工具调用数上限，以及单个工具的超时时间
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TOOL_TIMEOUT_SECONDS = 120
+_POLL_SECONDS = 0.5
+
+
+def _error_message(tool_call: Dict, error_type: str, message: str) -> ToolMessage:
+    return ToolMessage(
+        content=json.dumps({"error": {"type": error_type, "message": message}}, ensure_ascii=False),
+        tool_call_id=tool_call["id"],
+        name=tool_call["name"],
+        status="error"
+    )
+
+
+def _as_tool_message(tool_call: Dict, result) -> ToolMessage:
+    if isinstance(result, ToolMessage):
+        return result
+    return ToolMessage(content=str(result), tool_call_id=tool_call["id"], name=tool_call["name"])
+
+
+class ConcurrentToolExecutor:
+    """并发执行一条AI消息中的多个tool_calls
+
+    - 调用并发发出（不同MCP服务走各自的会话，同一会话内按请求ID复用）
+    - 信号量限制单步并发数，每个工具单独超时
+    - 结果按原始tool_calls顺序返回
+    """
+
+    def __init__(self, tools: Sequence[BaseTool],
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 timeout_seconds: float = DEFAULT_TOOL_TIMEOUT_SECONDS):
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+
+    async def run_tool_calls(self, tool_calls: List[Dict]) -> List[ToolMessage]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_one(tool_call: Dict) -> ToolMessage:
+            tool = self.tools_by_name.get(tool_call["name"])
+            if tool is None:
+                return _error_message(tool_call, "UNKNOWN_TOOL", f"未知工具: {tool_call['name']}")
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(
+                        tool.ainvoke({**tool_call, "type": "tool_call"}),
+                        timeout=self.timeout_seconds
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"工具 {tool_call['name']} 超时({self.timeout_seconds}s)")
+                    return _error_message(tool_call, "TIMEOUT", f"工具执行超过 {self.timeout_seconds} 秒")
+                except Exception as e:
+                    logger.exception(f"工具 {tool_call['name']} 执行失败")
+                    return _error_message(tool_call, type(e).__name__, str(e))
+            return _as_tool_message(tool_call, result)
+
+        # gather按输入顺序返回结果，与tool_calls顺序一致
+        return list(await asyncio.gather(*(run_one(tool_call) for tool_call in tool_calls)))
+
+    async def __call__(self, state) -> dict:
+        """作为LangGraph节点使用：执行最后一条AI消息中的全部工具调用"""
+        tool_calls = state["messages"][-1].tool_calls
+        return {"messages": await self.run_tool_calls(tool_calls)}
+
+
+def run_tool_calls_threaded(tools: Sequence[BaseTool], tool_calls: List[Dict],
+                            max_workers: int = DEFAULT_MAX_CONCURRENCY,
+                            timeout_seconds: float = DEFAULT_TOOL_TIMEOUT_SECONDS) -> List[ToolMessage]:
+    """同步版本：在线程池中并发执行工具调用，结果按原始顺序返回
+
+    线程无法被强制终止，超时的调用会在后台继续运行直至结束，但不再等待其结果。
+    与异步版本一致，超时从每个调用实际开始执行时算起，与等待结果的先后顺序无关；
+    调用数超过线程数时，排队的调用最晚须在 提交时间 + 轮数 × 超时 之前开始，
+    否则（例如线程都被超时的调用占住）直接按超时返回。
+    """
+    tools_by_name = {tool.name: tool for tool in tools}
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool-call")
+    started_at = {}
+
+    def invoke(index: int, tool: BaseTool, args: Dict):
+        started_at[index] = time.monotonic()
+        return tool.invoke(args)
+
+    def wait(index: int, future, start_deadline: float):
+        while True:
+            begin = started_at.get(index)
+            if begin is None:
+                if time.monotonic() >= start_deadline and future.cancel():
+                    raise FutureTimeoutError()
+                remaining = _POLL_SECONDS
+            else:
+                remaining = max(begin + timeout_seconds - time.monotonic(), 0)
+            try:
+                return future.result(timeout=remaining)
+            except FutureTimeoutError:
+                if begin is not None:
+                    raise
+
+    try:
+        submitted = time.monotonic()
+        futures = []
+        for index, tool_call in enumerate(tool_calls):
+            tool = tools_by_name.get(tool_call["name"])
+            futures.append(executor.submit(invoke, index, tool, tool_call["args"]) if tool else None)
+        rounds = math.ceil(sum(future is not None for future in futures) / max_workers)
+        start_deadline = submitted + timeout_seconds * max(rounds - 1, 0)
+
+        messages = []
+        for index, (tool_call, future) in enumerate(zip(tool_calls, futures)):
+            if future is None:
+                messages.append(_error_message(tool_call, "UNKNOWN_TOOL", f"未知工具: {tool_call['name']}"))
+                continue
+            try:
+                result = wait(index, future, start_deadline)
+                messages.append(_as_tool_message(tool_call, result))
+            except FutureTimeoutError:
+                messages.append(_error_message(tool_call, "TIMEOUT", f"工具执行超过 {timeout_seconds} 秒"))
+            except Exception as e:
+                messages.append(_error_message(tool_call, type(e).__name__, str(e)))
+        return messages
+    finally:
+        executor.shutdown(wait=False)
@@ -0,0 +1,173 @@
+import asyncio
+import importlib
+import logging
+from typing import Dict, List
+
+from langchain_core.tools import BaseTool, StructuredTool
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+
+logger = logging.getLogger(__name__)
+
+# MCP服务配置
+# trusted=True 且提供 module 的服务直接在本进程内挂载，省去JSON-RPC编码、管道读写和进程调度；
+# 其余服务（不可信或负载重的，如执行任意pandas代码的服务）仍通过 stdio / HTTP 子进程调用
+MCP_SERVERS = {
+    "math": {
+        "module": "mcptools.tools.math_server",
+        "trusted": True,
+        "command": "python",
+        "args": ["./mcptools/tools/math_server.py"],
+        "transport": "stdio",
+    },
+    "pandas": {
+        "trusted": False,
+        "command": "python",
+        "args": ["./mcptools/tools/pandasMcp.py"],
+        "transport": "stdio",
+    }
+}
+
+# 仅供注册表使用、不属于MCP连接参数的配置项
+_REGISTRY_KEYS = ("module", "trusted")
+
+
+def _content_to_text(result) -> str:
+    # 新版FastMCP.call_tool返回 (content, structured_output)，旧版只返回content列表
+    if isinstance(result, tuple):
+        result = result[0]
+    return "\n".join(block.text for block in result if getattr(block, "text", None) is not None)
+
+
+def _make_coroutine(server, tool_name: str):
+    async def call(**arguments):
+        return _content_to_text(await server.call_tool(tool_name, arguments))
+    return call
+
+
+async def mount_in_process(module_name: str) -> List[BaseTool]:
+    """导入MCP服务模块，把其中的FastMCP工具包装为直接调用的异步工具
+
+    工具名、描述和参数schema都取自服务本身，与经由子进程加载的工具完全一致。
+    """
+    server = importlib.import_module(module_name).mcp
+    tools = []
+    for tool in await server.list_tools():
+        tools.append(StructuredTool(
+            name=tool.name,
+            description=tool.description or "",
+            args_schema=tool.inputSchema,
+            coroutine=_make_coroutine(server, tool.name),
+            response_format="content"
+        ))
+    return tools
+
+
+class _RemoteSession:
+    """在独立后台任务中持有一个远程MCP服务的长连接会话
+
+    stdio会话内部使用anyio任务组，进入和退出必须在同一个任务中完成，
+    因此由专门的任务打开会话并一直等待，直到close()通知它退出。
+    """
+
+    def __init__(self, name: str, connection: dict):
+        self.name = name
+        self.connection = connection
+        self.tools: List[BaseTool] = []
+        self._ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            client = MultiServerMCPClient({self.name: self.connection})
+            async with client.session(self.name) as session:
+                self.tools = await load_mcp_tools(session)
+                self._ready.set_result(None)
+                await self._closing.wait()
+        except BaseException as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            elif not isinstance(e, asyncio.CancelledError):
+                logger.exception(f"MCP服务 {self.name} 会话异常退出")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+    async def wait_ready(self):
+        await asyncio.shield(self._ready)
+
+    @property
+    def alive(self) -> bool:
+        return not self._task.done()
+
+    async def close(self):
+        self._closing.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=10)
+        except Exception:
+            self._task.cancel()
+
+
+class ToolRegistry:
+    """按服务配置选择进程内挂载或子进程/HTTP传输，统一返回LangChain工具列表
+
+    远程服务的会话在应用生命周期内保持打开，各请求共享同一个服务进程，
+    服务内的结果缓存和沙箱进程池因此能跨请求复用；close()在应用关闭时调用。
+    """
+
+    def __init__(self, servers: Dict[str, dict] = None):
+        self.servers = servers if servers is not None else MCP_SERVERS
+        # 进程内工具只需挂载一次
+        self._mounted: Dict[str, List[BaseTool]] = {}
+        self._sessions: Dict[str, _RemoteSession] = {}
+        self._lock = None
+
+    def is_in_process(self, name: str) -> bool:
+        config = self.servers[name]
+        return bool(config.get("trusted") and config.get("module"))
+
+    async def _remote_tools(self, name: str) -> List[BaseTool]:
+        """返回远程服务的工具；会话尚未建立或服务进程已退出时重新连接"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            session = self._sessions.get(name)
+            if session is None or not session.alive:
+                connection = {k: v for k, v in self.servers[name].items() if k not in _REGISTRY_KEYS}
+                session = _RemoteSession(name, connection)
+                self._sessions[name] = session
+        try:
+            await session.wait_ready()
+        except Exception:
+            if self._sessions.get(name) is session:
+                del self._sessions[name]
+            raise
+        return session.tools
+
+    async def load_tools(self) -> List[BaseTool]:
+        """加载全部工具；远程服务复用应用级长连接会话"""
+        tools = []
+        for name, config in self.servers.items():
+            if self.is_in_process(name):
+                if name not in self._mounted:
+                    self._mounted[name] = await mount_in_process(config["module"])
+                    logger.info(f"MCP服务 {name} 已在进程内挂载: {[t.name for t in self._mounted[name]]}")
+                tools.extend(self._mounted[name])
+            else:
+                tools.extend(await self._remote_tools(name))
+        return tools
+
+    async def start(self):
+        """应用启动时预先连接全部远程服务，让服务进程及其沙箱工作进程提前就绪"""
+        for name in self.servers:
+            if not self.is_in_process(name):
+                await self._remote_tools(name)
+
+    async def close(self):
+        """关闭全部远程会话（随之结束stdio服务子进程）"""
+        sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            await session.close()
+
+
+tool_registry = ToolRegistry()
@@ -0,0 +1,113 @@
+"""Benchmark: repeated read_csv versus the Parquet copy made at upload time.
+
+Each loader runs in a fresh subprocess so peak RSS is measured in isolation.
+
+Usage:
+    python mcptools/tools/benchmarkColumnar.py --rows 1000000 --repeat 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+LOADERS = ["csv_full", "parquet_full", "parquet_two_columns"]
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def make_csv(path: str, rows: int):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "order_id": np.arange(rows),
+        "region": rng.choice(["north", "south", "east", "west"], rows),
+        "product": rng.choice([f"sku_{i}" for i in range(500)], rows),
+        "quantity": rng.integers(1, 100, rows),
+        "price": rng.random(rows) * 1000,
+        "order_date": pd.date_range("2020-01-01", periods=rows, freq="min").strftime("%Y-%m-%d %H:%M"),
+    })
+    df.to_csv(path, index=False)
+
+
+def run_worker(loader: str, path: str, repeat: int):
+    import pandas as pd
+    from mcptools.tools.columnarStore import load_frame
+
+    baseline = _peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        if loader == "csv_full":
+            df = pd.read_csv(path)
+        elif loader == "parquet_full":
+            df = load_frame(path)
+        else:
+            df = load_frame(path, columns=["region", "price"])
+        timings.append(time.perf_counter() - started)
+        del df
+
+    peak = _peak_rss_mb()
+    print(json.dumps({
+        "loader": loader,
+        "mean_seconds": sum(timings) / len(timings),
+        "min_seconds": min(timings),
+        "peak_rss_mb": peak,
+        "load_rss_mb": None if peak is None else peak - baseline
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--worker", choices=LOADERS, help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.path, args.repeat)
+        return
+
+    from mcptools.tools.columnarStore import convert_to_parquet
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.csv")
+        make_csv(path, args.rows)
+        print(f"CSV: {args.rows} rows, {os.path.getsize(path) / 1024 / 1024:.1f}MB")
+
+        started = time.perf_counter()
+        manifest = convert_to_parquet(path)
+        if manifest is None:
+            sys.exit("Parquet conversion failed")
+        print(f"One-off conversion: {time.perf_counter() - started:.2f}s, "
+              f"Parquet {os.path.getsize(path + '.parquet') / 1024 / 1024:.1f}MB")
+
+        print(f"{'loader':<22}{'mean s':>10}{'min s':>10}{'peak RSS MB':>14}{'load RSS MB':>14}")
+        for loader in LOADERS:
+            output = subprocess.run(
+                [sys.executable, __file__, "--worker", loader, "--path", path, "--repeat", str(args.repeat)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            peak = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.0f}"
+            delta = "n/a" if result["load_rss_mb"] is None else f"{result['load_rss_mb']:.0f}"
+            print(f"{loader:<22}{result['mean_seconds']:>10.3f}{result['min_seconds']:>10.3f}{peak:>14}{delta:>14}")
+
+
+if __name__ == "__main__":
+    main()
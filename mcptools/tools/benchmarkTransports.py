@@ -0,0 +1,121 @@
+"""Benchmark: per-call overhead of the math tools over each transport.
+
+- in_process: FastMCP tools mounted by the tool registry, called directly
+- stdio: a math_server.py subprocess, one session reused for all calls
+- http: math_server served over streamable HTTP on localhost
+
+Setup (import, process start, session handshake) is reported separately
+from the steady-state cost of one ``add`` call.
+
+Usage:
+    python mcptools/tools/benchmarkTransports.py --calls 500
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import AsyncExitStack
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, ROOT)
+
+TRANSPORTS = ["in_process", "stdio", "http"]
+HTTP_SERVER_CODE = (
+    "from mcptools.tools.math_server import mcp; "
+    "mcp.settings.port = {port}; mcp.settings.log_level = 'WARNING'; "
+    "mcp.run(transport='streamable-http')"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"HTTP server did not start on port {port}")
+
+
+async def _load_tools(transport: str, stack: AsyncExitStack):
+    from langchain_mcp_adapters.client import MultiServerMCPClient
+    from langchain_mcp_adapters.tools import load_mcp_tools
+    from mcptools.toolRegistry import MCP_SERVERS, mount_in_process
+
+    math_config = MCP_SERVERS["math"]
+    if transport == "in_process":
+        return await mount_in_process(math_config["module"])
+
+    if transport == "stdio":
+        connection = {
+            "command": sys.executable,
+            "args": [os.path.join(ROOT, "mcptools", "tools", "math_server.py")],
+            "transport": "stdio",
+        }
+    else:
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-c", HTTP_SERVER_CODE.format(port=port)],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        stack.callback(server.wait)
+        stack.callback(server.terminate)
+        _wait_for_port(port)
+        connection = {"url": f"http://127.0.0.1:{port}/mcp", "transport": "streamable_http"}
+
+    client = MultiServerMCPClient({"math": connection})
+    session = await stack.enter_async_context(client.session("math"))
+    return await load_mcp_tools(session)
+
+
+async def bench(transport: str, calls: int) -> dict:
+    async with AsyncExitStack() as stack:
+        started = time.perf_counter()
+        tools = await _load_tools(transport, stack)
+        setup = time.perf_counter() - started
+        add = next(tool for tool in tools if tool.name == "add")
+
+        # Warm up, and check every transport returns the same result
+        assert str(await add.ainvoke({"a": 2, "b": 3})).strip() == "5"
+
+        timings = []
+        for i in range(calls):
+            call_started = time.perf_counter()
+            await add.ainvoke({"a": i, "b": 1})
+            timings.append(time.perf_counter() - call_started)
+
+    timings.sort()
+    return {
+        "transport": transport,
+        "setup_ms": setup * 1000,
+        "mean_us": sum(timings) / len(timings) * 1e6,
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p99_us": timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--transports", nargs="+", choices=TRANSPORTS, default=TRANSPORTS)
+    args = parser.parse_args()
+
+    print(f"{'transport':<14}{'setup ms':>12}{'mean us':>12}{'p50 us':>12}{'p99 us':>12}")
+    for transport in args.transports:
+        result = asyncio.run(bench(transport, args.calls))
+        print(f"{transport:<14}{result['setup_ms']:>12.1f}{result['mean_us']:>12.0f}"
+              f"{result['p50_us']:>12.0f}{result['p99_us']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
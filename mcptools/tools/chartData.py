@@ -0,0 +1,127 @@
+"""Server-side reduction of chart data before it is written into HTML.
+
+Chart.js renders every point it is given, so a 200k-point series makes a
+huge file the browser can barely draw. Line data is downsampled to a point
+budget, keeping the shape of the curve:
+
+- one series: Largest-Triangle-Three-Buckets (LTTB) keeps, per bucket, the
+  point that forms the largest triangle with its neighbours
+- several series sharing the x labels: min/max buckets keep the extreme
+  points of every series, so the rendered labels stay aligned
+
+Bar and pie data keep the N largest categories and merge the long tail into
+one "Others" bucket.
+"""
+import warnings
+
+import numpy as np
+
+DEFAULT_MAX_POINTS = 2000
+DEFAULT_TOP_N = 20
+OTHERS_LABEL = "Others"
+
+
+def _as_float_array(values):
+    """Float array of ``values`` (None becomes NaN), or None if not 1-D numeric."""
+    try:
+        array = np.asarray([np.nan if v is None else v for v in values], dtype=float)
+    except (TypeError, ValueError):
+        return None
+    return array if array.ndim == 1 else None
+
+
+def lttb_indices(y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the points LTTB keeps when reducing ``y`` to ``threshold`` points."""
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=float)
+    every = (n - 2) / (threshold - 2)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN buckets
+        for i in range(threshold - 2):
+            start = int(i * every) + 1
+            end = int((i + 1) * every) + 1
+            next_end = min(int((i + 2) * every) + 1, n)
+            avg_x = x[end:next_end].mean()
+            avg_y = np.nanmean(y[end:next_end])
+
+            area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+            a = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+            selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(series: list, max_points: int) -> np.ndarray:
+    """Indices keeping the min and max of every series in each bucket."""
+    n = len(series[0])
+    if n <= max_points:
+        return np.arange(n)
+
+    buckets = max(max_points // (2 * len(series)), 1)
+    edges = np.linspace(0, n, buckets + 1, dtype=int)
+    keep = {0, n - 1}
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end <= start:
+            continue
+        for y in series:
+            bucket = y[start:end]
+            if np.isnan(bucket).all():
+                continue
+            keep.add(start + int(np.nanargmin(bucket)))
+            keep.add(start + int(np.nanargmax(bucket)))
+    return np.array(sorted(keep))
+
+
+def downsample_line(labels: list, datasets: list, max_points: int = DEFAULT_MAX_POINTS) -> tuple:
+    """Reduce line chart data to about ``max_points`` x positions.
+
+    Returns ``(labels, datasets, info)``; info has the original and rendered
+    point counts and the method used. Datasets whose values are not plain
+    numbers are passed through unchanged.
+    """
+    original = len(labels)
+    info = {"original_points": original, "rendered_points": original, "downsampling": "none"}
+    if original <= max_points or not datasets:
+        return labels, datasets, info
+
+    series = [_as_float_array(d["data"]) for d in datasets]
+    if any(y is None for y in series):
+        return labels, datasets, info
+
+    if len(series) == 1:
+        indices = lttb_indices(series[0], max_points)
+        info["downsampling"] = "lttb"
+    else:
+        indices = minmax_indices(series, max_points)
+        info["downsampling"] = "minmax"
+
+    labels = [labels[i] for i in indices]
+    datasets = [{**d, "data": [d["data"][i] for i in indices]} for d in datasets]
+    info["rendered_points"] = len(labels)
+    return labels, datasets, info
+
+
+def top_n(labels: list, values: list, n: int = DEFAULT_TOP_N, others_label: str = OTHERS_LABEL) -> tuple:
+    """Keep the ``n`` largest categories and sum the rest into ``others_label``.
+
+    Returns ``(labels, values, info)`` with the original and rendered counts.
+    """
+    original = len(labels)
+    info = {"original_points": original, "rendered_points": original, "collapsed": 0}
+    numeric = _as_float_array(values)
+    if original <= n or numeric is None:
+        return labels, values, info
+
+    order = np.argsort(-np.nan_to_num(numeric, nan=-np.inf), kind="stable")
+    kept, rest = order[:n], order[n:]
+    others = float(np.nansum(numeric[rest]))
+
+    labels = [labels[i] for i in kept] + [others_label]
+    values = [values[i] for i in kept] + [int(others) if others.is_integer() else others]
+    info.update({"rendered_points": len(labels), "collapsed": len(rest)})
+    return labels, values, info
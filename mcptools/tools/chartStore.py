@@ -0,0 +1,114 @@
+"""Compiled chart templates and a content-addressed chart store.
+
+Templates are read and compiled once per process: the sample literals the
+chart tools used to ``str.replace`` one by one are turned into slots, so
+rendering is a single join.
+
+Rendered charts are stored as ``charts/<sha256>.html``. Identical charts map
+to the same file and are written once; charts not regenerated within the TTL
+are garbage-collected. The app serves them at ``/charts/<chart_id>`` with the
+hash as a strong ETag, so browsers download each chart only once.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+CHARTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "charts")
+CHART_TTL_SECONDS = 7 * 24 * 3600
+GC_INTERVAL_SECONDS = 3600
+CHART_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+_templates = {}
+_templates_lock = threading.Lock()
+_last_gc = 0.0
+
+
+class ChartTemplate:
+    """A template split at its sample literals, rendered by one join."""
+
+    def __init__(self, text: str, slots: dict):
+        # slots maps each literal in the template to the slot name replacing it
+        pattern = "|".join(re.escape(literal) for literal in sorted(slots, key=len, reverse=True))
+        pieces = re.split(f"({pattern})", text)
+        # Even positions are fixed text, odd positions the matched literals
+        self._parts = [(piece, None) if i % 2 == 0 else (None, slots[piece]) for i, piece in enumerate(pieces)]
+        self.missing = sorted(set(slots.values()) - {slot for _, slot in self._parts if slot})
+
+    def render(self, **values) -> str:
+        """Fill every slot; slots without a value render as empty strings."""
+        return "".join(text if slot is None else values.get(slot, "") for text, slot in self._parts)
+
+
+def load_template(filename: str, slots: dict) -> ChartTemplate:
+    """Read and compile ``templates/<filename>`` on first use, then reuse it."""
+    with _templates_lock:
+        template = _templates.get(filename)
+        if template is None:
+            with open(os.path.join(TEMPLATES_DIR, filename), 'r', encoding='utf-8') as f:
+                template = ChartTemplate(f.read(), slots)
+            if template.missing:
+                logger.warning(f"Template {filename} has no placeholder for slots {template.missing}")
+            _templates[filename] = template
+    return template
+
+
+def chart_path(chart_id: str) -> str:
+    return os.path.join(CHARTS_DIR, f"{chart_id}.html")
+
+
+def store_chart(html: str) -> str:
+    """Store ``html`` under its content hash and return the chart id.
+
+    An existing identical chart is not rewritten; its mtime is refreshed so
+    the TTL counts from the last time it was generated.
+    """
+    data = html.encode('utf-8')
+    chart_id = hashlib.sha256(data).hexdigest()
+    path = chart_path(chart_id)
+    os.makedirs(CHARTS_DIR, exist_ok=True)
+
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        fd, tmp_path = tempfile.mkstemp(dir=CHARTS_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    if time.time() - _last_gc > GC_INTERVAL_SECONDS:
+        collect_garbage()
+    return chart_id
+
+
+def collect_garbage(ttl_seconds: float = CHART_TTL_SECONDS) -> int:
+    """Delete charts (and stray temp files) older than ``ttl_seconds``."""
+    global _last_gc
+    _last_gc = time.time()
+    cutoff = _last_gc - ttl_seconds
+    removed = 0
+    try:
+        entries = list(os.scandir(CHARTS_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue  # deleted concurrently or not permitted
+    if removed:
+        logger.info(f"Removed {removed} expired charts")
+    return removed
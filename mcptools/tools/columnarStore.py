@@ -0,0 +1,269 @@
+"""Columnar cache for uploaded CSV files.
+
+An uploaded CSV is parsed once and written as Parquet next to the original
+(``data.csv`` -> ``data.csv.parquet``) together with a sidecar manifest
+(``data.csv.manifest.json``) holding the detected encoding, delimiter, dtypes
+and row count. Tools load from the Parquet copy while the manifest still
+matches the source file and fall back to ``read_csv`` otherwise.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import duckdb
+import pandas as pd
+import pyarrow.parquet as pq
+import xxhash
+from chardet import detect
+
+logger = logging.getLogger(__name__)
+
+PARQUET_SUFFIX = ".parquet"
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+SNIFF_BYTES = 50000
+HASH_BLOCK_BYTES = 1024 * 1024
+# Above this size the CSV is converted by DuckDB, streaming, instead of pandas
+STREAMING_CONVERT_BYTES = 100 * 1024 * 1024
+
+TRANSCODE_BLOCK_CHARS = 1024 * 1024
+
+# chardet names -> DuckDB read_csv encodings (utf-8 is DuckDB's default).
+# read_csv supports nothing else: other encodings (GBK, GB2312, Big5, ...)
+# are transcoded to UTF-8 for conversion and rejected for direct queries.
+DUCKDB_ENCODINGS = {
+    "ascii": None,
+    "utf-8": None,
+    "utf-8-sig": None,
+    "utf-16": "utf-16",
+    "iso-8859-1": "latin-1",
+    "windows-1252": "latin-1",
+}
+
+
+class UnsupportedEncoding(ValueError):
+    """The CSV's encoding cannot be read by DuckDB's read_csv."""
+
+
+def parquet_path(file_path: str) -> str:
+    return file_path + PARQUET_SUFFIX
+
+
+def manifest_path(file_path: str) -> str:
+    return file_path + MANIFEST_SUFFIX
+
+
+def _source_signature(file_path: str) -> dict:
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def file_fingerprint(file_path: str) -> str:
+    """Content hash of a file, recomputed only when its size or mtime change."""
+    signature = _source_signature(file_path)
+    key = (os.path.abspath(file_path), signature["size"], signature["mtime_ns"])
+    with _fingerprints_lock:
+        cached = _fingerprints.get(key)
+    if cached:
+        return cached
+
+    digest = xxhash.xxh3_128()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    fingerprint = digest.hexdigest()
+    with _fingerprints_lock:
+        if len(_fingerprints) >= 1024:
+            _fingerprints.clear()
+        _fingerprints[key] = fingerprint
+    return fingerprint
+
+
+def detect_csv_format(file_path: str) -> tuple:
+    """Detect encoding and delimiter from a single read of the file head."""
+    with open(file_path, 'rb') as f:
+        rawdata = f.read(SNIFF_BYTES)
+    enc = detect(rawdata)['encoding'] or 'utf-8'
+    first_line = rawdata.decode(enc, errors='replace').split('\n', 1)[0]
+    delimiter = ',' if ',' in first_line else '\t' if '\t' in first_line else ';'
+    return enc, delimiter
+
+
+def read_manifest(file_path: str):
+    """Return the manifest if the Parquet copy is current, else None."""
+    try:
+        with open(manifest_path(file_path), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    if not os.path.exists(parquet_path(file_path)):
+        return None
+    try:
+        signature = _source_signature(file_path)
+    except OSError:
+        return None
+    if manifest.get("size") != signature["size"] or manifest.get("mtime_ns") != signature["mtime_ns"]:
+        return None
+    return manifest
+
+
+def get_csv_format(file_path: str) -> tuple:
+    """Return (encoding, delimiter), preferring the manifest over sniffing."""
+    manifest = read_manifest(file_path)
+    if manifest:
+        return manifest["encoding"], manifest["delimiter"]
+    return detect_csv_format(file_path)
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _read_csv_expr(file_path: str, enc: str, delimiter: str) -> str:
+    if enc.lower() not in DUCKDB_ENCODINGS:
+        raise UnsupportedEncoding(f"DuckDB cannot read {enc}-encoded CSV files")
+    options = [f"delim={_sql_literal(delimiter)}", "header=true"]
+    duck_enc = DUCKDB_ENCODINGS[enc.lower()]
+    if duck_enc:
+        options.append(f"encoding={_sql_literal(duck_enc)}")
+    return f"read_csv({_sql_literal(file_path)}, {', '.join(options)})"
+
+
+def duckdb_source(file_path: str) -> str:
+    """Return a DuckDB table expression reading the file without pandas.
+
+    Raises ``UnsupportedEncoding`` for a CSV in an encoding DuckDB cannot
+    read and no Parquet copy yet.
+    """
+    if read_manifest(file_path):
+        return f"read_parquet({_sql_literal(parquet_path(file_path))})"
+
+    enc, delimiter = detect_csv_format(file_path)
+    return _read_csv_expr(file_path, enc, delimiter)
+
+
+def restrict_to_file(con, file_path: str):
+    """Allow ``con`` to read only ``file_path`` and its Parquet copy.
+
+    Disables every other file and network access and locks the configuration,
+    so SQL run on the connection afterwards cannot turn it back on. Needs
+    DuckDB 1.2+ for ``allowed_paths``.
+    """
+    paths = dict.fromkeys([file_path, parquet_path(file_path),
+                           os.path.abspath(file_path), os.path.abspath(parquet_path(file_path))])
+    con.execute(f"SET allowed_paths = [{', '.join(_sql_literal(path) for path in paths)}]")
+    con.execute("SET enable_external_access = false")
+    con.execute("SET lock_configuration = true")
+
+
+def _transcode_to_utf8(file_path: str, enc: str, target: str):
+    """Stream ``file_path`` into a UTF-8 copy, one block in memory at a time."""
+    with open(file_path, 'r', encoding=enc, newline='') as src, \
+            open(target, 'w', encoding='utf-8', newline='') as dst:
+        shutil.copyfileobj(src, dst, TRANSCODE_BLOCK_CHARS)
+
+
+def _convert_streaming(file_path: str, enc: str, delimiter: str, target: str) -> dict:
+    """Convert with DuckDB COPY so files larger than memory never hit pandas.
+
+    Encodings DuckDB cannot read are first transcoded to a temporary UTF-8
+    copy, which is removed afterwards.
+    """
+    source = file_path
+    if enc.lower() not in DUCKDB_ENCODINGS:
+        source = target + ".utf8"
+        _transcode_to_utf8(file_path, enc, source)
+        enc = "utf-8"
+    try:
+        with duckdb.connect() as con:
+            con.execute(f"COPY (SELECT * FROM {_read_csv_expr(source, enc, delimiter)}) "
+                        f"TO {_sql_literal(target)} (FORMAT parquet)")
+    finally:
+        if source != file_path:
+            os.remove(source)
+    parquet_file = pq.ParquetFile(target)
+    schema = parquet_file.schema_arrow
+    return {
+        "rows": parquet_file.metadata.num_rows,
+        "columns": list(schema.names),
+        "dtypes": {field.name: str(field.type) for field in schema}
+    }
+
+
+def convert_to_parquet(file_path: str):
+    """Parse the CSV once and write the Parquet copy plus its manifest.
+
+    Meant to run as a background task after upload, so failures are logged
+    and reported as None instead of raised; readers then keep using the CSV.
+    """
+    try:
+        signature = _source_signature(file_path)
+        enc, delimiter = detect_csv_format(file_path)
+
+        started = time.perf_counter()
+        target = parquet_path(file_path)
+        tmp_target = target + ".tmp"
+        if signature["size"] > STREAMING_CONVERT_BYTES:
+            table_info = _convert_streaming(file_path, enc, delimiter, tmp_target)
+        else:
+            df = pd.read_csv(file_path, encoding=enc, delimiter=delimiter)
+            df.to_parquet(tmp_target, index=False)
+            table_info = {
+                "rows": len(df),
+                "columns": [str(col) for col in df.columns],
+                "dtypes": {str(col): str(dtype) for col, dtype in df.dtypes.items()}
+            }
+        os.replace(tmp_target, target)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "source": os.path.basename(file_path),
+            **signature,
+            "encoding": enc,
+            "delimiter": delimiter,
+            **table_info,
+            "parquet": os.path.basename(target),
+            "convert_seconds": round(time.perf_counter() - started, 3)
+        }
+        tmp_manifest = manifest_path(file_path) + ".tmp"
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_manifest, manifest_path(file_path))
+
+        logger.info(f"Converted {file_path} to Parquet: {manifest['rows']} rows in {manifest['convert_seconds']}s")
+        return manifest
+    except Exception:
+        logger.exception(f"Parquet conversion failed for {file_path}")
+        return None
+
+
+def load_frame(file_path: str, columns: list = None, nrows: int = None) -> pd.DataFrame:
+    """Load a CSV as a DataFrame, reading only the requested columns/rows.
+
+    Uses the memory-mapped Parquet copy when it is current, otherwise parses
+    the CSV with the detected encoding and delimiter.
+    """
+    if read_manifest(file_path):
+        target = parquet_path(file_path)
+        if nrows is None:
+            return pd.read_parquet(target, columns=columns, memory_map=True)
+
+        parquet_file = pq.ParquetFile(target, memory_map=True)
+        batch = next(parquet_file.iter_batches(batch_size=nrows, columns=columns), None)
+        if batch is None:
+            empty = parquet_file.schema_arrow.empty_table()
+            return (empty.select(columns) if columns else empty).to_pandas()
+        return batch.to_pandas()
+
+    enc, delimiter = detect_csv_format(file_path)
+    return pd.read_csv(file_path, encoding=enc, delimiter=delimiter, usecols=columns, nrows=nrows)
@@ -0,0 +1,309 @@
+"""Vectorized column profiling for read_metadata.
+
+All column statistics come from a handful of frame-wide operations
+(``isna().sum()``, ``nunique()``, one ``agg`` over the numeric block and a
+single ``duplicated()``) computed once and shared by the per-column report,
+the dataset summary and the quality warnings. Profiles are cached by file
+content hash, so repeated read_metadata calls on the same upload are free.
+
+For files larger than the sample budget the row count comes from the upload
+manifest (exact) or a newline scan over a memory map (estimated: quoted
+fields may contain newlines), while column statistics come from rows sampled
+at even byte strides across the whole file, so sorted exports are not judged
+by their first rows alone. Files whose quoted fields span lines fall back
+to the first rows, because byte offsets there do not fall on record
+boundaries and pandas would silently parse record fragments as rows.
+"""
+import io
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+from mcptools.tools.columnarStore import get_csv_format, load_frame, file_fingerprint, read_manifest
+
+PROFILE_MODES = ("fast", "full")
+FAST_SAMPLE_ROWS = 10000
+SAMPLE_VALUES = 2
+MAX_LISTED_DUPLICATES = 20
+PROFILE_CACHE_SIZE = 32
+COUNT_BLOCK_BYTES = 16 * 1024 * 1024
+QUOTE_PROBE_BYTES = 1024 * 1024
+QUOTECHAR = b'"'
+
+_profile_cache = OrderedDict()
+_profile_cache_lock = threading.Lock()
+
+
+def _py(value):
+    """Convert numpy scalars to plain Python values for JSON transport."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _is_utf16(enc: str) -> bool:
+    # Newline bytes are ambiguous in UTF-16, so byte-level scans do not apply
+    return enc.lower().replace("_", "-").startswith("utf-16")
+
+
+def count_rows(file_path: str, enc: str) -> int:
+    """Number of data rows (header excluded) from a newline scan.
+
+    The file is memory-mapped and scanned in fixed-size blocks, so memory
+    stays bounded. Quoted fields containing newlines are counted as extra
+    rows, so this is an upper bound; the Parquet manifest is authoritative
+    when it exists.
+    """
+    if _is_utf16(enc):
+        with open(file_path, 'r', encoding=enc) as f:
+            return max(sum(1 for _ in f) - 1, 0)
+
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return 0
+    newlines = 0
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start in range(0, size, COUNT_BLOCK_BYTES):
+            newlines += mm[start:start + COUNT_BLOCK_BYTES].count(b'\n')
+        ends_with_newline = mm[size - 1:size] == b'\n'
+    lines = newlines if ends_with_newline else newlines + 1
+    return max(lines - 1, 0)
+
+
+def has_multiline_records(file_path: str) -> bool:
+    """True when a quoted field in the first ``QUOTE_PROBE_BYTES`` spans lines.
+
+    Splitting on the quote character leaves the quoted text in the odd
+    segments (an escaped ``""`` just adds an empty one), so a newline in any
+    of them is a newline inside a field. Only valid for encodings where the
+    quote and newline bytes cannot occur inside multi-byte characters.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(QUOTE_PROBE_BYTES)
+    return any(b'\n' in part for part in head.split(QUOTECHAR)[1::2])
+
+
+def sample_rows(file_path: str, enc: str, delimiter: str, n: int) -> pd.DataFrame:
+    """Read about ``n`` rows spread evenly across the file.
+
+    Seeks to ``n`` equally spaced byte offsets and takes the first complete
+    line after each, so cost is ``n`` short reads whatever the file size.
+    Raises ``pd.errors.ParserError`` when a sampled line has unbalanced
+    quotes, i.e. the offset landed inside a quoted field that spans lines
+    beyond the region checked by ``has_multiline_records``.
+    """
+    size = os.path.getsize(file_path)
+    lines = []
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        data_start = f.tell()
+        span = size - data_start
+        last_line_start = -1
+        for i in range(n):
+            offset = data_start + span * i // n
+            f.seek(offset)
+            if offset > data_start:
+                f.readline()  # skip the partial line we landed in
+            line_start = f.tell()
+            if line_start <= last_line_start or line_start >= size:
+                continue
+            line = f.readline()
+            if line.count(QUOTECHAR) % 2:
+                raise pd.errors.ParserError(f"Line at byte {line_start} is part of a multi-line quoted field")
+            last_line_start = line_start
+            lines.append(line if line.endswith(b'\n') else line + b'\n')
+
+    return pd.read_csv(io.BytesIO(header + b''.join(lines)), encoding=enc, delimiter=delimiter)
+
+
+def profile_frame(df: pd.DataFrame) -> dict:
+    """Profile every column of ``df`` in one vectorized pass."""
+    null_counts = df.isna().sum()
+    unique_counts = df.nunique(dropna=True)
+    duplicated = df.duplicated()
+    duplicate_count = int(duplicated.sum())
+
+    numeric_cols = df.select_dtypes(include="number", exclude="bool").columns
+    numeric_stats = df[numeric_cols].agg(["min", "max", "mean", "std"]) if len(numeric_cols) else None
+
+    # Non-null samples from the head only, so dropna never scans whole columns
+    head = df.head(1000)
+
+    columns_metadata = []
+    column_types = {}
+    for col in df.columns:
+        series = df[col]
+        nulls = int(null_counts[col])
+        uniques = int(unique_counts[col])
+        is_numeric = col in numeric_cols
+        column_types[col] = infer_dtype(series, skipna=True)
+
+        col_meta = {
+            "name": col,
+            "type": str(series.dtype),
+            "sample": [_py(v) for v in head[col].dropna().iloc[:SAMPLE_VALUES]],
+            "stats": {
+                "null_count": nulls,
+                "unique_count": uniques,
+                "is_numeric": is_numeric
+            },
+            "warnings": [],
+            "suggested_operations": []
+        }
+
+        if is_numeric:
+            stats = numeric_stats[col]
+            col_meta["stats"].update({key: _py(stats[key]) for key in ("min", "max", "mean", "std")})
+            col_meta["suggested_operations"].extend(["normalize", "scale", "log_transform"])
+            if max(abs(stats["min"]), abs(stats["max"])) > 1e6:
+                col_meta["warnings"].append("Large numeric values detected - consider scaling")
+        if pd.api.types.is_string_dtype(series):
+            col_meta["suggested_operations"].extend(["one_hot_encode", "label_encode", "text_processing"])
+        if pd.api.types.is_datetime64_any_dtype(series):
+            col_meta["suggested_operations"].extend(["extract_year", "extract_month", "time_delta"])
+
+        if nulls > 0:
+            col_meta["warnings"].append(f"{nulls} null values found")
+        if uniques == 1:
+            col_meta["warnings"].append("Column contains only one unique value")
+
+        columns_metadata.append(col_meta)
+
+    null_columns = [col for col in df.columns if null_counts[col] > 0]
+    single_value_columns = [col for col in df.columns if unique_counts[col] == 1]
+    total_nulls = int(null_counts.sum())
+
+    warnings = {
+        "message": "Data quality issues detected" if (
+            null_columns or duplicate_count or single_value_columns
+        ) else "No significant data quality issues found"
+    }
+    if null_columns:
+        warnings["null_columns"] = {"count": len(null_columns), "columns": null_columns}
+        warnings["total_nulls"] = total_nulls
+    if duplicate_count:
+        warnings["duplicate_rows"] = {
+            "count": duplicate_count,
+            "rows": df.index[duplicated][:MAX_LISTED_DUPLICATES].tolist()
+        }
+    if single_value_columns:
+        warnings["single_value_columns"] = {"count": len(single_value_columns), "columns": single_value_columns}
+
+    return {
+        "columns": columns_metadata,
+        "column_types": column_types,
+        "warnings": warnings
+    }
+
+
+def profile_file(file_path: str, mode: str = "fast") -> dict:
+    """Build the read_metadata report for a file, cached by content hash.
+
+    ``full`` profiles every row. ``fast`` profiles every row of small files
+    and a stride sample of FAST_SAMPLE_ROWS rows otherwise; the report's
+    ``accuracy`` section says which figures are exact and which estimated.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"mode must be one of {PROFILE_MODES}, got {mode!r}")
+
+    cache_key = (file_fingerprint(file_path), mode)
+    with _profile_cache_lock:
+        cached = _profile_cache.get(cache_key)
+        if cached is not None:
+            _profile_cache.move_to_end(cache_key)
+    if cached is not None:
+        return {**cached, "profile": {**cached["profile"], "cached": True}}
+
+    started = time.perf_counter()
+    file_size = os.path.getsize(file_path)
+    enc, delimiter = get_csv_format(file_path)
+
+    manifest = read_manifest(file_path) if mode == "fast" else None
+    total_rows = manifest["rows"] if manifest else None
+    if mode == "fast" and total_rows is None:
+        total_rows = count_rows(file_path, enc)
+
+    if mode == "full" or total_rows <= FAST_SAMPLE_ROWS:
+        df = load_frame(file_path)
+        total_rows = len(df)
+        sampling = "none"
+    elif _is_utf16(enc) or has_multiline_records(file_path):
+        df = load_frame(file_path, nrows=FAST_SAMPLE_ROWS)
+        sampling = "head"
+    else:
+        try:
+            df = sample_rows(file_path, enc, delimiter, FAST_SAMPLE_ROWS)
+            sampling = "stride"
+        except pd.errors.ParserError:
+            # Quoted fields span lines, so byte offsets do not fall on record boundaries
+            df = load_frame(file_path, nrows=FAST_SAMPLE_ROWS)
+            sampling = "head"
+
+    profile = profile_frame(df)
+    column_stats = "exact" if sampling == "none" else "estimated"
+    # Parsed rows or the manifest are exact; a newline count is not
+    row_count = "exact" if sampling == "none" or manifest else "estimated"
+
+    summary = {
+        "status": "SUCCESS",
+        "file_info": {
+            "size": f"{file_size / 1024:.1f}KB",
+            "encoding": enc,
+            "delimiter": delimiter
+        },
+        "dataset": {
+            "rows": total_rows,
+            "columns": len(df.columns),
+            "column_types": profile["column_types"]
+        },
+        "columns": profile["columns"],
+        "warnings": profile["warnings"],
+        "profile": {
+            "mode": mode,
+            "rows_profiled": len(df),
+            "sampling": sampling,
+            "accuracy": {
+                "rows": row_count,
+                "columns": "exact",
+                "column_stats": column_stats,
+                "warnings": column_stats
+            },
+            "cached": False,
+            "elapsed_seconds": round(time.perf_counter() - started, 3)
+        }
+    }
+
+    with _profile_cache_lock:
+        _profile_cache[cache_key] = summary
+        while len(_profile_cache) > PROFILE_CACHE_SIZE:
+            _profile_cache.popitem(last=False)
+    return summary
+
+
+def schema_summary(profile: dict, max_columns: int = 50) -> str:
+    """Condense a profile into a few prompt lines: one header, one per column."""
+    dataset = profile["dataset"]
+    file_info = profile["file_info"]
+    approx = "~" if profile["profile"]["accuracy"]["rows"] == "estimated" else ""
+    lines = [
+        f"rows={approx}{dataset['rows']}, columns={dataset['columns']}, "
+        f"encoding={file_info['encoding']}, delimiter={file_info['delimiter']!r}"
+    ]
+    for col in profile["columns"][:max_columns]:
+        stats = col["stats"]
+        parts = [col["type"], f"nulls={stats['null_count']}", f"unique={stats['unique_count']}"]
+        if stats["is_numeric"]:
+            parts.append(f"range={stats.get('min')}..{stats.get('max')}")
+        if col["sample"]:
+            parts.append("e.g. " + ", ".join(str(value) for value in col["sample"]))
+        lines.append(f"- {col['name']}: {'; '.join(parts)}")
+    if len(profile["columns"]) > max_columns:
+        lines.append(f"- ... {len(profile['columns']) - max_columns} more columns")
+    if profile["profile"]["accuracy"]["column_stats"] == "estimated":
+        lines.append(f"(column stats estimated from {profile['profile']['rows_profiled']} sampled rows)")
+    return "\n".join(lines)
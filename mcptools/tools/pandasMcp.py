@@ -1,13 +1,21 @@
 from mcp.server.fastmcp import FastMCP
-import pandas as pd
+import duckdb
 import os
-from chardet import detect
 import traceback
-from io import StringIO
+import asyncio
 import sys
 import time
 import json
 
+# Started as a stdio subprocess, so make the repository root importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from mcptools.tools.columnarStore import UnsupportedEncoding, duckdb_source, restrict_to_file
+from mcptools.tools.csvProfiler import profile_file
+from mcptools.tools.sandboxPool import SandboxPool
+from mcptools.tools.resultCache import ResultCache, cache_key
+from mcptools.tools.chartData import DEFAULT_MAX_POINTS, DEFAULT_TOP_N, downsample_line, top_n
+from mcptools.tools.chartStore import chart_path, load_template, store_chart
+
 
 mcp = FastMCP("PandasAgent")
 
@@ -15,17 +23,55 @@ mcp = FastMCP("PandasAgent")
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 BLACKLIST = ['os.', 'sys.', 'subprocess.', 'open(', 'exec(', 'eval(', 'import os', 'import sys']
 
+# DuckDB limits for query_sql; larger intermediates spill to DUCKDB_TEMP_DIR
+DUCKDB_MEMORY_LIMIT = "2GB"
+DUCKDB_THREADS = 4
+DUCKDB_MAX_ROWS = 500
+DUCKDB_TEMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tmp", "duckdb")
+
+# Worker processes for run_pandas_code
+SANDBOX_WORKERS = 2
+SANDBOX_TIMEOUT_SECONDS = 60
+SANDBOX_MAX_RSS_MB = 2048
+SANDBOX_MAX_JOBS_PER_WORKER = 50
+
+# Cached run_pandas_code responses
+RESULT_CACHE_ENTRIES = 256
+RESULT_CACHE_BYTES = 32 * 1024 * 1024
+
+_sandbox = None
+result_cache = ResultCache(max_entries=RESULT_CACHE_ENTRIES, max_bytes=RESULT_CACHE_BYTES)
+
+
+def get_sandbox() -> SandboxPool:
+    """Return the server-wide pool; the server process is kept alive by the
+    web app's tool registry, so workers and their job counts outlive requests."""
+    global _sandbox
+    if _sandbox is None:
+        _sandbox = SandboxPool(
+            size=SANDBOX_WORKERS,
+            timeout_seconds=SANDBOX_TIMEOUT_SECONDS,
+            max_rss_mb=SANDBOX_MAX_RSS_MB,
+            max_jobs=SANDBOX_MAX_JOBS_PER_WORKER
+        )
+    return _sandbox
+
 @mcp.tool()
-def read_metadata(file_path: str) -> dict:
+def read_metadata(file_path: str, mode: str = "fast") -> dict:
     """Read CSV file metadata and return in MCP-compatible format.
     
     Args:
         file_path: Absolute path to CSV
+        mode: "fast" (default) gives an exact row count and, for large files,
+            statistics estimated from rows sampled across the whole file;
+            "full" profiles every row
         
     Returns:
         dict: Structured metadata including:
-            - columns: List with name/type/sample for each column
+            - columns: List with name/type/sample/stats for each column
             - file_info: Size and encoding details
+            - dataset: Exact row and column counts
+            - profile: Sampling used and which statistics are exact or estimated
             - status: SUCCESS/ERROR indicator
         
     Example:
@@ -53,128 +99,12 @@ def read_metadata(file_path: str) -> dict:
                 "status": "ERROR",
                 "error": "FILE_TOO_LARGE",
                 "max_size": f"{MAX_FILE_SIZE / 1024 / 1024}MB",
-                "actual_size": f"{file_size / 1024 / 1024:.1f}MB"
+                "actual_size": f"{file_size / 1024 / 1024:.1f}MB",
+                "suggestion": "Use query_sql to inspect and aggregate this file out of core"
             }
 
-        # Detect encoding and delimiter
-        with open(file_path, 'rb') as f:
-            rawdata = f.read(50000)
-            enc = detect(rawdata)['encoding'] or 'utf-8'
-
-        with open(file_path, 'r', encoding=enc) as f:
-            first_line = f.readline()
-            delimiter = ',' if ',' in first_line else '\t' if '\t' in first_line else ';'
-
-        # Try using dask for large files
-        if file_size > MAX_FILE_SIZE:
-            return {
-                "status": "ERROR",
-                "error": "FILE_TOO_LARGE",
-                "max_size": f"{MAX_FILE_SIZE / 1024 / 1024}MB",
-                "actual_size": f"{file_size / 1024 / 1024:.1f}MB"
-            }
-        else:
-            df = pd.read_csv(file_path, encoding=enc, delimiter=delimiter, nrows=100)
-
-        # Calculate additional metadata
-        columns_metadata = []
-        for col in df.columns:
-            col_meta = {
-                "name": col,
-                "type": str(df[col].dtype),
-                "sample": df[col].dropna().iloc[:2].tolist(),
-                "stats": {
-                    "null_count": df[col].isnull().sum(),
-                    "unique_count": df[col].nunique(),
-                    "is_numeric": pd.api.types.is_numeric_dtype(df[col])
-                },
-                "warnings": [],
-                "suggested_operations": []
-            }
-            
-            # Add numeric stats if applicable
-            if pd.api.types.is_numeric_dtype(df[col]):
-                col_meta["stats"].update({
-                    "min": df[col].min(),
-                    "max": df[col].max(),
-                    "mean": df[col].mean(),
-                    "std": df[col].std()
-                })
-                col_meta["suggested_operations"].extend([
-                    "normalize", "scale", "log_transform"
-                ])
-            
-            # Add categorical stats if applicable
-            if pd.api.types.is_string_dtype(df[col]):
-                col_meta["suggested_operations"].extend([
-                    "one_hot_encode", "label_encode", "text_processing"
-                ])
-            
-            # Add datetime detection
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                col_meta["suggested_operations"].extend([
-                    "extract_year", "extract_month", "time_delta"
-                ])
-            
-            # Add warnings
-            if df[col].isnull().sum() > 0:
-                col_meta["warnings"].append(f"{df[col].isnull().sum()} null values found")
-            if df[col].nunique() == 1:
-                col_meta["warnings"].append("Column contains only one unique value")
-            if pd.api.types.is_numeric_dtype(df[col]) and df[col].abs().max() > 1e6:
-                col_meta["warnings"].append("Large numeric values detected - consider scaling")
-            
-            columns_metadata.append(col_meta)
-
-        from pandas.api.types import infer_dtype
-        
-        # Format concise response
-        summary = {
-            "status": "SUCCESS",
-            "file_info": {
-                "size": f"{file_size / 1024:.1f}KB",
-                "encoding": enc,
-                "delimiter": delimiter
-            },
-            "dataset": {
-                "rows": len(df),
-                "columns": len(df.columns),
-                "column_types": {
-                    col: infer_dtype(df[col])
-                    for col in df.columns
-                }
-            },
-            "warnings": {
-                "message": "Data quality issues detected" if (
-                    df.isnull().any().any() or 
-                    df.duplicated().any() or
-                    (df.nunique() == 1).any()
-                ) else "No significant data quality issues found",
-                **({
-                    "null_columns": {
-                        "count": sum(df.isnull().any()),
-                        "columns": [col for col in df.columns if df[col].isnull().any()]
-                    }
-                } if sum(df.isnull().any()) > 0 else {}),
-                **({
-                    "total_nulls": df.isnull().sum().sum()
-                } if df.isnull().sum().sum() > 0 else {}),
-                **({
-                    "duplicate_rows": {
-                        "count": df.duplicated().sum(),
-                        "rows": df[df.duplicated()].index.tolist()
-                    }
-                } if df.duplicated().sum() > 0 else {}),
-                **({
-                    "single_value_columns": {
-                        "count": sum(df.nunique() == 1),
-                        "columns": [col for col in df.columns if df[col].nunique() == 1]
-                    }
-                } if sum(df.nunique() == 1) > 0 else {})
-            }
-        }
-            
-        return summary
+        # Single vectorized pass, cached by file content hash
+        return profile_file(file_path, mode=mode)
 
     except Exception as e:
         return {
@@ -191,28 +121,38 @@ def read_metadata(file_path: str) -> dict:
 
 
 @mcp.tool()
-def run_pandas_code(code: str) -> dict:
+async def run_pandas_code(code: str) -> dict:
     """Execute pandas code with smart suggestions and security checks.
     
     Requirements:
         - Must contain full import and file loading logic using the provided file_path
         - Must assign final result to 'result' variable
         - Code must use the provided file_path to load data
+        - Prefer load_table(file_path, columns=[...]) over pd.read_csv: it reads
+          the columnar copy made at upload time and only the listed columns
     
+    Limits:
+        - Runs in a separate worker process, stopped after 60 seconds or
+          2GB of memory (error type TIMEOUT / MEMORY_LIMIT_EXCEEDED)
+
+    Caching:
+        - Deterministic code over unchanged files is answered from cache;
+          the response's "cache" field is HIT, MISS or BYPASS (not cacheable)
+
     Returns:
         dict: Either the result or error information
         
     Example:
         >>> run_pandas_code('''
         ... import pandas as pd
-        ... df = pd.read_csv(file_path)
+        ... df = load_table(r'/path/to/data.csv', columns=['A', 'B'])
         ... result = df.sum()
         ... ''', '/path/to/data.csv')
         {
             "result": {
                 "type": "series",
-                "data": {"A": 3, "B": 7},
-                "dtype": "int64"
+                "shape": [2, 1],
+                "table": ",0\nA,3\nB,7"
             }
         }
     """
@@ -229,62 +169,155 @@ def run_pandas_code(code: str) -> dict:
                 }
             }
 
-   
-    # Prepare execution environment
-    local_vars = {'pd': pd}
-    stdout_capture = StringIO()
-    old_stdout = sys.stdout
-    sys.stdout = stdout_capture
+    # Identical deterministic code over unchanged files returns the cached response
+    key = await asyncio.to_thread(cache_key, code)
+    if key:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return {**cached, "cache": "HIT"}
 
-    try:
-        exec(code, {}, local_vars)
-        result = local_vars.get('result', None)
+    # Run in a worker process so slow snippets never block the server
+    response = await asyncio.to_thread(get_sandbox().run, code)
+    if key and "error" not in response:
+        result_cache.put(key, response)
+    return {**response, "cache": "MISS" if key else "BYPASS"}
 
-        if result is None:
-            return {
-                "output": stdout_capture.getvalue(),
-                "warning": "No 'result' variable found in code"
-            }
 
-        # Format different result types appropriately
-        if isinstance(result, (pd.DataFrame, pd.Series)):
-            response = {
-                "result": {
-                    "type": "dataframe" if isinstance(result, pd.DataFrame) else "series",
-                    "shape": result.shape,
-                    "dtypes": str(result.dtypes),
-                    "data": result.head().to_dict() if isinstance(result, pd.DataFrame) else result.to_dict()
-                }
-            }
-        else:
-            response = {"result": str(result)}
+@mcp.tool()
+def query_sql(file_path: str, sql: str, max_rows: int = 100) -> dict:
+    """Run a read-only SQL query over a CSV/Parquet file with DuckDB.
 
-        return response
-        
-    except Exception as e:
-        # Generate specific suggestions based on error
-        error_msg = str(e)
-        suggestions = []
+    Works out of core, so use it for files larger than 100MB (which
+    read_metadata and run_pandas_code reject) and for large aggregations.
+    The file is exposed as the table `data`.
+
+    Args:
+        file_path: Absolute path to the uploaded file
+        sql: A single SELECT (or WITH ... SELECT) statement over `data`
+        max_rows: Maximum rows returned (capped at 500); aggregate instead of
+            selecting raw rows
+
+    Returns:
+        dict: Column names, result rows and whether the result was truncated
 
-        if "No such file or directory" in error_msg:
-            suggestions.append("Use raw strings for paths: r'path\\to\\file.csv'")
-        if "could not convert string to float" in error_msg:
-            suggestions.append("Try: pd.to_numeric(df['col'], errors='coerce')")
-        if "AttributeError" in error_msg and "str" in error_msg:
-            suggestions.append("Try: df['col'].astype(str).str.strip()")
+    Example:
+        >>> query_sql("/path/to/data.csv",
+        ...           "SELECT region, SUM(amount) AS total FROM data GROUP BY region")
+        {
+            "status": "SUCCESS",
+            "columns": ["region", "total"],
+            "rows": [["north", 1200.5], ["south", 980.0]],
+            "row_count": 2,
+            "truncated": false
+        }
+    """
+    if not os.path.exists(file_path):
+        return {"status": "ERROR", "error": "FILE_NOT_FOUND", "path": file_path}
 
+    statement = sql.strip().rstrip(';').strip()
+    if ';' in statement or not statement.lower().startswith(('select', 'with')):
         return {
-            "error": {
-                "type": type(e).__name__,
-                "message": error_msg,
-                "traceback": traceback.format_exc(),
-                "output": stdout_capture.getvalue(),
-                "suggestions": suggestions if suggestions else None
-            }
+            "status": "ERROR",
+            "error": "SECURITY_VIOLATION",
+            "message": "Only a single SELECT statement over the table `data` is allowed"
         }
-    finally:
-        sys.stdout = old_stdout
 
+    max_rows = max(1, min(max_rows, DUCKDB_MAX_ROWS))
+    os.makedirs(DUCKDB_TEMP_DIR, exist_ok=True)
+    con = duckdb.connect(config={
+        "memory_limit": DUCKDB_MEMORY_LIMIT,
+        "threads": DUCKDB_THREADS,
+        "temp_directory": DUCKDB_TEMP_DIR
+    })
+    try:
+        con.execute(f"CREATE TEMP VIEW data AS SELECT * FROM {duckdb_source(file_path)}")
+        # No other files (e.g. read_text('/etc/passwd') or another session's upload) or URLs
+        restrict_to_file(con, file_path)
+
+        started = time.perf_counter()
+        cursor = con.execute(statement)
+        columns = [desc[0] for desc in cursor.description]
+        # Fetch one extra row to detect truncation without materializing the rest
+        rows = cursor.fetchmany(max_rows + 1)
+        truncated = len(rows) > max_rows
+
+        return {
+            "status": "SUCCESS",
+            "columns": columns,
+            "rows": [list(row) for row in rows[:max_rows]],
+            "row_count": min(len(rows), max_rows),
+            "truncated": truncated,
+            "elapsed_seconds": round(time.perf_counter() - started, 3)
+        }
+    except duckdb.Error as e:
+        return {
+            "status": "ERROR",
+            "error_type": type(e).__name__,
+            "message": str(e),
+            "solution": ["Reference the file as the table `data`", "Check column names with SELECT * FROM data LIMIT 5"]
+        }
+    except UnsupportedEncoding as e:
+        return {
+            "status": "ERROR",
+            "error_type": "UNSUPPORTED_ENCODING",
+            "message": f"{e}; the file is queryable once its Parquet copy is ready",
+            "solution": ["Retry query_sql shortly", "Use run_pandas_code with load_table(file_path) instead"]
+        }
+    finally:
+        con.close()
+
+
+# Sample literals in each chart template and the slot that replaces them
+BAR_TEMPLATE_SLOTS = {
+    'labels: ["Electronics", "Clothing", "Home Goods", "Sports Equipment"]': "labels",
+    'data: [120000, 85000, 95000, 60000]': "data",
+    'backgroundColor: ["#4e73df", "#1cc88a", "#36b9cc", "#f6c23e"]': "colors",
+    'Sales by Category (2023)': "title",
+    'legend: { position: \'top\' },': "legend"
+}
+PIE_TEMPLATE_SLOTS = {
+    'labels: ["Apple", "Samsung", "Huawei", "Xiaomi", "Others"]': "labels",
+    'data: [45, 25, 12, 8, 10]': "data",
+    'backgroundColor: ["#4e73df", "#1cc88a", "#36b9cc", "#f6c23e", "#e74a3b"]': "colors",
+    'Global Smartphone Market Share (2023)': "title"
+}
+LINE_TEMPLATE_SLOTS = {
+    'labels: ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]': "labels",
+    'datasets: [\n' +
+    '                {\n' +
+    '                    label: "Electronics",\n' +
+    '                    data: [6500, 5900, 8000, 8100, 8600, 8250, 9500, 10500, 12000, 11500, 13000, 15000],\n' +
+    '                    borderColor: "#4e73df",\n' +
+    '                    backgroundColor: "#4e73df",\n' +
+    '                    borderWidth: 2,\n' +
+    '                    pointRadius: 5,\n' +
+    '                    tension: 0,\n' +
+    '                    fill: false\n' +
+    '                },\n' +
+    '                {\n' +
+    '                    label: "Clothing",\n' +
+    '                    data: [12000, 11000, 12500, 10500, 11500, 13000, 14000, 12500, 11000, 9500, 10000, 12000],\n' +
+    '                    borderColor: "#1cc88a",\n' +
+    '                    backgroundColor: "#1cc88a",\n' +
+    '                    borderWidth: 2,\n' +
+    '                    pointRadius: 5,\n' +
+    '                    tension: 0,\n' +
+    '                    fill: false\n' +
+    '                },\n' +
+    '                {\n' +
+    '                    label: "Home Goods",\n' +
+    '                    data: [8000, 8500, 9000, 9500, 10000, 10500, 11000, 11500, 12000, 12500, 13000, 13500],\n' +
+    '                    borderColor: "#36b9cc",\n' +
+    '                    backgroundColor: "#36b9cc",\n' +
+    '                    borderWidth: 2,\n' +
+    '                    pointRadius: 5,\n' +
+    '                    tension: 0,\n' +
+    '                    fill: false\n' +
+    '                }\n' +
+    '            ]': "datasets",
+    'Interactive Sales Trend Dashboard': "title",
+    'Monthly Sales Trend (2023)': "title"
+}
 
 
 @mcp.tool()
@@ -292,7 +325,7 @@ def bar_chart_to_html(
     categories: list,
     values: list,
     title: str = "Interactive Chart",
-   
+    max_categories: int = DEFAULT_TOP_N
 ) -> dict:
     """Generate interactive HTML bar chart using Chart.js template.
     
@@ -300,11 +333,12 @@ def bar_chart_to_html(
         categories: List of category names for x-axis
         values: List of numeric values for y-axis
         title: Chart title (default: "Interactive Chart")
+        max_categories: Keep the largest N categories and merge the rest into "Others" (default: 20)
         x_label: Label for X-axis (default: "Categories")
         y_label: Label for Y-axis (default: "Values")
         
     Returns:
-        dict: Contains file path and status information
+        dict: Contains file path, status information and original/rendered point counts
         
     Example:
         >>> bar_chart_to_html(
@@ -314,7 +348,9 @@ def bar_chart_to_html(
         ... )
         {
             "status": "SUCCESS",
-            "filepath": "/absolute/path/to/plotXXXXXX.html",
+            "filepath": "/absolute/path/to/charts/<sha256>.html",
+            "url": "/charts/<sha256>",
+            "points": {"original_points": 4, "rendered_points": 4, ...}
         }
     """
     # Validate input lengths
@@ -325,11 +361,9 @@ def bar_chart_to_html(
             "message": f"Categories ({len(categories)}) and values ({len(values)}) must be same length"
         }
 
-    # Read template file
-    template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "./templates/barchart_template.html")
+    # Compiled once per process
     try:
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template = f.read()
+        template = load_template("barchart_template.html", BAR_TEMPLATE_SLOTS)
     except Exception as e:
         return {
             "status": "ERROR",
@@ -338,8 +372,7 @@ def bar_chart_to_html(
         }
 
     # Prepare data for Chart.js
-    all_categories = categories
-    all_values = values
+    all_categories, all_values, points = top_n(categories, values, max_categories)
     colors = [
         "#4e73df", "#1cc88a", "#36b9cc", "#f6c23e",
         "#e74a3b", "#858796", "#f8f9fc", "#5a5c69",
@@ -350,34 +383,16 @@ def bar_chart_to_html(
     ][:len(all_categories)]
 
     # Inject data into template
-    template = template.replace(
-        'labels: ["Electronics", "Clothing", "Home Goods", "Sports Equipment"]',
-        f'labels: {json.dumps(all_categories)}'
-    ).replace(
-        'data: [120000, 85000, 95000, 60000]',
-        f'data: {json.dumps(all_values)}'
-    ).replace(
-        'backgroundColor: ["#4e73df", "#1cc88a", "#36b9cc", "#f6c23e"]',
-        f'backgroundColor: {json.dumps(colors)}'
-    ).replace(
-        'Sales by Category (2023)',
-        title
-    ).replace(
-        'legend: { position: \'top\' },',
-        ''
+    html = template.render(
+        labels=f'labels: {json.dumps(all_categories)}',
+        data=f'data: {json.dumps(all_values)}',
+        colors=f'backgroundColor: {json.dumps(colors)}',
+        title=title
     )
 
-    # Save to plot directory as HTML
-    charts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "charts")
-    os.makedirs(charts_dir, exist_ok=True)
-
-    timestamp = str(int(time.time()))
-    filename = f"chart_{timestamp}.html"
-    filepath = os.path.join(charts_dir, filename)
-
+    # Stored by content hash: identical charts share one file
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(template)
+        chart_id = store_chart(html)
     except Exception as e:
         return {
             "status": "ERROR",
@@ -387,7 +402,9 @@ def bar_chart_to_html(
 
     return {
         "status": "SUCCESS",
-        "filepath": os.path.abspath(filepath)
+        "filepath": os.path.abspath(chart_path(chart_id)),
+        "url": f"/charts/{chart_id}",
+        "points": points
     }
 
 
@@ -395,7 +412,8 @@ def bar_chart_to_html(
 def pie_chart_to_html(
     labels: list,
     values: list,
-    title: str = "Interactive Pie Chart"
+    title: str = "Interactive Pie Chart",
+    max_categories: int = DEFAULT_TOP_N
 ) -> dict:
     """Generate interactive HTML pie chart using Chart.js template.
     
@@ -403,9 +421,10 @@ def pie_chart_to_html(
         labels: List of label names for each pie slice
         values: List of numeric values for each slice
         title: Chart title (default: "Interactive Pie Chart")
+        max_categories: Keep the largest N slices and merge the rest into "Others" (default: 20)
         
     Returns:
-        dict: Contains file path and status information
+        dict: Contains file path, status information and original/rendered point counts
         
     Example:
         >>> pie_chart_to_html(
@@ -415,7 +434,9 @@ def pie_chart_to_html(
         ... )
         {
             "status": "SUCCESS",
-            "filepath": "/absolute/path/to/plotXXXXXX.html",
+            "filepath": "/absolute/path/to/charts/<sha256>.html",
+            "url": "/charts/<sha256>",
+            "points": {"original_points": 4, "rendered_points": 4, ...}
         }
     """
     # Validate input lengths
@@ -426,11 +447,9 @@ def pie_chart_to_html(
             "message": f"Labels ({len(labels)}) and values ({len(values)}) must be same length"
         }
 
-    # Read template file
-    template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "./templates/piechart_template.html")
+    # Compiled once per process
     try:
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template = f.read()
+        template = load_template("piechart_template.html", PIE_TEMPLATE_SLOTS)
     except Exception as e:
         return {
             "status": "ERROR",
@@ -439,6 +458,7 @@ def pie_chart_to_html(
         }
 
     # Prepare data for Chart.js
+    labels, values, points = top_n(labels, values, max_categories)
     colors = [
         "#4e73df", "#1cc88a", "#36b9cc", "#f6c23e",
         "#e74a3b", "#858796", "#f8f9fc", "#5a5c69",
@@ -449,31 +469,16 @@ def pie_chart_to_html(
     ][:len(labels)]
 
     # Inject data into template
-    template = template.replace(
-        'labels: ["Apple", "Samsung", "Huawei", "Xiaomi", "Others"]',
-        f'labels: {json.dumps(labels)}'
-    ).replace(
-        'data: [45, 25, 12, 8, 10]',
-        f'data: {json.dumps(values)}'
-    ).replace(
-        'backgroundColor: ["#4e73df", "#1cc88a", "#36b9cc", "#f6c23e", "#e74a3b"]',
-        f'backgroundColor: {json.dumps(colors)}'
-    ).replace(
-        'Global Smartphone Market Share (2023)',
-        title
+    html = template.render(
+        labels=f'labels: {json.dumps(labels)}',
+        data=f'data: {json.dumps(values)}',
+        colors=f'backgroundColor: {json.dumps(colors)}',
+        title=title
     )
 
-    # Save to plot directory as HTML
-    charts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "charts")
-    os.makedirs(charts_dir, exist_ok=True)
-
-    timestamp = str(int(time.time()))
-    filename = f"chart_{timestamp}.html"
-    filepath = os.path.join(charts_dir, filename)
-
+    # Stored by content hash: identical charts share one file
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(template)
+        chart_id = store_chart(html)
     except Exception as e:
         return {
             "status": "ERROR",
@@ -483,14 +488,17 @@ def pie_chart_to_html(
 
     return {
         "status": "SUCCESS",
-        "filepath": os.path.abspath(filepath)
+        "filepath": os.path.abspath(chart_path(chart_id)),
+        "url": f"/charts/{chart_id}",
+        "points": points
     }
 
 @mcp.tool()
 def line_chart_to_html(
     labels: list,
     datasets: list,
-    title: str = "Interactive Line Chart"
+    title: str = "Interactive Line Chart",
+    max_points: int = DEFAULT_MAX_POINTS
 ) -> dict:
     """Generate interactive HTML line chart using Chart.js template.
     
@@ -500,9 +508,10 @@ def line_chart_to_html(
             - label: Name of the dataset
             - data: List of numeric values (3 dimensions: [x, y, z])
         title: Chart title (default: "Interactive Line Chart")
+        max_points: Downsample to about this many x positions, keeping the curve's shape (default: 2000)
         
     Returns:
-        dict: Contains file path and status information
+        dict: Contains file path, status information and original/rendered point counts
         
     Example:
         >>> line_chart_to_html(
@@ -515,7 +524,9 @@ def line_chart_to_html(
         ... )
         {
             "status": "SUCCESS",
-            "filepath": "/absolute/path/to/plotXXXXXX.html",
+            "filepath": "/absolute/path/to/charts/<sha256>.html",
+            "url": "/charts/<sha256>",
+            "points": {"original_points": 4, "rendered_points": 4, ...}
         }
     """
     # Validate input
@@ -526,11 +537,9 @@ def line_chart_to_html(
             "message": "All datasets must have same length as labels"
         }
 
-    # Read template file
-    template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "./templates/linechart_template.html")
+    # Compiled once per process
     try:
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template = f.read()
+        template = load_template("linechart_template.html", LINE_TEMPLATE_SLOTS)
     except Exception as e:
         return {
             "status": "ERROR",
@@ -539,6 +548,7 @@ def line_chart_to_html(
         }
 
     # Prepare data for Chart.js
+    labels, datasets, points = downsample_line(labels, datasets, max_points)
     chart_data = {
         "labels": labels,
         "datasets": []
@@ -552,68 +562,22 @@ def line_chart_to_html(
                 "borderColor": '#4e73df',  # Default color
                 "backgroundColor": '#4e73df',
             "borderWidth": 2,
-            "pointRadius": 5,
+            # Point markers only help on short series; thousands of them just slow rendering
+            "pointRadius": 5 if len(labels) <= 100 else 0,
             "tension": 0,
             "fill": False
         })
 
     # Inject data into template
-    template = template.replace(
-        'labels: ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]',
-        f'labels: {json.dumps(labels)}'
-    ).replace(
-        'datasets: [\n' +
-        '                {\n' +
-        '                    label: "Electronics",\n' +
-        '                    data: [6500, 5900, 8000, 8100, 8600, 8250, 9500, 10500, 12000, 11500, 13000, 15000],\n' +
-        '                    borderColor: "#4e73df",\n' +
-        '                    backgroundColor: "#4e73df",\n' +
-        '                    borderWidth: 2,\n' +
-        '                    pointRadius: 5,\n' +
-        '                    tension: 0,\n' +
-        '                    fill: false\n' +
-        '                },\n' +
-        '                {\n' +
-        '                    label: "Clothing",\n' +
-        '                    data: [12000, 11000, 12500, 10500, 11500, 13000, 14000, 12500, 11000, 9500, 10000, 12000],\n' +
-        '                    borderColor: "#1cc88a",\n' +
-        '                    backgroundColor: "#1cc88a",\n' +
-        '                    borderWidth: 2,\n' +
-        '                    pointRadius: 5,\n' +
-        '                    tension: 0,\n' +
-        '                    fill: false\n' +
-        '                },\n' +
-        '                {\n' +
-        '                    label: "Home Goods",\n' +
-        '                    data: [8000, 8500, 9000, 9500, 10000, 10500, 11000, 11500, 12000, 12500, 13000, 13500],\n' +
-        '                    borderColor: "#36b9cc",\n' +
-        '                    backgroundColor: "#36b9cc",\n' +
-        '                    borderWidth: 2,\n' +
-        '                    pointRadius: 5,\n' +
-        '                    tension: 0,\n' +
-        '                    fill: false\n' +
-        '                }\n' +
-        '            ]',
-        f'datasets: {json.dumps(chart_data["datasets"], indent=16)}'
-    ).replace(
-        'Interactive Sales Trend Dashboard',
-        title
-    ).replace(
-        'Monthly Sales Trend (2023)',
-        title
+    html = template.render(
+        labels=f'labels: {json.dumps(labels)}',
+        datasets=f'datasets: {json.dumps(chart_data["datasets"], indent=16)}',
+        title=title
     )
 
-    # Save to plot directory as HTML
-    charts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "charts")
-    os.makedirs(charts_dir, exist_ok=True)
-
-    timestamp = str(int(time.time()))
-    filename = f"chart_{timestamp}.html"
-    filepath = os.path.join(charts_dir, filename)
-
+    # Stored by content hash: identical charts share one file
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(template)
+        chart_id = store_chart(html)
     except Exception as e:
         return {
             "status": "ERROR",
@@ -623,9 +587,16 @@ def line_chart_to_html(
 
     return {
         "status": "SUCCESS",
-        "filepath": os.path.abspath(filepath)
+        "filepath": os.path.abspath(chart_path(chart_id)),
+        "url": f"/charts/{chart_id}",
+        "points": points
     }
 
 
 if __name__ == "__main__":
-    mcp.run()
+    # Start the workers before serving so the first call does not pay for them
+    get_sandbox()
+    try:
+        mcp.run()
+    finally:
+        get_sandbox().close()
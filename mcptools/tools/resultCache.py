@@ -0,0 +1,152 @@
+"""Memoized run_pandas_code responses.
+
+Agents often resend the same snippet on retries and follow-up questions.
+Responses are cached under a key built from the code's AST (so formatting
+and comments do not matter) plus the content hash of every file the code
+reads. Only code that looks deterministic and free of side effects is
+cached. These bypass the cache:
+
+- anything touching random numbers, clocks or uuids
+- a known reader whose path is not a string literal
+- any other string literal that looks like a path, since the file may be
+  read another way (read_fwf, np.loadtxt, duckdb, a variable) and would go
+  unhashed
+- calls that write or delete files (``to_csv``, ``savefig``...), which a
+  cache hit would silently skip
+"""
+import ast
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from mcptools.tools.columnarStore import file_fingerprint
+
+NONDETERMINISTIC_NAMES = {
+    "random", "rand", "randn", "randint", "choice", "shuffle", "permutation",
+    "default_rng", "now", "today", "utcnow", "time", "perf_counter",
+    "uuid1", "uuid4", "getpid"
+}
+FILE_READERS = {
+    "load_table", "read_csv", "read_excel", "read_parquet", "read_json", "read_table", "read_feather"
+}
+# Keyword names the readers above accept for their path argument
+PATH_KEYWORDS = {"filepath_or_buffer", "path", "path_or_buf", "io", "file_path"}
+PATH_LIKE = re.compile(
+    r"[/\\]|\.(csv|tsv|txt|dat|parquet|pq|json|jsonl|xlsx?|feather|arrow|pkl|pickle|h5|hdf5?|npy|npz"
+    r"|db|sqlite|duckdb|zip|gz|bz2|xz)$",
+    re.IGNORECASE
+)
+# to_* methods that return a value instead of writing a file
+PURE_CONVERSIONS = {
+    "to_dict", "to_list", "to_numpy", "to_string", "to_markdown", "to_frame", "to_records", "to_series",
+    "to_datetime", "to_numeric", "to_timedelta", "to_period", "to_timestamp", "to_pydatetime", "to_flat_index"
+}
+SIDE_EFFECT_CALLS = {
+    "savefig", "save", "savez", "savetxt", "dump", "write", "writelines",
+    "remove", "unlink", "rmtree", "rmdir", "mkdir", "makedirs", "rename", "touch", "write_text", "write_bytes"
+}
+
+
+def _call_name(node: ast.Call):
+    func = node.func
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    if isinstance(func, ast.Name):
+        return func.id
+    return None
+
+
+def _has_side_effects(name) -> bool:
+    if name is None:
+        return False
+    return name in SIDE_EFFECT_CALLS or (name.startswith("to_") and name not in PURE_CONVERSIONS)
+
+
+def _reader_path(node: ast.Call):
+    """The path argument of a reader call: a constant node, another node, or None."""
+    if node.args:
+        return node.args[0]
+    return next((kw.value for kw in node.keywords if kw.arg in PATH_KEYWORDS), None)
+
+
+def cache_key(code: str):
+    """Return the cache key for ``code``, or None if it must not be cached."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    files = set()
+    reader_paths = set()  # ids of the constant nodes hashed as reader paths
+    path_constants = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and node.attr in NONDETERMINISTIC_NAMES:
+            return None
+        if isinstance(node, ast.Name) and node.id in NONDETERMINISTIC_NAMES:
+            return None
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and PATH_LIKE.search(node.value):
+            path_constants.append(node)
+        if not isinstance(node, ast.Call):
+            continue
+
+        name = _call_name(node)
+        if _has_side_effects(name):
+            return None
+        if name == "sample" and not any(kw.arg == "random_state" for kw in node.keywords):
+            return None
+        if name in FILE_READERS:
+            path_arg = _reader_path(node)
+            if not (isinstance(path_arg, ast.Constant) and isinstance(path_arg.value, str)):
+                return None
+            files.add(path_arg.value)
+            reader_paths.add(id(path_arg))
+
+    # A path used anywhere else may be read in a way the key does not see
+    if any(id(node) not in reader_paths for node in path_constants):
+        return None
+
+    digest = hashlib.sha256(ast.dump(tree, annotate_fields=False).encode("utf-8"))
+    for path in sorted(files):
+        if not os.path.isfile(path):
+            return None
+        digest.update(f"\0{path}\0{file_fingerprint(path)}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU cache bounded by entry count and approximate size in bytes."""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, response: dict):
+        size = len(json.dumps(response, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (response, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
@@ -0,0 +1,128 @@
+"""Compact encoding of MCP tool results for the LLM context.
+
+Everything a tool returns is fed back to DeepSeek on the next agent step,
+so results are rendered for tokens, not for humans:
+
+- DataFrames/Series become capped CSV tables, plus ``describe()`` summary
+  statistics when rows had to be cut
+- tracebacks keep only their last frames
+- JSON is re-serialized without indentation, empty fields, or escaped
+  Chinese, and long lists/strings are cut until the result fits a token
+  budget
+"""
+import json
+
+import pandas as pd
+
+MAX_TABLE_ROWS = 20
+MAX_TABLE_COLS = 20
+TRACEBACK_FRAMES = 2
+DEFAULT_TOKEN_BUDGET = 1500
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count via tiktoken when available, else a character heuristic."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # not installed or encoding files not downloadable
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # ~4 chars per token for ASCII, ~1 per token for CJK
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def render_table(result, max_rows: int = MAX_TABLE_ROWS, max_cols: int = MAX_TABLE_COLS) -> dict:
+    """Render a DataFrame or Series as a capped CSV table with summary stats."""
+    df = result.to_frame() if isinstance(result, pd.Series) else result
+    rows, cols = df.shape
+    shown = df.iloc[:max_rows, :max_cols]
+
+    rendered = {
+        "type": "series" if isinstance(result, pd.Series) else "dataframe",
+        "shape": [rows, cols],
+        "table": shown.to_csv(float_format="%.6g").strip()
+    }
+    if rows > max_rows or cols > max_cols:
+        rendered["truncated"] = f"showing {len(shown)} of {rows} rows, {shown.shape[1]} of {cols} columns"
+    if rows > max_rows:
+        numeric = df.iloc[:, :max_cols].select_dtypes(include="number")
+        if not numeric.empty:
+            rendered["summary"] = numeric.describe().to_csv(float_format="%.6g").strip()
+    return rendered
+
+
+def trim_traceback(text: str, frames: int = TRACEBACK_FRAMES) -> str:
+    """Keep the last ``frames`` stack frames and the exception line."""
+    lines = text.strip().splitlines()
+    frame_starts = [i for i, line in enumerate(lines) if line.lstrip().startswith('File "')]
+    if len(frame_starts) <= frames:
+        return text.strip()
+    return "...\n" + "\n".join(lines[frame_starts[-frames]:])
+
+
+def _compact(value, max_items: int, max_chars: int):
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            if item is None or item == "" or item == [] or item == {}:
+                continue
+            if key == "traceback" and isinstance(item, str):
+                item = trim_traceback(item)
+            compacted[key] = _compact(item, max_items, max_chars)
+        return compacted
+    if isinstance(value, list):
+        items = [_compact(item, max_items, max_chars) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"... {len(value) - max_items} more")
+        return items
+    if isinstance(value, float):
+        return float(f"{value:.6g}")
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + f"... [{len(value) - max_chars} chars cut]"
+    return value
+
+
+def encode_tool_output(content: str, token_budget: int = DEFAULT_TOKEN_BUDGET) -> tuple:
+    """Re-encode a tool result to fit ``token_budget``.
+
+    Returns ``(encoded_text, stats)`` where stats reports tokens before and
+    after encoding and the tokens saved.
+    """
+    tokens_before = estimate_tokens(content)
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        data = None
+
+    if data is None:
+        encoded = content
+    else:
+        max_items, max_chars = 50, 4000
+        encoded = json.dumps(_compact(data, max_items, max_chars), ensure_ascii=False,
+                             separators=(",", ":"), default=str)
+        # Tighten list and string caps until the result fits the budget
+        while estimate_tokens(encoded) > token_budget and max_chars > 200:
+            max_items, max_chars = max(5, max_items // 2), max_chars // 2
+            encoded = json.dumps(_compact(data, max_items, max_chars), ensure_ascii=False,
+                                 separators=(",", ":"), default=str)
+
+    tokens_after = estimate_tokens(encoded)
+    if tokens_after > token_budget:
+        # Last resort: hard cut proportional to the overshoot
+        keep = int(len(encoded) * token_budget / tokens_after)
+        encoded = encoded[:keep] + f"... [truncated to ~{token_budget} tokens]"
+        tokens_after = estimate_tokens(encoded)
+
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": max(tokens_before - tokens_after, 0)
+    }
+    return encoded, stats
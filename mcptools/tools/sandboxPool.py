@@ -0,0 +1,209 @@
+"""Worker-process pool that executes run_pandas_code snippets.
+
+Snippets used to run via ``exec`` inside the MCP server and swapped the
+global ``sys.stdout``, so a runaway snippet blocked every user and parallel
+calls mixed their output. Here each snippet runs in one of a few
+pre-started worker processes that have pandas imported already:
+
+- every run has a wall-clock timeout and an RSS ceiling, enforced by the
+  parent, which kills and replaces the worker when either is exceeded
+- stdout is captured per run inside the worker
+- workers are recycled after ``max_jobs`` runs to shed leaked memory
+- the worker formats the result itself and sends back only the small
+  response dict (pickled over a pipe), never the DataFrame
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout
+from io import StringIO
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = 0.1
+
+
+def execute_code(code: str) -> dict:
+    """Run one snippet and format its ``result`` (called inside a worker)."""
+    import pandas as pd
+    from mcptools.tools.columnarStore import load_frame
+    from mcptools.tools.resultEncoder import render_table, trim_traceback
+
+    local_vars = {'pd': pd, 'load_table': load_frame}
+    stdout_capture = StringIO()
+
+    try:
+        with redirect_stdout(stdout_capture):
+            exec(code, {}, local_vars)
+        result = local_vars.get('result', None)
+
+        if result is None:
+            return {
+                "output": stdout_capture.getvalue(),
+                "warning": "No 'result' variable found in code"
+            }
+
+        # Format different result types appropriately
+        if isinstance(result, (pd.DataFrame, pd.Series)):
+            response = {"result": render_table(result)}
+        else:
+            response = {"result": str(result)}
+        output = stdout_capture.getvalue()
+        if output:
+            response["output"] = output
+
+        return response
+
+    except Exception as e:
+        # Generate specific suggestions based on error
+        error_msg = str(e)
+        suggestions = []
+
+        if "No such file or directory" in error_msg:
+            suggestions.append("Use raw strings for paths: r'path\\to\\file.csv'")
+        if "could not convert string to float" in error_msg:
+            suggestions.append("Try: pd.to_numeric(df['col'], errors='coerce')")
+        if "AttributeError" in error_msg and "str" in error_msg:
+            suggestions.append("Try: df['col'].astype(str).str.strip()")
+
+        return {
+            "error": {
+                "type": type(e).__name__,
+                "message": error_msg,
+                "traceback": trim_traceback(traceback.format_exc()),
+                "output": stdout_capture.getvalue(),
+                "suggestions": suggestions if suggestions else None
+            }
+        }
+
+
+def _worker_main(conn):
+    """Worker loop: receive code, send back the formatted response."""
+    # The parent's stdout is the MCP stdio channel; never write to it
+    sys.stdout = open(os.devnull, 'w')
+    import pandas  # noqa: F401  warm the import before the first job
+
+    while True:
+        try:
+            code = conn.recv()
+        except EOFError:
+            break
+        if code is None:
+            break
+        try:
+            response = execute_code(code)
+        except BaseException as e:  # keep the worker alive on SystemExit etc.
+            response = {"error": {"type": type(e).__name__, "message": str(e)}}
+        try:
+            conn.send(response)
+        except Exception as e:  # unpicklable result; pickling fails before anything is written
+            conn.send({"error": {"type": "SERIALIZATION_ERROR", "message": str(e)}})
+
+
+def _rss_mb(pid: int):
+    """Current resident set size of ``pid`` in MB, or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        # No procfs (Windows/macOS): the memory limit is not enforced there
+        return None
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+
+class SandboxPool:
+    """Fixed-size pool of pre-started pandas worker processes."""
+
+    def __init__(self, size: int = 2, timeout_seconds: float = 60,
+                 max_rss_mb: int = 2048, max_jobs: int = 50):
+        self.timeout_seconds = timeout_seconds
+        self.max_rss_mb = max_rss_mb
+        self.max_jobs = max_jobs
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(_Worker(self._ctx))
+        logger.info(f"Sandbox pool started with {size} workers")
+
+    def _replace(self, worker: _Worker, kill: bool):
+        """Retire a worker and start its successor off the request path."""
+        def restart():
+            if kill:
+                worker.kill()
+            else:
+                worker.stop()
+            if not self._closed:
+                self._idle.put(_Worker(self._ctx))
+        threading.Thread(target=restart, daemon=True).start()
+
+    def run(self, code: str) -> dict:
+        """Execute ``code`` in an idle worker, blocking until it finishes."""
+        worker = self._idle.get()
+        started = time.monotonic()
+        try:
+            worker.conn.send(code)
+            while not worker.conn.poll(POLL_INTERVAL_SECONDS):
+                elapsed = time.monotonic() - started
+                if elapsed > self.timeout_seconds:
+                    self._replace(worker, kill=True)
+                    return {"error": {
+                        "type": "TIMEOUT",
+                        "message": f"Code ran longer than {self.timeout_seconds}s and was stopped",
+                        "suggestions": ["Load fewer columns or aggregate with query_sql"]
+                    }}
+                rss = _rss_mb(worker.process.pid)
+                if rss is not None and rss > self.max_rss_mb:
+                    self._replace(worker, kill=True)
+                    return {"error": {
+                        "type": "MEMORY_LIMIT_EXCEEDED",
+                        "message": f"Code used {rss:.0f}MB, above the {self.max_rss_mb}MB limit",
+                        "suggestions": ["Load only the needed columns with load_table(file_path, columns=[...])"]
+                    }}
+            response = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._replace(worker, kill=True)
+            return {"error": {"type": "WORKER_CRASHED", "message": str(e) or "Worker process exited"}}
+
+        worker.jobs += 1
+        if worker.jobs >= self.max_jobs:
+            self._replace(worker, kill=False)
+        else:
+            self._idle.put(worker)
+        return response
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
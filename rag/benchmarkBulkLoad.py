@@ -0,0 +1,137 @@
+"""Benchmark: rows/s for loading embedding rows into Postgres + pgvector.
+
+Methods compared on the same synthetic corpus:
+
+- executemany: one INSERT per row (the old insert_chunks path)
+- execute_values: multi-row INSERTs, EXECUTE_VALUES_PAGE_SIZE rows each
+- copy: binary COPY (rag/bulkLoader.py)
+
+Each method loads into a fresh temporary table shaped like
+langchain_pg_embedding, in one transaction. With --hnsw the table has an
+HNSW index during the load; add --defer to drop it for the load and rebuild
+it afterwards (deferred_ann_indexes), which is timed as part of the load.
+
+Usage:
+    python rag/benchmarkBulkLoad.py --rows 20000 --dim 384 --hnsw --defer
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+import uuid
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from rag.bulkLoader import copy_rows, deferred_ann_indexes, execute_values_rows
+
+METHODS = ["executemany", "execute_values", "copy"]
+TABLE = "bench_pg_embedding"
+
+
+def synthetic_rows(count: int, dim: int, text_chars: int) -> list:
+    rng = random.Random(42)
+    collection_id = str(uuid.uuid4())
+    alphabet = string.ascii_letters + "     "
+    rows = []
+    for i in range(count):
+        rows.append((
+            collection_id,
+            [rng.uniform(-1, 1) for _ in range(dim)],
+            "".join(rng.choices(alphabet, k=text_chars)),
+            json.dumps({"source": "benchmark", "chunk": i}),
+            "benchmark",
+            str(uuid.uuid4()),
+        ))
+    return rows
+
+
+def create_table(cursor, dim: int, hnsw: bool):
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cursor.execute(f"""
+        CREATE TEMP TABLE {TABLE} (
+            collection_id uuid NULL,
+            embedding vector({dim}) NULL,
+            "document" varchar NULL,
+            cmetadata json NULL,
+            custom_id varchar NULL,
+            "uuid" uuid PRIMARY KEY
+        )
+    """)
+    if hnsw:
+        cursor.execute(f"CREATE INDEX {TABLE}_hnsw ON {TABLE} USING hnsw (embedding vector_l2_ops)")
+
+
+def load(cursor, method: str, rows: list, batch_rows: int):
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        if method == "executemany":
+            cursor.executemany(f"""
+                INSERT INTO {TABLE} (collection_id, embedding, document, cmetadata, custom_id, uuid)
+                VALUES (%s, %s::vector, %s, %s, %s, %s)
+            """, batch)
+        elif method == "execute_values":
+            execute_values_rows(cursor, batch, TABLE)
+        else:
+            copy_rows(cursor, batch, TABLE)
+
+
+def bench(conn, method: str, rows: list, dim: int, batch_rows: int, hnsw: bool, defer: bool) -> float:
+    with conn.cursor() as cursor:
+        create_table(cursor, dim, hnsw)
+    conn.commit()
+
+    started = time.perf_counter()
+    if defer:
+        with deferred_ann_indexes(conn, TABLE):
+            with conn.cursor() as cursor:
+                load(cursor, method, rows, batch_rows)
+    else:
+        with conn.cursor() as cursor:
+            load(cursor, method, rows, batch_rows)
+    conn.commit()
+    elapsed = time.perf_counter() - started
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {TABLE}")
+        assert cursor.fetchone()[0] == len(rows)
+    return len(rows) / elapsed
+
+
+def main():
+    with open(os.path.join(ROOT, "config", "config.json"), "r") as f:
+        db = json.load(f)["database"]
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384, help="all-MiniLM-L6-v2 produces 384-dim vectors")
+    parser.add_argument("--text-chars", type=int, default=800)
+    parser.add_argument("--batch-rows", type=int, default=64, help="rows per write call (EMBED_BATCH_SIZE)")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    parser.add_argument("--hnsw", action="store_true", help="load into a table with an HNSW index")
+    parser.add_argument("--defer", action="store_true", help="drop the ANN index for the load, rebuild after")
+    parser.add_argument("--dsn", default=f"host={db['host']} port={db['port']} dbname={db['name']} "
+                                         f"user={db['user']} password={db['password']}")
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows, args.dim, args.text_chars)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        conn.commit()
+        print(f"{args.rows} rows, dim {args.dim}, hnsw={args.hnsw}, defer={args.defer}")
+        print(f"{'method':<16}{'rows/s':>12}")
+        for method in args.methods:
+            print(f"{method:<16}{bench(conn, method, rows, args.dim, args.batch_rows, args.hnsw, args.defer):>12.0f}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""批量导入目录或zip压缩包到知识库
+
+    python -m rag.bulkIngest docs/ --knowledge-base 员工手册 --user admin
+    python -m rag.bulkIngest handbook.zip --knowledge-base 员工手册 --workers 8
+
+- 读取和切分在进程池中并行进行（子进程不加载嵌入模型）
+- 所有文件的文本块共用一条嵌入/写库流水线，小文件也能凑满嵌入批次
+- 与上传入库相同，按内容哈希增量导入：未变化的块跳过，文件中已删除的块随
+  该文件的最后一批一起删除
+- 完成的文件记录在清单(manifest)中，中断后重新执行会跳过清单中未变化的文件
+- 定期输出进度、吞吐量和预计剩余时间
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from rag.streamingChunker import ENCODINGS, build_text_splitter, iter_file_chunks, iter_text_chunks, scan_text
+from rag.tokenChunking import LENGTH_UNITS, make_token_counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTENSIONS = (".md", ".txt")
+# 每个子进程最多预先切分的文件数，限制内存中待嵌入的文本块
+PREFETCH_PER_WORKER = 2
+PROGRESS_INTERVAL_SECONDS = 5
+
+_splitter = None
+_chunk_size = 0
+
+
+def _init_worker(params: Dict, embedding_model: str):
+    """子进程初始化：按入库参数创建分割器（tokens 模式只加载知识库所用模型的分词器，不加载模型）"""
+    global _splitter, _chunk_size
+    _chunk_size = params["chunk_size"]
+    length_function = len
+    if params["length_unit"] == "tokens":
+        from transformers import AutoTokenizer
+        with open(ROOT / "config" / "config.json", "r") as f:
+            model_config = json.load(f)["model"]
+        tokenizer = AutoTokenizer.from_pretrained(embedding_model, cache_dir=model_config["cache_path"],
+                                                  local_files_only=True)
+        length_function = make_token_counter(tokenizer)
+    _splitter = build_text_splitter(params, length_function)
+
+
+def _decode(data: bytes) -> str:
+    for encoding in ENCODINGS[:-1]:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode(ENCODINGS[-1])
+
+
+def _parse(item: Dict) -> Dict:
+    """在子进程中读取并切分一个文件，返回其全部文本块"""
+    if item.get("archive"):
+        with zipfile.ZipFile(item["archive"]) as archive:
+            text = _decode(archive.read(item["member"]))
+        chunks, text_length = list(iter_text_chunks(text, _splitter, _chunk_size)), len(text)
+    else:
+        encoding, text_length = scan_text(item["path"])
+        chunks = list(iter_file_chunks(item["path"], _splitter, _chunk_size, encoding))
+    return {**item, "chunks": chunks, "text_length": text_length}
+
+
+def discover(input_path: Path, extensions: tuple) -> List[Dict]:
+    """列出要导入的文件；source 为相对路径，signature 用于判断文件是否变化"""
+    items = []
+    if zipfile.is_zipfile(input_path):
+        with zipfile.ZipFile(input_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(extensions):
+                    items.append({"archive": str(input_path), "member": info.filename, "source": info.filename,
+                                  "size": info.file_size, "signature": f"{info.file_size}:{info.CRC}"})
+    else:
+        for path in sorted(input_path.rglob("*")):
+            if path.is_file() and path.suffix.lower() in extensions:
+                stat = path.stat()
+                items.append({"path": str(path), "source": path.relative_to(input_path).as_posix(),
+                              "size": stat.st_size, "signature": f"{stat.st_size}:{stat.st_mtime_ns}"})
+    return items
+
+
+class Manifest:
+    """已完成文件的清单（JSON Lines，每完成一个文件追加一行）"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done: Dict[str, str] = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.done[entry["source"]] = entry["signature"]
+
+    def is_done(self, item: Dict) -> bool:
+        return self.done.get(item["source"]) == item["signature"]
+
+    def record(self, entries: List[Dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self.done[entry["source"]] = entry["signature"]
+
+
+class ProgressReporter:
+    """按字节数估算进度，定期输出吞吐量和预计剩余时间"""
+
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.bytes_done = 0
+        self.started = time.monotonic()
+        self._last_print = 0.0
+
+    def file_done(self, size: int):
+        self.files_done += 1
+        self.bytes_done += size
+
+    def print(self, stats: Dict, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_print < PROGRESS_INTERVAL_SECONDS:
+            return
+        self._last_print = now
+        elapsed = now - self.started
+        fraction = self.bytes_done / self.total_bytes if self.total_bytes else 1.0
+        eta = elapsed * (1 - fraction) / fraction if fraction else None
+        print(f"[{elapsed:7.0f}s] 文件 {self.files_done}/{self.total_files} ({fraction:.1%})"
+              f"  已写入 {stats['chunks_written']} 块  {stats['chunks_written'] / elapsed if elapsed else 0:.1f} 块/秒"
+              f"  {self.bytes_done / elapsed / 1024 if elapsed else 0:.0f} KB/秒"
+              f"  剩余约 {'-' if eta is None else f'{eta:.0f}s'}", flush=True)
+
+
+def run(input_path: Path, knowledge_base: str, user: str, params: Dict, workers: int,
+        extensions: tuple, manifest_path: Optional[Path], bulk: bool) -> Dict:
+    """导入 input_path 下的文件，返回新增/未变化/删除的块数和各阶段吞吐量"""
+    # 主进程才加载模型和数据库连接
+    from rag.initRAGDB_local_model_wf import (
+        EMBED_BATCH_SIZE, ProcessingState, _batched, _chunk_row, _collection_embedder, _delete_rows,
+        _load_chunk_diff, deferred_ann_indexes, embedding_model_of, extract_metadata, get_db_connection,
+        load_rows, make_chunk, token_limit_check
+    )
+    from rag.ingestPipeline import IngestPipeline
+
+    manifest = Manifest(manifest_path or input_path.with_name(f"{input_path.name}.{knowledge_base}.manifest.jsonl"))
+    items = discover(input_path, extensions)
+    todo = [item for item in items if not manifest.is_done(item)]
+    print(f"共 {len(items)} 个文件，清单 {manifest.path} 中已完成 {len(items) - len(todo)} 个，"
+          f"本次导入 {len(todo)} 个", flush=True)
+
+    state = ProcessingState(user=user, knowledge_base_name=knowledge_base, metadata={"source": str(input_path)})
+    base_metadata = {**extract_metadata(state)["metadata"], **params}
+    document_id = base_metadata["document_id"]
+    # 已有知识库可能仍在使用旧模型，切分、超长检查和嵌入都以它为准
+    model = embedding_model_of(document_id)
+    embed, revalidate = _collection_embedder(document_id, model)
+    limit_check = token_limit_check(model)
+    reporter = ProgressReporter(len(todo), sum(item["size"] for item in todo))
+    totals = {"added": 0, "unchanged": 0, "deleted": 0}
+    last_chunk_of = {}  # id(文件最后一个待写入的块) -> 该文件的完成记录
+    written = []  # 写库线程：本批中写完的文件，提交后记入清单
+    unrecorded = []  # 单事务导入时，提交前暂不记入清单的文件
+    finish_lock = threading.Lock()  # 主线程和写库线程都会记录完成的文件
+    # --bulk：写库线程删除向量索引后持有排他锁直到提交，其他连接上的查询和删除都会等待它，
+    # 因此先读出所有文件的已入库哈希，没有新块的文件的旧块留到写库连接上最后删除
+    diffs = {item["source"]: _load_chunk_diff(document_id, item["source"]) for item in todo} if bulk else {}
+    deferred_stale = []
+
+    def finish(entries: List[Dict], stats: Dict, final: bool = False):
+        with finish_lock:
+            if bulk and not final:
+                unrecorded.extend(entries)
+                return
+            manifest.record([{k: entry[k] for k in ("source", "signature", "added", "unchanged", "deleted")}
+                             for entry in entries])
+            for entry in entries:
+                for key in totals:
+                    totals[key] += entry[key]
+                reporter.file_done(entry["size"])
+            reporter.print(stats)
+
+    def parsed_files() -> Iterator[Dict]:
+        # 按顺序取回子进程的切分结果，同时在途的文件数有上限
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(params, model)) as pool:
+            queue = iter(todo)
+            pending = deque(pool.submit(_parse, item) for item in
+                            (next(queue) for _ in range(min(len(todo), workers * PREFETCH_PER_WORKER))))
+            while pending:
+                result = pending.popleft().result()
+                item = next(queue, None)
+                if item is not None:
+                    pending.append(pool.submit(_parse, item))
+                yield result
+
+    def chunks() -> Iterator:
+        for parsed in parsed_files():
+            metadata = {**base_metadata, "source": parsed["source"], "text_length": parsed["text_length"]}
+            diff = diffs.pop(parsed["source"]) if bulk else _load_chunk_diff(document_id, parsed["source"])
+            file_chunks = list(diff.filter(limit_check.filter(make_chunk(text, metadata) for text in parsed["chunks"])))
+            entry = {"source": parsed["source"], "signature": parsed["signature"], "size": parsed["size"],
+                     "added": diff.added, "unchanged": diff.unchanged, "stale": diff.stale_ids()}
+            entry["deleted"] = len(entry["stale"])
+            if file_chunks:
+                last_chunk_of[id(file_chunks[-1])] = entry
+                yield from file_chunks
+                continue
+            # 没有需要嵌入的块：直接删除旧块并记入清单
+            if entry["stale"] and bulk:
+                deferred_stale.extend(entry.pop("stale"))
+            elif entry["stale"]:
+                with get_db_connection() as conn:
+                    _delete_rows(conn, entry.pop("stale"))
+                    conn.commit()
+            finish([entry], pipeline.stats())
+
+    def write(cursor, batch: list, vectors: list):
+        vectors = revalidate(cursor, batch, vectors)
+        load_rows(cursor, [_chunk_row(document_id, chunk, vector) for chunk, vector in zip(batch, vectors)])
+        for chunk in batch:
+            entry = last_chunk_of.pop(id(chunk), None)
+            if entry:
+                # 文件的最后一批：在同一事务中删除该文件不再出现的旧块
+                _delete_rows(cursor.connection, entry.pop("stale"))
+                written.append(entry)
+
+    def on_commit(stats: Dict):
+        entries, written[:] = written[:], []
+        finish(entries, stats)
+
+    @contextmanager
+    def bulk_load(conn):
+        with deferred_ann_indexes(conn):
+            yield
+            _delete_rows(conn, deferred_stale)
+
+    pipeline = IngestPipeline(embed, get_db_connection, write, on_commit,
+                              single_transaction=bulk, around_load=bulk_load if bulk else None)
+    stats = pipeline.run(_batched(chunks(), EMBED_BATCH_SIZE))
+    if bulk:
+        finish(unrecorded, stats, final=True)
+    reporter.print(stats, force=True)
+    limit_check.warn(str(input_path))
+    return {**totals, "files": len(todo), "chunks_over_limit": limit_check.over_limit,
+            "chunks_per_second": stats["chunks_per_second"], "elapsed_seconds": stats["elapsed_seconds"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", type=Path, help="目录或zip压缩包")
+    parser.add_argument("--knowledge-base", required=True)
+    parser.add_argument("--user", default="anonymous")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--separators", default="", help="逗号分隔的分割字符串")
+    parser.add_argument("--length-unit", choices=LENGTH_UNITS, default="chars")
+    parser.add_argument("--extensions", default=",".join(DEFAULT_EXTENSIONS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="读取和切分文件的进程数")
+    parser.add_argument("--manifest", type=Path, help="默认为输入旁边的 <名称>.<知识库>.manifest.jsonl")
+    parser.add_argument("--bulk", action="store_true",
+                        help="单个事务导入并在导入期间删除向量索引（初次导入用，期间查询会等待）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    params = {"chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap,
+              "separators": args.separators, "length_unit": args.length_unit}
+    extensions = tuple(ext if ext.startswith(".") else f".{ext}" for ext in args.extensions.lower().split(","))
+    result = run(args.input.resolve(), args.knowledge_base, args.user, params, args.workers,
+                 extensions, args.manifest, args.bulk)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
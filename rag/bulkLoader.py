@@ -0,0 +1,125 @@
+import io
+import logging
+import re
+import struct
+import uuid
+from contextlib import contextmanager
+from typing import Iterable, List, Sequence
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+EMBEDDING_COLUMNS = ("collection_id", "embedding", "document", "cmetadata", "custom_id", "uuid")
+# 二进制COPY按列类型编码，表结构与此不一致时回退为 execute_values
+BINARY_COPY_TYPES = ("uuid", "vector", "varchar", "json", "varchar", "uuid")
+EXECUTE_VALUES_PAGE_SIZE = 1000
+ANN_INDEX_METHODS = ("hnsw", "ivfflat")
+
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+_copy_supported = {}
+
+
+def _field(data: bytes) -> bytes:
+    return struct.pack("!i", len(data)) + data
+
+
+def _encode_value(column_type: str, value) -> bytes:
+    if value is None:
+        return struct.pack("!i", -1)
+    if column_type == "uuid":
+        return _field(uuid.UUID(str(value)).bytes)
+    if column_type == "vector":
+        # pgvector 二进制格式：int16 维度、int16 保留位、float4 数组（网络字节序）
+        return _field(struct.pack(f"!hh{len(value)}f", len(value), 0, *value))
+    # varchar/json 的二进制格式就是UTF-8文本
+    return _field(str(value).encode("utf-8"))
+
+
+def encode_copy_binary(rows: Iterable[Sequence], column_types: Sequence[str] = BINARY_COPY_TYPES) -> bytes:
+    """把行编码为 COPY ... (FORMAT binary) 的输入流"""
+    buffer = io.BytesIO()
+    buffer.write(_COPY_HEADER)
+    tuple_header = struct.pack("!h", len(column_types))
+    for row in rows:
+        buffer.write(tuple_header)
+        for column_type, value in zip(column_types, row):
+            buffer.write(_encode_value(column_type, value))
+    buffer.write(_COPY_TRAILER)
+    return buffer.getvalue()
+
+
+def copy_supported(cursor, table: str = EMBEDDING_TABLE) -> bool:
+    """表的列类型与 BINARY_COPY_TYPES 一致时才能使用二进制COPY（按表缓存结果）"""
+    if table not in _copy_supported:
+        cursor.execute("""
+            SELECT a.attname, t.typname
+            FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        """, (table,))
+        types = dict(cursor.fetchall())
+        actual = tuple(types.get(column) for column in EMBEDDING_COLUMNS)
+        _copy_supported[table] = actual == BINARY_COPY_TYPES
+        if not _copy_supported[table]:
+            logger.warning(f"{table} 列类型为 {actual}，不支持二进制COPY，改用 execute_values")
+    return _copy_supported[table]
+
+
+def copy_rows(cursor, rows: List[Sequence], table: str = EMBEDDING_TABLE):
+    """用二进制COPY写入行（行的列顺序同 EMBEDDING_COLUMNS）"""
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(EMBEDDING_COLUMNS)}) FROM STDIN WITH (FORMAT binary)",
+        io.BytesIO(encode_copy_binary(rows))
+    )
+
+
+def execute_values_rows(cursor, rows: List[Sequence], table: str = EMBEDDING_TABLE,
+                        page_size: int = EXECUTE_VALUES_PAGE_SIZE):
+    """用多行VALUES写入行，每条语句最多 page_size 行"""
+    execute_values(
+        cursor,
+        f"INSERT INTO {table} ({', '.join(EMBEDDING_COLUMNS)}) VALUES %s",
+        rows,
+        template="(%s, %s::vector, %s, %s, %s, %s)",
+        page_size=page_size
+    )
+
+
+def load_rows(cursor, rows: List[Sequence], table: str = EMBEDDING_TABLE):
+    """批量写入行：优先二进制COPY，表结构不匹配时使用 execute_values"""
+    if not rows:
+        return
+    if copy_supported(cursor, table):
+        copy_rows(cursor, rows, table)
+    else:
+        execute_values_rows(cursor, rows, table)
+
+
+def ann_indexes(cursor, table: str = EMBEDDING_TABLE) -> List[tuple]:
+    """表上的向量近似索引 (名称, 定义)"""
+    cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", (table,))
+    pattern = re.compile(rf"\bUSING\s+({'|'.join(ANN_INDEX_METHODS)})\b", re.IGNORECASE)
+    return [(name, definition) for name, definition in cursor.fetchall() if pattern.search(definition)]
+
+
+@contextmanager
+def deferred_ann_indexes(conn, table: str = EMBEDDING_TABLE):
+    """在当前事务中删除向量近似索引，写入结束后按原定义重建
+
+    大量写入时逐行维护HNSW/IVFFlat索引远比最后一次性构建慢。删除索引会对表
+    加排他锁直到事务提交，期间该表上的查询会等待，只适合初次导入或离线重建。
+    出错时事务回滚，索引随之恢复。
+    """
+    with conn.cursor() as cursor:
+        indexes = ann_indexes(cursor, table)
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX "{name}"')
+    if indexes:
+        logger.info(f"写入期间暂时删除向量索引: {[name for name, _ in indexes]}")
+    yield
+    with conn.cursor() as cursor:
+        for name, definition in indexes:
+            logger.info(f"重建向量索引 {name}...")
+            cursor.execute(definition)
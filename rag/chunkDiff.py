@@ -0,0 +1,51 @@
+import hashlib
+import threading
+from typing import Dict, Iterable, Iterator, List
+
+from langchain_core.documents import Document
+
+# 文本块内容哈希在 cmetadata 中的键
+CHUNK_HASH_KEY = "chunk_hash"
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ChunkDiff:
+    """把重新切分出的文本块与同一来源已入库的块按内容哈希比对
+
+    existing 为 {哈希: [行uuid, ...]}（同一内容可能出现多次）。filter() 只放行
+    新增或内容变化的块；迭代结束后 stale_ids() 为不再出现的旧块，应在写入新块的
+    同一事务中删除。filter() 未迭代完（切分中途出错）时无法区分已删除和尚未
+    比对到的旧块，此时 stale_ids() 抛出异常。
+    """
+
+    def __init__(self, existing: Dict[str, List[str]]):
+        self._existing = {h: list(ids) for h, ids in existing.items()}
+        self._lock = threading.Lock()
+        self.had_existing = bool(existing)
+        self.added = 0
+        self.unchanged = 0
+        self.complete = False
+
+    def filter(self, chunks: Iterable[Document]) -> Iterator[Document]:
+        for chunk in chunks:
+            with self._lock:
+                ids = self._existing.get(chunk.metadata[CHUNK_HASH_KEY])
+                if ids:
+                    ids.pop()
+                    self.unchanged += 1
+                    continue
+                self.added += 1
+            yield chunk
+        self.complete = True
+
+    def stale_ids(self) -> List[str]:
+        if not self.complete:
+            raise RuntimeError("文本块尚未全部比对，不能确定哪些旧块已删除")
+        with self._lock:
+            return [row_id for ids in self._existing.values() for row_id in ids]
+
+    def counts(self) -> Dict[str, int]:
+        return {"chunks_added": self.added, "chunks_unchanged": self.unchanged}
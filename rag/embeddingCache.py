@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存上限，超出后按最近使用时间淘汰
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# 每次淘汰到上限的这个比例，避免每次写入都触发淘汰
+EVICT_TO_RATIO = 0.9
+# SQLite 单条语句的参数个数有上限，按此分批查询
+LOOKUP_BATCH = 500
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFKC 规范化并合并空白：只有空白或全半角差异的文本共用一个缓存项"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """磁盘上的嵌入向量缓存（SQLite，向量按float32紧凑存储）
+
+    键为 (模型名, 用途, 规范化文本) 的SHA-256，同一文件可被多个进程共享。
+    总大小超过 max_bytes 时淘汰最久未使用的记录。大小取自数据库文件实际占用的页数，
+    其他进程（批量导入的子进程、其他Web进程、模型迁移）写入的记录同样计入。
+    """
+
+    def __init__(self, path: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, kind: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{kind}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items: Dict[bytes, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            # 同一键的向量相同：已存在（可能由其他进程刚写入）的记录不重复写
+            changes = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+            if self._conn.total_changes > changes and self._size() > self.max_bytes:
+                self._evict()
+
+    def _size(self) -> int:
+        """数据库已使用的字节数（不含空闲页），各进程写入的记录都包括在内"""
+        page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self):
+        size = self._size()
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if not count or size <= self.max_bytes:
+            return
+        # 删除的页进入空闲列表供后续写入复用，文件本身不缩小
+        keep = int(count * self.max_bytes * EVICT_TO_RATIO / size)
+        self._conn.execute("""
+            DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+            )
+        """, (count - keep,))
+        self._conn.commit()
+        logger.info(f"嵌入缓存超出上限，淘汰 {count - keep} 条")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": str(self.path),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "size_bytes": self._size(),
+                "max_bytes": self.max_bytes,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """先查缓存、只对未命中的文本调用模型的嵌入封装，接口与被封装的模型相同"""
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def _embed(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        keys = [EmbeddingCache.make_key(self.model_name, kind, text) for text in texts]
+        found = self.cache.get_many(keys)
+        # 未命中的文本去重后一次性计算
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            computed = dict(zip(missing, compute(list(missing.values()))))
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", texts, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text], lambda missing: [self.underlying.embed_query(missing[0])])[0]
@@ -0,0 +1,326 @@
+import logging
+import threading
+import time
+from contextlib import closing
+from typing import Callable, Dict, List, Optional
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# 每个知识库当前使用的嵌入模型，以及迁移中的目标模型
+MODEL_TABLE = "collection_embedding_model"
+# 迁移期间新模型的向量写在影子列中，切换时整体替换 embedding 列
+SHADOW_COLUMN = "embedding_shadow"
+MIGRATION_BATCH_SIZE = 64
+# 默认限速：后台重新嵌入不挤占在线查询和入库的CPU
+MIGRATION_ROWS_PER_SECOND = 100
+# 模型记录表中的迁移状态：只有 running 的迁移在进程重启后继续
+MIGRATION_RUNNING = "running"
+MIGRATION_CANCELLED = "cancelled"
+MIGRATION_FAILED = "failed"
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def ensure_schema(connect: Callable, current_model: str):
+    """创建模型记录表（每个进程只执行一次）
+
+    首次建表时把已有的知识库都登记为 current_model（此前入库用的就是配置中的模型），
+    之后修改 config.json 中的 embedding_model 不会让旧知识库改用新模型查询。
+    """
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with closing(connect()) as conn:
+            with conn.cursor() as cursor:
+                # 多个进程同时启动时只有一个建表并登记已有知识库
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (MODEL_TABLE,))
+                cursor.execute("SELECT to_regclass(%s)", (MODEL_TABLE,))
+                created = cursor.fetchone()[0] is None
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {MODEL_TABLE} (
+                        collection_id uuid PRIMARY KEY REFERENCES langchain_pg_collection(uuid) ON DELETE CASCADE,
+                        model varchar NOT NULL,
+                        target_model varchar NULL,
+                        migration_status varchar NULL,
+                        migration_error text NULL,
+                        updated_at timestamp DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cursor.execute(f"""
+                    ALTER TABLE {MODEL_TABLE}
+                        ADD COLUMN IF NOT EXISTS migration_status varchar NULL,
+                        ADD COLUMN IF NOT EXISTS migration_error text NULL
+                """)
+                if created:
+                    cursor.execute(f"""
+                        INSERT INTO {MODEL_TABLE} (collection_id, model)
+                        SELECT uuid, %s FROM langchain_pg_collection
+                        ON CONFLICT (collection_id) DO NOTHING
+                    """, (current_model,))
+                    logger.info(f"已有的 {cursor.rowcount} 个知识库登记为嵌入模型 {current_model}")
+            conn.commit()
+        _schema_ready = True
+
+
+def record_collection_model(cursor, collection_id: str, model: str):
+    """登记知识库的嵌入模型（已有记录时不变）"""
+    cursor.execute(f"""
+        INSERT INTO {MODEL_TABLE} (collection_id, model) VALUES (%s, %s)
+        ON CONFLICT (collection_id) DO NOTHING
+    """, (collection_id, model))
+
+
+def collection_model(cursor, collection_id: str, default_model: str) -> str:
+    """知识库向量所用的模型；知识库创建时即登记，尚无记录的（还没有向量）按默认模型"""
+    cursor.execute(f"SELECT model FROM {MODEL_TABLE} WHERE collection_id = %s", (collection_id,))
+    row = cursor.fetchone()
+    return row[0] if row else default_model
+
+
+def lock_collection_model(cursor, collection_id: str, default_model: str) -> str:
+    """在当前事务中对知识库的模型记录加共享锁并返回当前模型
+
+    写入向量的事务持有共享锁，模型切换持有排他锁：切换要等正在写入的批次提交，
+    切换之后开始的批次读到的是新模型。
+    """
+    record_collection_model(cursor, collection_id, default_model)
+    cursor.execute(f"SELECT model FROM {MODEL_TABLE} WHERE collection_id = %s FOR SHARE", (collection_id,))
+    return cursor.fetchone()[0]
+
+
+class EmbeddingMigrator:
+    """后台把知识库的向量重新嵌入为新模型，完成后原子切换
+
+    - 迁移期间查询和入库继续使用旧模型和 embedding 列
+    - 新模型的向量按限速分批写入影子列，每批提交，中断后从未完成的行继续
+    - 切换在一个事务中完成：补齐期间新写入的行，用影子列替换 embedding 列，更新模型记录
+    - 迁移状态（running/cancelled/failed）记在模型记录表中：取消和失败在重启后仍然有效，
+      任一进程发起的取消都会被执行迁移的进程看到
+    - 执行前取得该知识库的会话级 advisory lock，多个进程（如多个Web worker）不会重复执行同一迁移
+    """
+
+    def __init__(self, connect: Callable, get_embeddings: Callable[[str], object], default_model: str):
+        self.connect = connect
+        self.get_embeddings = get_embeddings
+        self.default_model = default_model
+        self._status: Dict[str, dict] = {}
+        self._cancel: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def status(self, collection_id: Optional[str] = None):
+        """迁移进度；本进程未执行的迁移按模型记录表中的状态返回（无进度信息）"""
+        with self._lock:
+            local = {cid: dict(status) for cid, status in self._status.items()
+                     if collection_id is None or cid == collection_id}
+        ensure_schema(self.connect, self.default_model)
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT collection_id::text, target_model, migration_status, migration_error FROM {MODEL_TABLE}
+                    WHERE target_model IS NOT NULL AND (%s::uuid IS NULL OR collection_id = %s::uuid)
+                """, (collection_id, collection_id))
+                stored = cursor.fetchall()
+        for cid, target_model, status, error in stored:
+            if cid not in local or local[cid]["status"] == "skipped":
+                local[cid] = {"collection_id": cid, "target_model": target_model, "status": status,
+                              "error": error, "other_process": True}
+        if collection_id is not None:
+            return local.get(str(collection_id), {})
+        return list(local.values())
+
+    def start(self, collection_id: str, target_model: str,
+              rows_per_second: float = MIGRATION_ROWS_PER_SECOND) -> dict:
+        """开始（或继续）迁移；同一知识库已在迁移时返回其状态"""
+        collection_id = str(collection_id)
+        with self._lock:
+            current = self._status.get(collection_id)
+            if current and current["status"] == "running":
+                return dict(current)
+            self._status[collection_id] = {
+                "collection_id": collection_id, "target_model": target_model, "status": "running",
+                "rows_per_second_limit": rows_per_second, "done": 0, "total": None,
+                "rows_per_second": 0.0, "eta_seconds": None, "started_at": time.time(), "error": None,
+            }
+            self._cancel[collection_id] = threading.Event()
+        threading.Thread(target=self._run, args=(collection_id, target_model, rows_per_second),
+                         name=f"embedding-migration-{collection_id[:8]}", daemon=True).start()
+        return self.status(collection_id)
+
+    def cancel(self, collection_id: str) -> dict:
+        """停止迁移：已写入影子列的向量保留，重新开始时继续；查询不受影响"""
+        collection_id = str(collection_id)
+        event = self._cancel.get(collection_id)
+        if event:
+            event.set()
+        # 记入数据库：重启后不再继续；迁移在其他进程中执行时由它在下一批前看到
+        self._set_state(collection_id, MIGRATION_CANCELLED)
+        return self.status(collection_id)
+
+    def resume_pending(self, rows_per_second: float = MIGRATION_ROWS_PER_SECOND):
+        """继续进程重启前仍在执行的迁移（已取消或失败的不继续）"""
+        ensure_schema(self.connect, self.default_model)
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT collection_id::text, target_model FROM {MODEL_TABLE}
+                    WHERE target_model IS NOT NULL AND migration_status = %s
+                """, (MIGRATION_RUNNING,))
+                pending = cursor.fetchall()
+        for collection_id, target_model in pending:
+            logger.info(f"继续未完成的嵌入模型迁移: {collection_id} -> {target_model}")
+            self.start(collection_id, target_model, rows_per_second)
+
+    def _update(self, collection_id: str, **fields):
+        with self._lock:
+            self._status[collection_id].update(fields)
+
+    def _set_state(self, collection_id: str, state: str, error: Optional[str] = None):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    UPDATE {MODEL_TABLE} SET migration_status = %s, migration_error = %s, updated_at = now()
+                    WHERE collection_id = %s AND target_model IS NOT NULL
+                """, (state, error, collection_id))
+            conn.commit()
+
+    def _run(self, collection_id: str, target_model: str, rows_per_second: float):
+        try:
+            self._migrate(collection_id, target_model, rows_per_second)
+        except Exception as e:
+            logger.exception(f"嵌入模型迁移失败: {collection_id}")
+            self._update(collection_id, status="failed", error=str(e))
+            try:
+                self._set_state(collection_id, MIGRATION_FAILED, str(e))
+            except Exception:
+                logger.exception(f"记录迁移失败状态出错: {collection_id}")
+
+    @staticmethod
+    def _try_claim(conn, collection_id: str) -> bool:
+        """会话级 advisory lock，连接关闭时自动释放"""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (f"embedding_migration:{collection_id}",))
+            claimed = cursor.fetchone()[0]
+        conn.commit()
+        return claimed
+
+    @staticmethod
+    def _still_running(conn, collection_id: str) -> bool:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT migration_status FROM {MODEL_TABLE} WHERE collection_id = %s", (collection_id,))
+            row = cursor.fetchone()
+        conn.commit()
+        return bool(row) and row[0] == MIGRATION_RUNNING
+
+    def _prepare(self, conn, collection_id: str, target_model: str) -> bool:
+        """登记迁移目标；已是目标模型时返回False"""
+        with conn.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS {SHADOW_COLUMN} vector")
+            lock_collection_model(cursor, collection_id, self.default_model)
+            cursor.execute(f"SELECT model, target_model FROM {MODEL_TABLE} WHERE collection_id = %s FOR UPDATE",
+                           (collection_id,))
+            model, previous_target = cursor.fetchone()
+            if model == target_model:
+                cursor.execute(f"""
+                    UPDATE {MODEL_TABLE} SET target_model = NULL, migration_status = NULL, migration_error = NULL
+                    WHERE collection_id = %s
+                """, (collection_id,))
+                conn.commit()
+                return False
+            if previous_target != target_model:
+                # 目标模型变了，之前写入影子列的向量作废
+                cursor.execute(f"UPDATE langchain_pg_embedding SET {SHADOW_COLUMN} = NULL WHERE collection_id = %s",
+                               (collection_id,))
+            cursor.execute(f"""
+                UPDATE {MODEL_TABLE} SET target_model = %s, migration_status = %s, migration_error = NULL,
+                    updated_at = now()
+                WHERE collection_id = %s
+            """, (target_model, MIGRATION_RUNNING, collection_id))
+            cursor.execute(f"""
+                SELECT count(*), count({SHADOW_COLUMN}) FROM langchain_pg_embedding WHERE collection_id = %s
+            """, (collection_id,))
+            total, done = cursor.fetchone()
+        conn.commit()
+        self._update(collection_id, total=total, done=done)
+        return True
+
+    def _backfill_batch(self, conn, collection_id: str, embed: Callable[[List[str]], list]) -> int:
+        """为一批影子列为空的行计算新向量，返回处理的行数（不提交）"""
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT uuid::text, COALESCE(document, '') FROM langchain_pg_embedding
+                WHERE collection_id = %s AND {SHADOW_COLUMN} IS NULL
+                LIMIT %s
+            """, (collection_id, MIGRATION_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            vectors = embed([document for _, document in rows])
+            execute_values(cursor, f"""
+                UPDATE langchain_pg_embedding AS e SET {SHADOW_COLUMN} = v.vector::vector
+                FROM (VALUES %s) AS v(id, vector) WHERE e.uuid = v.id::uuid
+            """, [(row_id, vector) for (row_id, _), vector in zip(rows, vectors)])
+        return len(rows)
+
+    def _migrate(self, collection_id: str, target_model: str, rows_per_second: float):
+        ensure_schema(self.connect, self.default_model)
+        embed = self.get_embeddings(target_model).embed_documents
+        cancelled = self._cancel[collection_id]
+        with closing(self.connect()) as conn:
+            if not self._try_claim(conn, collection_id):
+                logger.info(f"嵌入模型迁移 {collection_id} 已由其他进程执行")
+                self._update(collection_id, status="skipped", error="其他进程正在执行该迁移")
+                return
+            if not self._prepare(conn, collection_id, target_model):
+                self._update(collection_id, status="succeeded", eta_seconds=0)
+                return
+
+            started = time.monotonic()
+            migrated = 0
+            while not cancelled.is_set():
+                count = self._backfill_batch(conn, collection_id, embed)
+                conn.commit()
+                if not count:
+                    break
+                migrated += count
+                elapsed = time.monotonic() - started
+                status = self.status(collection_id)
+                rate = migrated / elapsed if elapsed else 0.0
+                done = status["done"] + count
+                remaining = max(status["total"] - done, 0)
+                self._update(collection_id, done=done, rows_per_second=round(rate, 1),
+                             eta_seconds=round(remaining / rate) if rate else None)
+                # 限速：按目标速率应耗费的时间补足等待
+                if rows_per_second:
+                    cancelled.wait(max(migrated / rows_per_second - elapsed, 0))
+                if not self._still_running(conn, collection_id):
+                    cancelled.set()  # 其他进程发起了取消
+
+            if cancelled.is_set():
+                self._update(collection_id, status="cancelled")
+                logger.info(f"嵌入模型迁移已停止: {collection_id}")
+                return
+            self._switch(conn, collection_id, embed)
+        self._update(collection_id, status="succeeded", eta_seconds=0, finished_at=time.time())
+        logger.info(f"知识库 {collection_id} 已切换到嵌入模型 {target_model}")
+
+    def _switch(self, conn, collection_id: str, embed: Callable[[List[str]], list]):
+        with conn.cursor() as cursor:
+            # 排他锁：等待正在写入旧模型向量的批次提交，并阻止新的写入
+            cursor.execute(f"SELECT 1 FROM {MODEL_TABLE} WHERE collection_id = %s FOR UPDATE", (collection_id,))
+            # 补齐回填期间新入库的行
+            while self._backfill_batch(conn, collection_id, embed):
+                pass
+            cursor.execute(f"""
+                UPDATE langchain_pg_embedding SET embedding = {SHADOW_COLUMN}, {SHADOW_COLUMN} = NULL
+                WHERE collection_id = %s
+            """, (collection_id,))
+            cursor.execute(f"""
+                UPDATE {MODEL_TABLE} SET model = target_model, target_model = NULL,
+                    migration_status = NULL, migration_error = NULL, updated_at = now()
+                WHERE collection_id = %s
+            """, (collection_id,))
+        conn.commit()
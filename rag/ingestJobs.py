@@ -0,0 +1,445 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from rag.initRAGDB_local_model_wf import ingest_file, remove_upload_file, IngestCancelled
+
+logger = logging.getLogger(__name__)
+
+# 本进程内并发执行的入库任务数（嵌入模型占用CPU/内存，默认串行）
+INGEST_WORKERS = 1
+# 任务记录保留时间
+JOB_TTL_SECONDS = 24 * 3600
+# 执行中的任务持有租约并定期续期；节点崩溃后租约过期，任务重新排队
+JOB_LEASE_SECONDS = 60
+HEARTBEAT_INTERVAL_SECONDS = 15
+# 因节点失联重新排队的次数上限，超过后标记为失败（避免反复拖垮节点的任务无限重试）
+MAX_JOB_ATTEMPTS = 3
+# 失败或取消的任务在此时间内未重试，则删除其上传文件（须短于任务记录保留时间）
+RETRY_WINDOW_SECONDS = 12 * 3600
+# 检查过期租约和过期上传文件的周期
+MAINTENANCE_INTERVAL_SECONDS = 30
+# memory: 仅本进程；redis: 多个节点共享队列和任务状态（要求各节点共享上传目录）
+INGEST_QUEUE_BACKEND = os.getenv("INGEST_QUEUE_BACKEND", "memory")
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+RETRYABLE_STATUSES = ("failed", "cancelled")
+
+
+class MemoryJobBackend:
+    """进程内任务存储与队列
+
+    进程退出时任务随之丢失，无需租约：claim/renew 总是成功，没有失联的任务。
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        self._cancelled = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._retained: Dict[str, Tuple[str, float]] = {}
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def save(self, job: dict):
+        self._jobs[job["job_id"]] = json.loads(json.dumps(job))
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [k for k, v in self._jobs.items() if v["updated_at"] < cutoff]:
+            self._jobs.pop(job_id, None)
+            self._cancelled.discard(job_id)
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return json.loads(json.dumps(job)) if job else None
+
+    async def push(self, job_id: str):
+        await self._get_queue().put(job_id)
+
+    async def pop(self, timeout: float) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(self._get_queue().get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def request_cancel(self, job_id: str):
+        self._cancelled.add(job_id)
+
+    async def clear_cancel(self, job_id: str):
+        self._cancelled.discard(job_id)
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        return job_id in self._cancelled
+
+    async def claim(self, job_id: str, owner: str) -> bool:
+        return True
+
+    async def renew(self, job_id: str, owner: str) -> bool:
+        return True
+
+    async def release(self, job_id: str, owner: str):
+        pass
+
+    async def claim_abandoned(self, owner: str) -> List[str]:
+        return []
+
+    async def requeue(self, job_id: str, owner: str):
+        await self.push(job_id)
+
+    async def retain_upload(self, job_id: str, file_path: str, expires_at: float):
+        self._retained[job_id] = (file_path, expires_at)
+
+    async def release_upload(self, job_id: str):
+        self._retained.pop(job_id, None)
+
+    async def expired_uploads(self, now: float) -> List[Tuple[str, str]]:
+        return [(job_id, path) for job_id, (path, expires_at) in self._retained.items() if expires_at <= now]
+
+
+class RedisJobBackend:
+    """Redis任务存储与队列，复用会话的Redis连接池
+
+    取出任务用 BLMOVE 原子地从队列移到处理中列表，执行节点以 SET NX 取得租约并定期续期。
+    处理中列表里没有租约的任务（节点崩溃、或取出后未来得及取得租约）由任一节点
+    同样以 SET NX 抢到租约后重新排队，因此同一任务不会被两个节点同时执行。
+    """
+
+    QUEUE_KEY = "ingest_jobs:queue"
+    PROCESSING_KEY = "ingest_jobs:processing"
+    RETAINED_KEY = "ingest_jobs:retained_uploads"
+
+    def __init__(self, session_backend):
+        self.session_backend = session_backend
+
+    async def _redis(self):
+        await self.session_backend.connect()
+        return self.session_backend.redis_pool
+
+    async def save(self, job: dict):
+        redis = await self._redis()
+        await redis.setex(f"ingest_job:{job['job_id']}", JOB_TTL_SECONDS, json.dumps(job, ensure_ascii=False))
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        redis = await self._redis()
+        data = await redis.get(f"ingest_job:{job_id}")
+        return json.loads(data) if data else None
+
+    async def push(self, job_id: str):
+        redis = await self._redis()
+        await redis.rpush(self.QUEUE_KEY, job_id)
+
+    async def pop(self, timeout: float) -> Optional[str]:
+        redis = await self._redis()
+        return await redis.blmove(self.QUEUE_KEY, self.PROCESSING_KEY, int(max(timeout, 1)), "LEFT", "RIGHT")
+
+    async def request_cancel(self, job_id: str):
+        # 取消标记单独存放，避免与执行中的进度写入相互覆盖
+        redis = await self._redis()
+        await redis.setex(f"ingest_job:{job_id}:cancel", JOB_TTL_SECONDS, "1")
+
+    async def clear_cancel(self, job_id: str):
+        redis = await self._redis()
+        await redis.delete(f"ingest_job:{job_id}:cancel")
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        redis = await self._redis()
+        return bool(await redis.exists(f"ingest_job:{job_id}:cancel"))
+
+    async def claim(self, job_id: str, owner: str) -> bool:
+        redis = await self._redis()
+        return bool(await redis.set(f"ingest_job:{job_id}:lease", owner, nx=True, ex=JOB_LEASE_SECONDS))
+
+    async def renew(self, job_id: str, owner: str) -> bool:
+        redis = await self._redis()
+        key = f"ingest_job:{job_id}:lease"
+        if await redis.get(key) != owner:
+            return False
+        return bool(await redis.set(key, owner, xx=True, ex=JOB_LEASE_SECONDS))
+
+    async def release(self, job_id: str, owner: str):
+        # 租约已失效时任务可能已被重新排队并由其他节点执行，不能动它的处理中记录
+        redis = await self._redis()
+        key = f"ingest_job:{job_id}:lease"
+        if await redis.get(key) == owner:
+            await redis.lrem(self.PROCESSING_KEY, 0, job_id)
+            await redis.delete(key)
+
+    async def claim_abandoned(self, owner: str) -> List[str]:
+        """处理中但没有有效租约的任务，逐个抢到租约后返回，由调用方重新排队或标记失败"""
+        redis = await self._redis()
+        claimed = []
+        for job_id in dict.fromkeys(await redis.lrange(self.PROCESSING_KEY, 0, -1)):
+            if await self.claim(job_id, owner):
+                claimed.append(job_id)
+        return claimed
+
+    async def requeue(self, job_id: str, owner: str):
+        # 先移出处理中列表再入队：入队后立即被取走但抢不到租约的，留在处理中列表等下次回收
+        redis = await self._redis()
+        await redis.lrem(self.PROCESSING_KEY, 0, job_id)
+        await redis.rpush(self.QUEUE_KEY, job_id)
+        await redis.delete(f"ingest_job:{job_id}:lease")
+
+    async def retain_upload(self, job_id: str, file_path: str, expires_at: float):
+        redis = await self._redis()
+        await redis.hset(self.RETAINED_KEY, job_id, json.dumps({"file_path": file_path, "expires_at": expires_at}))
+
+    async def release_upload(self, job_id: str):
+        redis = await self._redis()
+        await redis.hdel(self.RETAINED_KEY, job_id)
+
+    async def expired_uploads(self, now: float) -> List[Tuple[str, str]]:
+        redis = await self._redis()
+        expired = []
+        for job_id, data in (await redis.hgetall(self.RETAINED_KEY)).items():
+            entry = json.loads(data)
+            if entry["expires_at"] <= now:
+                expired.append((job_id, entry["file_path"]))
+        return expired
+
+
+class IngestJobManager:
+    """知识库入库任务：提交后立即返回任务ID，由后台工作协程在线程中执行入库流程
+
+    进度（已切分/已嵌入/已写入的块数）随流程回调写入任务记录，可轮询或通过SSE获取；
+    取消在下一个进度点生效，已提交的批次保留；失败或取消的任务可重试，已写入的块按内容哈希跳过。
+    上传文件保留到成功为止，失败或取消后 RETRY_WINDOW_SECONDS 内未重试则删除。
+    执行中的任务持有租约，节点崩溃后由其他节点重新排队（最多 MAX_JOB_ATTEMPTS 次）。
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS):
+        self.workers = workers
+        self.backend = MemoryJobBackend()
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 租约持有者标识：节点+进程
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self, redis_backend=None):
+        """启动工作协程；传入会话的RedisBackend时使用Redis队列"""
+        if redis_backend is not None:
+            self.backend = RedisJobBackend(redis_backend)
+        self._loop = asyncio.get_running_loop()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+        logger.info(f"入库任务队列已启动: {type(self.backend).__name__}, {self.workers} 个工作协程")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, file_path: str, params: dict, owner: str) -> dict:
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "owner": owner,
+            "file_path": file_path,
+            "params": params,
+            "progress": {"stage": "queued", "chunks_split": 0, "chunks_embedded": 0, "chunks_written": 0},
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.backend.save(job)
+        await self.backend.push(job["job_id"])
+        logger.info(f"入库任务已提交: {job['job_id']} {params.get('source')}")
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.backend.load(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        job = await self.backend.load(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return job
+        await self.backend.request_cancel(job_id)
+        if job["status"] == "queued":
+            # 尚未开始：直接标记，工作协程取到后跳过
+            job.update(status="cancelled", updated_at=time.time(), finished_at=time.time())
+            job["progress"]["stage"] = "cancelled"
+            await self.backend.save(job)
+            await self._retain_upload(job)
+        return job
+
+    async def retry(self, job_id: str) -> Optional[dict]:
+        job = await self.backend.load(job_id)
+        if job is None or job["status"] not in ("failed", "cancelled"):
+            return job
+        if not os.path.exists(job["file_path"]):
+            job["error"] = "上传文件已不存在，无法重试"
+            return job
+        await self.backend.clear_cancel(job_id)
+        await self.backend.release_upload(job_id)
+        job.update(status="queued", error=None, result=None, updated_at=time.time())
+        job["progress"] = {"stage": "queued", "chunks_split": 0, "chunks_embedded": 0, "chunks_written": 0}
+        await self.backend.save(job)
+        await self.backend.push(job_id)
+        return job
+
+    async def events(self, job_id: str, interval: float = 0.5) -> AsyncGenerator[dict, None]:
+        """任务状态有变化时产出一次，直到任务结束"""
+        last_update = None
+        while True:
+            job = await self.backend.load(job_id)
+            if job is None:
+                return
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(interval)
+
+    async def _worker(self):
+        while True:
+            try:
+                job_id = await self.backend.pop(timeout=5)
+                if job_id and await self.backend.claim(job_id, self.owner):
+                    try:
+                        await self._run(job_id)
+                    finally:
+                        await self.backend.release(job_id, self.owner)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("入库任务工作协程异常")
+                await asyncio.sleep(1)
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self._requeue_abandoned()
+                await self._expire_uploads()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("入库任务维护失败")
+            await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+    async def _requeue_abandoned(self):
+        """租约过期（执行节点崩溃）的任务重新排队，超过尝试次数的标记为失败"""
+        for job_id in await self.backend.claim_abandoned(self.owner):
+            job = await self.backend.load(job_id)
+            if job is None or job["status"] in TERMINAL_STATUSES:
+                await self.backend.release(job_id, self.owner)
+                continue
+            if job["status"] == "running" and job["attempts"] >= MAX_JOB_ATTEMPTS:
+                job = await self._update(job_id, status="failed", finished_at=time.time(), progress={"stage": "failed"},
+                                         error=f"执行节点失联，已尝试 {job['attempts']} 次")
+                await self.backend.release(job_id, self.owner)
+                await self._retain_upload(job)
+                logger.warning(f"入库任务 {job_id} 执行节点失联且已达尝试上限，标记为失败")
+                continue
+            if job["status"] == "running":
+                await self._update(job_id, status="queued", progress={"stage": "queued"})
+                logger.warning(f"入库任务 {job_id} 执行节点失联，重新排队")
+            await self.backend.requeue(job_id, self.owner)
+
+    async def _retain_upload(self, job: Optional[dict]):
+        if job and job["status"] in RETRYABLE_STATUSES:
+            await self.backend.retain_upload(job["job_id"], job["file_path"], time.time() + RETRY_WINDOW_SECONDS)
+
+    async def _expire_uploads(self):
+        """删除失败或取消后超过重试期限的任务的上传文件"""
+        for job_id, file_path in await self.backend.expired_uploads(time.time()):
+            job = await self.backend.load(job_id)
+            if job is None or job["status"] in RETRYABLE_STATUSES:
+                await asyncio.to_thread(remove_upload_file, file_path)
+                if job is not None:
+                    await self._update(job_id, upload_expired=True)
+                logger.info(f"入库任务 {job_id} 超过重试期限，已删除上传文件")
+            await self.backend.release_upload(job_id)
+
+    async def _update(self, job_id: str, **fields) -> Optional[dict]:
+        job = await self.backend.load(job_id)
+        if job is None:
+            return None
+        progress = fields.pop("progress", None)
+        if progress:
+            job["progress"].update(progress)
+        job.update(fields, updated_at=time.time())
+        await self.backend.save(job)
+        return job
+
+    async def _on_progress(self, job_id: str, stage: str, counts: dict) -> bool:
+        await self._update(job_id, progress={"stage": stage, **counts})
+        return await self.backend.cancel_requested(job_id)
+
+    async def _run(self, job_id: str):
+        job = await self.backend.load(job_id)
+        if job is None or job["status"] != "queued":
+            return  # 排队期间已取消或已过期
+        job = await self._update(job_id, status="running", attempts=job["attempts"] + 1,
+                                 started_at=time.time(), progress={"stage": "reading"})
+        loop = self._loop
+        lease_lost = asyncio.Event()
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+                try:
+                    renewed = await self.backend.renew(job_id, self.owner)
+                except Exception:
+                    logger.exception(f"入库任务 {job_id} 续租失败")
+                    continue  # 租约未过期前还可再试
+                if not renewed:
+                    lease_lost.set()
+                    return
+
+        def progress(stage: str, **counts):
+            # 在入库线程中调用：把进度交回事件循环保存，并检查是否已请求取消
+            if lease_lost.is_set():
+                raise IngestCancelled(job_id)  # 任务已被其他节点重新排队
+            cancelled = asyncio.run_coroutine_threadsafe(self._on_progress(job_id, stage, counts), loop).result()
+            if cancelled:
+                raise IngestCancelled(job_id)
+
+        def run():
+            # 流式读取和切分，大文件不会整篇读入内存
+            return ingest_file(job["file_path"], progress=progress, **job["params"])
+
+        started = time.perf_counter()
+        heartbeat_task = asyncio.create_task(heartbeat())
+        try:
+            result = await asyncio.to_thread(run)
+        except IngestCancelled:
+            if lease_lost.is_set():
+                logger.warning(f"入库任务 {job_id} 租约已失效，停止执行")
+                return
+            job = await self._update(job_id, status="cancelled", finished_at=time.time(), progress={"stage": "cancelled"})
+            await self._retain_upload(job)
+            logger.info(f"入库任务已取消: {job_id}")
+            return
+        except Exception as e:
+            logger.exception(f"入库任务失败: {job_id}")
+            job = await self._update(job_id, status="failed", error=str(e), finished_at=time.time(),
+                                     progress={"stage": "failed"})
+            await self._retain_upload(job)
+            return
+        finally:
+            heartbeat_task.cancel()
+
+        if result.get("status") != "success":
+            job = await self._update(job_id, status="failed", result=result, error=result.get("message"),
+                                     finished_at=time.time(), progress={"stage": "failed"})
+            await self._retain_upload(job)
+            return
+
+        await asyncio.to_thread(remove_upload_file, job["file_path"])
+        await self._update(job_id, status="succeeded", result=result, finished_at=time.time(),
+                           elapsed_seconds=round(time.perf_counter() - started, 3), progress={"stage": "done"})
+        logger.info(f"入库任务完成: {job_id}, {result.get('num_chunks')} 个文本块")
+
+
+ingest_jobs = IngestJobManager()
@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, nullcontext
+from typing import Callable, ContextManager, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 并发执行嵌入的线程数（模型推理期间释放GIL）
+EMBED_WORKERS = 2
+# 已提交嵌入但尚未写库的批数上限：写库跟不上时切分和嵌入随之暂停
+PIPELINE_DEPTH = 4
+_POLL_SECONDS = 0.5
+# 切分阶段出错时发给写库线程的结束标记，与正常结束的 None 区分
+_ABORT = object()
+
+
+class PipelineAborted(Exception):
+    """切分阶段出错，写库线程放弃未提交的写入"""
+
+
+class StageMeter:
+    """统计单个阶段处理的块数与耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.busy_seconds = 0.0
+
+    def add(self, count: int, seconds: float):
+        with self._lock:
+            self.count += count
+            self.busy_seconds += seconds
+
+    def rate(self) -> float:
+        """每秒处理的块数（按该阶段实际工作时间计算，嵌入为单个线程的速率）"""
+        return round(self.count / self.busy_seconds, 1) if self.busy_seconds else 0.0
+
+
+class IngestPipeline:
+    """切分 -> 嵌入 -> 写库 流水线
+
+    - 调用线程迭代文本块批次（切分），提交到嵌入线程池
+    - 写库线程使用独立连接，按批次原顺序写入，每批提交一次作为检查点；
+      single_transaction 为True时全部写完才提交一次，around_load(conn) 包住整个写入过程
+    - 队列有界，写库较慢时反压到切分和嵌入，内存中最多 depth 批
+    - 任一阶段出错（包括进度回调抛出的取消异常）时停止流水线并在调用线程重新抛出；
+      已提交的批次保留，调用方可据此断点续传。切分出错时 around_load 收尾和最终提交都不会执行，
+      single_transaction 模式下整个写入回滚
+    """
+
+    def __init__(self, embed: Callable[[list], list], connect: Callable, write: Callable,
+                 on_commit: Optional[Callable[[Dict], None]] = None,
+                 embed_workers: int = EMBED_WORKERS, depth: int = PIPELINE_DEPTH,
+                 single_transaction: bool = False,
+                 around_load: Optional[Callable[[object], ContextManager]] = None):
+        self.embed = embed  # embed(texts) -> vectors
+        self.connect = connect  # connect() -> 新的数据库连接
+        self.write = write  # write(cursor, batch, vectors)
+        self.on_commit = on_commit  # on_commit(stats)，每批写入（提交）后调用
+        self.embed_workers = embed_workers
+        self.depth = depth
+        self.single_transaction = single_transaction
+        self.around_load = around_load
+        self.meters = {"split": StageMeter(), "embed": StageMeter(), "write": StageMeter()}
+        self._failed = threading.Event()
+        self._errors = []
+
+    def stats(self) -> Dict:
+        return {
+            "chunks_split": self.meters["split"].count,
+            "chunks_embedded": self.meters["embed"].count,
+            "chunks_written": self.meters["write"].count,
+            "chunks_per_second": {stage: meter.rate() for stage, meter in self.meters.items()},
+        }
+
+    def _embed(self, batch: list) -> list:
+        started = time.perf_counter()
+        vectors = self.embed([chunk.page_content for chunk in batch])
+        self.meters["embed"].add(len(batch), time.perf_counter() - started)
+        return vectors
+
+    def _writer(self, pending: queue.Queue):
+        try:
+            with closing(self.connect()) as conn:
+                try:
+                    with self.around_load(conn) if self.around_load else nullcontext():
+                        self._write_batches(conn, pending)
+                    started = time.perf_counter()
+                    conn.commit()
+                    self.meters["write"].add(0, time.perf_counter() - started)
+                except BaseException:
+                    conn.rollback()
+                    raise
+        except BaseException as e:
+            self._errors.append(e)
+            self._failed.set()
+
+    def _write_batches(self, conn, pending: queue.Queue):
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            if item is _ABORT:
+                raise PipelineAborted("切分阶段出错，放弃未提交的写入")
+            batch, future = item
+            vectors = future.result()
+            started = time.perf_counter()
+            with conn.cursor() as cursor:
+                self.write(cursor, batch, vectors)
+            if not self.single_transaction:
+                conn.commit()
+            self.meters["write"].add(len(batch), time.perf_counter() - started)
+            if self.on_commit:
+                self.on_commit(self.stats())
+
+    def _put(self, pending: queue.Queue, item) -> bool:
+        # 队列满时阻塞（反压），同时留意写库线程是否已失败
+        while not self._failed.is_set():
+            try:
+                pending.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _split(self, batches: Iterable[list]):
+        iterator = iter(batches)
+        while True:
+            started = time.perf_counter()
+            batch = next(iterator, None)
+            if batch is None:
+                return
+            self.meters["split"].add(len(batch), time.perf_counter() - started)
+            yield batch
+
+    def run(self, batches: Iterable[list]) -> Dict:
+        """执行流水线直到 batches 耗尽，返回各阶段统计"""
+        started = time.perf_counter()
+        pending = queue.Queue(maxsize=self.depth)
+        writer = threading.Thread(target=self._writer, args=(pending,), name="ingest-writer", daemon=True)
+        writer.start()
+        end = _ABORT
+        try:
+            with ThreadPoolExecutor(max_workers=self.embed_workers, thread_name_prefix="ingest-embed") as executor:
+                for batch in self._split(batches):
+                    if not self._put(pending, (batch, executor.submit(self._embed, batch))):
+                        # 写库线程已退出，丢弃尚未开始的嵌入
+                        executor.shutdown(wait=True, cancel_futures=True)
+                        break
+            end = None
+        finally:
+            # 切分出错时写库线程仍写完已入队的批次（逐批提交模式下保留为检查点），
+            # 随后收到 _ABORT 放弃收尾和最终提交，不会把未匹配的旧块当作已删除
+            self._put(pending, end)
+            writer.join()
+
+        if self._errors:
+            raise self._errors[0]
+        stats = self.stats()
+        elapsed = time.perf_counter() - started
+        stats["elapsed_seconds"] = round(elapsed, 3)
+        stats["chunks_per_second"]["overall"] = round(stats["chunks_written"] / elapsed, 1) if elapsed else 0.0
+        logger.info(f"流水线完成: {stats}")
+        return stats
@@ -1,17 +1,30 @@
 import uuid
+import functools
+import itertools
 import logging
 import psycopg2
 from datetime import datetime
 from langchain_core.documents import Document
 from langgraph.graph import END, StateGraph
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Callable, Iterable, Iterator
+from langchain_core.runnables import RunnableConfig
 import json
 from pathlib import Path
 from fastapi import UploadFile
-import shutil
 from rag.model_manager import model_manager,config
+from fileManage.uploadStore import UploadStore, UPLOAD_SIZE_LIMITS, safe_filename
+from fileManage.resumableUpload import ResumableUploads
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from rag.streamingChunker import scan_text, iter_file_chunks, iter_text_chunks, build_text_splitter
+from rag.ingestPipeline import IngestPipeline
+from rag.bulkLoader import load_rows, deferred_ann_indexes
+from rag.chunkDiff import ChunkDiff, chunk_hash, CHUNK_HASH_KEY
+from rag.tokenChunking import make_token_counter, TokenLimitCheck
+from rag.embeddingVersions import (
+    ensure_schema, collection_model, lock_collection_model, record_collection_model, EmbeddingMigrator
+)
+from contextlib import contextmanager, nullcontext
 
 # 使用嵌入模型
 embeddings = model_manager.embeddings
@@ -25,8 +38,25 @@ MODEL_CONFIG = config['model']
 APP_CONFIG = config['app']
 CONNECTION_STRING = f"postgresql+psycopg2://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['name']}"
 
+# 嵌入与写库的批大小，每批提交一次并汇报进度、检查是否已取消；
+# 流式入库时内存中最多只有流水线深度个批次
+EMBED_BATCH_SIZE = 64
+
+
+class IngestCancelled(Exception):
+    """入库任务被取消（由进度回调抛出，已提交的批次保留，重试时按内容哈希跳过）"""
+
+
+def _report(config: Optional[RunnableConfig], stage: str, **counts):
+    """调用任务的进度回调（通过 config["configurable"]["progress"] 传入）"""
+    progress = ((config or {}).get("configurable") or {}).get("progress")
+    if progress:
+        progress(stage, **counts)
+
 upload_dir = Path(APP_CONFIG.get('upload_dir', 'uploads'))
 upload_dir.mkdir(exist_ok=True, parents=True)
+upload_store = UploadStore(upload_dir, UPLOAD_SIZE_LIMITS["/uploadragfile"])
+resumable_uploads = ResumableUploads(upload_store)
 
 # 使用Pydantic定义状态
 class ProcessingState(BaseModel):
@@ -44,6 +74,7 @@ def extract_metadata(state: ProcessingState) -> dict:
     text_len = len(state.text) if state.text else 0
     collection_id = str(uuid.uuid4())
     try:
+        ensure_schema(get_db_connection, MODEL_CONFIG['embedding_model'])
         # 使用正确的连接参数 [1,7](@ref)
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
@@ -54,6 +85,8 @@ def extract_metadata(state: ProcessingState) -> dict:
                           RETURNING uuid
                       """, (collection_id, state.knowledge_base_name, state.user, json.dumps(state.metadata)))
                 collection_id = cursor.fetchone()[0]
+                # 新知识库记下当前的嵌入模型；已有知识库保持原记录
+                record_collection_model(cursor, collection_id, MODEL_CONFIG['embedding_model'])
                 conn.commit()
     except Exception as e:
         logger.exception("数据库操作失败")  # 记录完整堆栈信息
@@ -73,32 +106,54 @@ def extract_metadata(state: ProcessingState) -> dict:
 
     return {"metadata": new_metadata}
 
-def split_text(state: ProcessingState) -> dict:
-    """分割文本为块"""
-    logger.info("分割文本...")
-    if not state.text:
-        return {"chunks": []}
+@functools.lru_cache(maxsize=None)
+def token_counter(model_name: str) -> Callable[[str], int]:
+    """按指定嵌入模型的分词器计算token数（每个模型在进程内共享一个缓存）"""
+    return make_token_counter(model_manager.embedding_tokenizer(model_name))
 
-    # 获取自定义分割符或使用默认值
-    custom_separators = state.metadata.get("separators", "").split(',') if state.metadata.get("separators") else None
-    separators = custom_separators or ["\n\n", "\n", "。", "！", "？", "；", "，", "、", " "]
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=state.metadata.get("chunk_size", 1000),
-        chunk_overlap=state.metadata.get("chunk_overlap", 200),
-        separators=separators  # 使用自定义分割符
-    )
+def embedding_model_of(document_id: str) -> str:
+    """知识库当前使用的嵌入模型（迁移前建立的知识库可能仍是旧模型）"""
+    ensure_schema(get_db_connection, MODEL_CONFIG['embedding_model'])
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            return collection_model(cursor, document_id, MODEL_CONFIG['embedding_model'])
+
+
+def token_limit_check(model_name: str) -> TokenLimitCheck:
+    """按知识库所用模型的分词器和输入上限统计超长块"""
+    return TokenLimitCheck(token_counter(model_name), model_manager.embedding_max_tokens(model_name))
 
-    chunks = text_splitter.split_text(state.text)
-    chunks_list = [Document(
-        page_content=chunk,
+
+def make_text_splitter(metadata: Dict) -> RecursiveCharacterTextSplitter:
+    """按入库参数创建文本分割器；length_unit 为 tokens 时块大小和重叠按知识库嵌入模型的token计"""
+    if metadata.get("length_unit") != "tokens":
+        return build_text_splitter(metadata)
+    return build_text_splitter(metadata, token_counter(embedding_model_of(metadata["document_id"])))
+
+
+def make_chunk(text: str, metadata: Dict) -> Document:
+    return Document(
+        page_content=text,
         metadata={
-            "custom_id": state.metadata.get("user", "null"),
-            **{k: v for k, v in state.metadata.items() if k != "separators"},
+            "custom_id": metadata.get("user", "null"),
+            **{k: v for k, v in metadata.items() if k != "separators"},
              # 显式设置自定义ID
+            CHUNK_HASH_KEY: chunk_hash(text)  # 重新入库时据此跳过未变化的块
         }
+    )
 
-    ) for chunk in chunks]
+
+def split_text(state: ProcessingState, config: RunnableConfig = None) -> dict:
+    """分割文本为块"""
+    logger.info("分割文本...")
+    if not state.text:
+        return {"chunks": []}
+
+    # 与 ingest_file 使用同一种窗口切分，同一内容两条路径得到相同的块
+    chunks = iter_text_chunks(state.text, make_text_splitter(state.metadata), state.metadata.get("chunk_size", 1000))
+    chunks_list = [make_chunk(chunk, state.metadata) for chunk in chunks]
+    _report(config, "split", chunks_split=len(chunks_list))
     return {"chunks": chunks_list}
 
 from sqlalchemy import create_engine
@@ -109,20 +164,24 @@ engine = create_engine(CONNECTION_STRING)
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def generate_embeddings(state: ProcessingState) -> dict:
+def generate_embeddings(state: ProcessingState, config: RunnableConfig = None) -> dict:
     """生成嵌入向量"""
     logger.info("生成嵌入向量...")
     try:
         # 创建向量存储
-        insert_chunks(state)
+        counts = insert_chunks(state, config)
 
         return {
             "results": {
                 "status": "success",
                 "num_chunks": len(state.chunks),
-                "document_id": state.metadata.get("document_id", "")
+                "document_id": state.metadata.get("document_id", ""),
+                "length_unit": state.metadata.get("length_unit", "chars"),
+                **counts
             }
         }
+    except IngestCancelled:
+        raise
     except Exception as e:
         logger.error(f"生成嵌入时出错: {str(e)}")
         return {
@@ -147,19 +206,31 @@ workflow.add_edge("generate_embeddings", END)
 knowledge_workflow = workflow.compile()
 
 
-def save_upload_file(upload_file: UploadFile) -> str:
-    """保存上传的文件并返回文件路径"""
-    try:
-        file_path = upload_dir / upload_file.filename
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
-        return str(file_path)
-    finally:
-        upload_file.file.close()
+def _job_filename(filename: str) -> str:
+    # 入库任务异步执行且失败后保留文件以便重试，同名上传不能互相覆盖
+    return f"{uuid.uuid4().hex}_{safe_filename(filename)}"
+
+
+async def save_upload_file(upload_file: UploadFile) -> str:
+    """流式保存上传的文件并返回文件路径（相同内容在磁盘上只保存一份）"""
+    stored = await upload_store.save(upload_file, upload_dir, _job_filename(upload_file.filename))
+    return stored.path
+
+
+async def finalize_upload_file(upload_id: str, owner: str) -> tuple:
+    """组装分片上传的文件，返回 (文件路径, 原始文件名)"""
+    filename = resumable_uploads.status(upload_id, owner)["filename"]
+    stored = await resumable_uploads.finalize(upload_id, owner, upload_dir, _job_filename(filename))
+    return stored.path, filename
+
+
+def remove_upload_file(file_path: str):
+    """删除处理完的上传文件，并清理不再被引用的内容"""
+    upload_store.discard(file_path)
 
 
 def read_file(file_path: str) -> str:
-    """读取文件内容"""
+    """读取文件内容（整个文件读入内存，大文件请使用 ingest_file）"""
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read()
@@ -176,8 +247,13 @@ def process_content(
         chunk_overlap: int = 200,
         separators: str = "",  # 新增
         user: str = "anonymous",  # 新增
-        knowledge_base_name: str = "default"  # 新增
+        knowledge_base_name: str = "default",  # 新增
+        progress: Optional[Callable] = None,
+        length_unit: str = "chars"
 ) -> dict:
+    """执行入库流程；progress(stage, **counts) 在切分、每批嵌入和每批写库后被调用，
+    抛出 IngestCancelled 即可中止任务。length_unit 为 tokens 时 chunk_size/chunk_overlap
+    按嵌入模型的token数计算，chars（默认）按字符数"""
     state = ProcessingState(
         text=content,
         user=user,  # 传递用户信息
@@ -186,13 +262,73 @@ def process_content(
             "source": source,
             "chunk_size": chunk_size,
             "chunk_overlap": chunk_overlap,
-            "separators": separators  # 传递分割字符串
+            "separators": separators,  # 传递分割字符串
+            "length_unit": length_unit
         }
     )
 
-    result = knowledge_workflow.invoke(state)
+    result = knowledge_workflow.invoke(state, config={"configurable": {"progress": progress}})
     return result["results"]
 
+
+def ingest_file(
+        file_path: str,
+        source: str,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        separators: str = "",
+        user: str = "anonymous",
+        knowledge_base_name: str = "default",
+        progress: Optional[Callable] = None,
+        bulk: bool = False,
+        length_unit: str = "chars"
+) -> dict:
+    """流式入库文件：边读边切分，按批嵌入并写库，峰值内存与文件大小无关
+
+    参数和返回值与 process_content 相同；两者按同样的窗口切分，同一内容得到相同的块
+    （块边界可能与对整篇一次调用 split_text 的结果不同）。
+    与 process_content 一样按内容哈希增量入库，失败的任务重新执行时也会跳过已提交的块。
+    bulk 为True时整个文件在一个事务中写入（没有检查点），写入期间删除向量索引、
+    结束后重建，适合大批量的初次导入。
+    """
+    config = {"configurable": {"progress": progress}}
+    encoding, text_length = scan_text(file_path)
+    state = ProcessingState(
+        user=user,
+        knowledge_base_name=knowledge_base_name,
+        metadata={
+            "source": source,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "separators": separators,
+            "length_unit": length_unit
+        }
+    )
+    metadata = {**extract_metadata(state)["metadata"], "text_length": text_length}
+
+    logger.info(f"流式分割并嵌入 {file_path} ({encoding}, {text_length} 字符)...")
+    try:
+        texts = iter_file_chunks(file_path, make_text_splitter(metadata), chunk_size, encoding)
+        chunks = (make_chunk(text, metadata) for text in texts)
+        stats = _run_pipeline(metadata["document_id"], source, chunks, config, streaming=True, bulk=bulk)
+    except IngestCancelled:
+        raise
+    except Exception as e:
+        logger.exception("流式入库失败")
+        return {"status": "error", "message": str(e)}
+
+    return {
+        "status": "success",
+        "num_chunks": stats["added"] + stats["unchanged"],
+        "document_id": metadata["document_id"],
+        "added": stats["added"],
+        "unchanged": stats["unchanged"],
+        "deleted": stats["deleted"],
+        "chunks_over_limit": stats["over_limit"],
+        "length_unit": length_unit,
+        "chunks_per_second": stats["chunks_per_second"]
+    }
+
 PSYCOPG2_CONN_PARAMS = {
     'dbname': DB_CONFIG['name'],
     'user': DB_CONFIG['user'],
@@ -205,7 +341,124 @@ PSYCOPG2_CONN_PARAMS = {
 def get_db_connection():
     return psycopg2.connect(**PSYCOPG2_CONN_PARAMS)
 
-def insert_chunks(state: ProcessingState):
+# 后台嵌入模型迁移（见 rag/embeddingVersions.py）
+embedding_migrations = EmbeddingMigrator(get_db_connection, model_manager.get_embeddings, MODEL_CONFIG['embedding_model'])
+
+
+def _collection_embedder(document_id: str, model: str) -> tuple:
+    """按知识库当前的嵌入模型 model 返回 (嵌入函数, 写库前的模型校验函数)
+
+    校验函数在写库事务中锁住模型记录：若嵌入之后模型已被切换，用新模型重新嵌入这一批，
+    保证写入的向量与查询使用的模型一致。
+    """
+    def revalidate(cursor, batch: List[Document], vectors: List[List[float]]) -> List[List[float]]:
+        active = lock_collection_model(cursor, document_id, MODEL_CONFIG['embedding_model'])
+        if active != model:
+            logger.info(f"知识库 {document_id} 的嵌入模型已切换为 {active}，重新嵌入本批")
+            return model_manager.get_embeddings(active).embed_documents([chunk.page_content for chunk in batch])
+        return vectors
+
+    return model_manager.get_embeddings(model).embed_documents, revalidate
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _chunk_row(document_id: str, chunk: Document, embedding: List[float]) -> tuple:
+    # 处理元数据中的特殊值（如datetime对象）
+    processed_metadata = {}
+    for key, value in chunk.metadata.items():
+        if hasattr(value, 'isoformat'):  # 处理datetime对象
+            processed_metadata[key] = value.isoformat()
+        else:
+            processed_metadata[key] = value
+
+    # 构建插入数据元组
+    return (
+        document_id,
+        embedding,  # 嵌入向量
+        chunk.page_content,  # 文档文本
+        json.dumps(processed_metadata),  # 使用Psycopg2的Json适配器
+        chunk.metadata.get("custom_id", str(uuid.uuid4())),
+        str(uuid.uuid4())  # 新的UUID
+    )
+
+
+def _load_chunk_diff(document_id: str, source: str) -> ChunkDiff:
+    """读取知识库中同一来源已有块的内容哈希（早期写入、没有哈希的行按文本现算）"""
+    existing = {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT COALESCE(cmetadata->>%s, encode(sha256(convert_to(document, 'UTF8')), 'hex')), uuid::text
+                FROM langchain_pg_embedding
+                WHERE collection_id = %s AND cmetadata->>'source' = %s
+            """, (CHUNK_HASH_KEY, document_id, source))
+            for hash_value, row_id in cursor:
+                existing.setdefault(hash_value, []).append(row_id)
+    return ChunkDiff(existing)
+
+
+def _delete_rows(conn, row_ids: List[str]):
+    with conn.cursor() as cursor:
+        for batch in _batched(row_ids, 1000):
+            cursor.execute("DELETE FROM langchain_pg_embedding WHERE uuid = ANY(%s::uuid[])", (batch,))
+
+
+def _run_pipeline(document_id: str, source: str, chunks: Iterable[Document],
+                  config: Optional[RunnableConfig] = None, streaming: bool = False, bulk: bool = False) -> dict:
+    """增量写入同一来源的文本块（chunks 可以是生成器），返回各阶段统计和增删数
+
+    与已入库的块按内容哈希比对，只嵌入并写入新增或变化的块。嵌入与写库并行进行：
+    - 首次入库时每批单独提交，失败或取消时已提交的批次保留，重新执行时作为未变化的块跳过
+    - 该来源已有数据时，新增和删除在同一个事务中完成，查询不会看到新旧版本混在一起；
+      切分中途出错时整个事务回滚，旧版本保持不变
+    streaming 为True时切分与嵌入同步进行，切分进度随每批一起汇报；
+    bulk 为True时在单个事务中写入并推迟向量索引的维护（见 ingest_file）。
+    """
+    diff = _load_chunk_diff(document_id, source)
+    model = embedding_model_of(document_id)
+    limit_check = token_limit_check(model)
+    embed, revalidate = _collection_embedder(document_id, model)
+    stale = []
+
+    def write(cursor, batch: List[Document], vectors: List[List[float]]):
+        vectors = revalidate(cursor, batch, vectors)
+        # 二进制COPY批量写入，每批一条语句
+        load_rows(cursor, [_chunk_row(document_id, chunk, vector) for chunk, vector in zip(batch, vectors)])
+
+    def on_commit(stats: dict):
+        counts = {k: v for k, v in stats.items() if k.startswith("chunks_") and isinstance(v, int)}
+        if streaming:
+            counts["chunks_split"] = diff.added + diff.unchanged  # 包括跳过的未变化块
+        else:
+            counts.pop("chunks_split")  # 已在 split_text 中汇报总数
+        _report(config, "write", **counts, **diff.counts(), chunks_per_second=stats["chunks_per_second"])
+
+    @contextmanager
+    def around_load(conn):
+        with deferred_ann_indexes(conn) if bulk else nullcontext():
+            yield
+            # 切分已结束，剩下未匹配的旧块即为已删除的内容
+            stale.extend(diff.stale_ids())
+            _delete_rows(conn, stale)
+
+    pipeline = IngestPipeline(embed, get_db_connection, write, on_commit,
+                              single_transaction=bulk or diff.had_existing, around_load=around_load)
+    stats = pipeline.run(_batched(diff.filter(limit_check.filter(chunks)), EMBED_BATCH_SIZE))
+    stats.update(added=diff.added, unchanged=diff.unchanged, deleted=len(stale), over_limit=limit_check.over_limit)
+    limit_check.warn(source)
+    logger.info(f"{source}: 新增 {diff.added} 块，未变化 {diff.unchanged} 块，删除 {len(stale)} 块")
+    return stats
+
+
+def insert_chunks(state: ProcessingState, config: Optional[RunnableConfig] = None):
     """
     优化后的函数，批量插入文档块到数据库，并生成嵌入向量
 
@@ -215,47 +468,13 @@ def insert_chunks(state: ProcessingState):
     """
     chunks = state.chunks
     try:
-        # 1. 批量生成所有文档块的嵌入向量
-        texts = [chunk.page_content for chunk in chunks]
-        embeddingss = embeddings.embed_documents(texts)
-
-        # 2. 准备批量插入数据
-        data_to_insert = []
-        for i, chunk in enumerate(chunks):
-            # 处理元数据中的特殊值（如datetime对象）
-            processed_metadata = {}
-            for key, value in chunk.metadata.items():
-                if hasattr(value, 'isoformat'):  # 处理datetime对象
-                    processed_metadata[key] = value.isoformat()
-                else:
-                    processed_metadata[key] = value
-
-            # 构建插入数据元组
-            data_tuple = (
-                state.metadata.get("document_id"),
-                embeddingss[i],  # 嵌入向量
-                chunk.page_content,  # 文档文本
-                json.dumps(processed_metadata),  # 使用Psycopg2的Json适配器
-                chunk.metadata.get("custom_id", str(uuid.uuid4())),
-                str(uuid.uuid4())  # 新的UUID
-            )
-            data_to_insert.append(data_tuple)
-
-        # 3. 批量插入数据
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                # 使用executemany进行批量插入
-                cursor.executemany("""
-                    INSERT INTO langchain_pg_embedding (
-                        collection_id, embedding, document, 
-                        cmetadata, custom_id, uuid
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                """, data_to_insert)
-                conn.commit()
+        stats = _run_pipeline(state.metadata.get("document_id"), state.metadata.get("source"), chunks, config)
 
-        logger.info(f"成功插入 {len(chunks)} 个文档块")
-        return len(chunks)
+        logger.info(f"成功插入 {stats['added']} 个文档块")
+        return {"chunks_over_limit": stats["over_limit"], **{key: stats[key] for key in ("added", "unchanged", "deleted")}}
 
+    except IngestCancelled:
+        raise
     except Exception as e:
         logger.exception("数据库操作失败")
-        raise
\ No newline at end of file
+        raise
@@ -2,7 +2,9 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 from sentence_transformers import CrossEncoder
 import logging
 import json
+import threading
 from pathlib import Path
+from rag.embeddingCache import EmbeddingCache, CachedEmbeddings, DEFAULT_MAX_BYTES
 
 logger = logging.getLogger(__name__)
 def load_config():
@@ -26,11 +28,16 @@ class ModelManager:
 
     def _init_models(self):
         try:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=MODEL_CONFIG['embedding_model'],
-                cache_folder=MODEL_CONFIG['cache_path'],
-                model_kwargs={"local_files_only": True}
+            # 嵌入结果持久化缓存：相同文本（页眉、免责声明等）不重复计算
+            self.embedding_cache = EmbeddingCache(
+                Path(MODEL_CONFIG.get('embedding_cache_path',
+                                      Path(MODEL_CONFIG['cache_path']) / 'embedding_cache.sqlite3')),
+                int(MODEL_CONFIG.get('embedding_cache_max_bytes', DEFAULT_MAX_BYTES))
             )
+            self.embeddings = self._load_embeddings(MODEL_CONFIG['embedding_model'])
+            # 知识库可以使用不同的嵌入模型（迁移期间新旧模型同时使用），按需加载
+            self._embeddings_by_model = {MODEL_CONFIG['embedding_model']: self.embeddings}
+            self._embeddings_lock = threading.Lock()
             self.rerank_model = CrossEncoder(
                 MODEL_CONFIG['rerank_model'],
                 max_length=512,
@@ -42,6 +49,34 @@ class ModelManager:
             logger.error(f"Error initializing models: {str(e)}")
             raise
 
+    def _load_embeddings(self, model_name: str) -> CachedEmbeddings:
+        return CachedEmbeddings(
+            HuggingFaceEmbeddings(
+                model_name=model_name,
+                cache_folder=MODEL_CONFIG['cache_path'],
+                model_kwargs={"local_files_only": True}
+            ),
+            model_name,
+            self.embedding_cache
+        )
+
+    def get_embeddings(self, model_name: str) -> CachedEmbeddings:
+        """指定模型的嵌入实例（与默认模型共用嵌入缓存，缓存键包含模型名）"""
+        with self._embeddings_lock:
+            if model_name not in self._embeddings_by_model:
+                logger.info(f"加载嵌入模型 {model_name}")
+                self._embeddings_by_model[model_name] = self._load_embeddings(model_name)
+            return self._embeddings_by_model[model_name]
+
+    def embedding_tokenizer(self, model_name: str):
+        """指定嵌入模型自带的分词器（sentence-transformers 默认加载 fast tokenizer）"""
+        return self.get_embeddings(model_name).underlying.client.tokenizer
+
+    def embedding_max_tokens(self, model_name: str) -> int:
+        """指定嵌入模型单段输入的最大token数（扣除[CLS]/[SEP]等特殊token），超出部分被截断"""
+        client = self.get_embeddings(model_name).underlying.client
+        return client.max_seq_length - client.tokenizer.num_special_tokens_to_add(pair=False)
+
 
 # 单例初始化
 model_manager = ModelManager()
\ No newline at end of file
@@ -3,6 +3,7 @@ import psycopg2
 from pydantic import BaseModel
 from fastapi import   HTTPException
 from rag.model_manager import model_manager,config
+from rag.embeddingVersions import ensure_schema, collection_model
 
 # 使用嵌入模型
 embeddings = model_manager.embeddings
@@ -39,37 +40,46 @@ PSYCOPG2_CONN_PARAMS = {
 def get_db_connection():
     return psycopg2.connect(**PSYCOPG2_CONN_PARAMS)
 
+def vector_search(request: QueryRequest) -> list:
+    """按知识库当前的嵌入模型计算查询向量并检索
+
+    知识库ID、模型记录和向量在同一个REPEATABLE READ快照中读取：嵌入模型切换
+    提交前后的查询分别完整地使用旧模型或新模型，不会用旧模型的查询向量检索新向量。
+    """
+    ensure_schema(get_db_connection, MODEL_CONFIG['embedding_model'])
+    with get_db_connection() as conn:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cursor:
+            # 1. 获取知识库ID
+            cursor.execute(
+                "SELECT uuid FROM langchain_pg_collection WHERE name = %s",
+                (request.knowledge_base_name,)
+            )
+            collection_id = cursor.fetchone()
+            if not collection_id:
+                raise HTTPException(status_code=404, detail="知识库不存在")
+            collection_id = collection_id[0]
+
+            # 2. 向量检索
+            model = collection_model(cursor, collection_id, MODEL_CONFIG['embedding_model'])
+            query_vector = model_manager.get_embeddings(model).embed_query(request.query_text)
+            cursor.execute(
+                """
+                SELECT document, cmetadata, embedding <-> %s::vector AS similarity
+                FROM langchain_pg_embedding
+                WHERE collection_id = %s
+                ORDER BY embedding <-> %s::vector
+                LIMIT %s
+                """,
+                (query_vector, collection_id, query_vector, request.top_k)
+            )
+            return cursor.fetchall()
+
 async def query_knowledge_base(request: QueryRequest):
     """执行知识库查询"""
     try:
-        # 1. 获取知识库ID
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT uuid FROM langchain_pg_collection WHERE name = %s",
-                    (request.knowledge_base_name,)
-                )
-                collection_id = cursor.fetchone()
-                if not collection_id:
-                    raise HTTPException(status_code=404, detail="知识库不存在")
-                collection_id = collection_id[0]
-
-        # 2. 向量检索
-        query_vector = embeddings.embed_query(request.query_text)
-
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """
-                    SELECT document, cmetadata, embedding <-> %s::vector AS similarity
-                    FROM langchain_pg_embedding
-                    WHERE collection_id = %s
-                    ORDER BY embedding <-> %s::vector
-                    LIMIT %s
-                    """,
-                    (query_vector, collection_id, query_vector, request.top_k)
-                )
-                results = cursor.fetchall()
+        # 1-2. 获取知识库ID并向量检索
+        results = vector_search(request)
 
         # 3. 结果重排
         if results and len(results) > 1:
@@ -113,34 +123,8 @@ async def get_knowledge_bases():
 
 async def query_knowledge(request: QueryRequest):
     try:
-        # 1. 获取知识库ID
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT uuid FROM langchain_pg_collection WHERE name = %s",
-                    (request.knowledge_base_name,)
-                )
-                collection_id = cursor.fetchone()
-                if not collection_id:
-                    raise HTTPException(status_code=404, detail="知识库不存在")
-                collection_id = collection_id[0]
-
-        # 2. 向量检索
-        query_vector = embeddings.embed_query(request.query_text)
-
-        with get_db_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """
-                    SELECT document, cmetadata, embedding <-> %s::vector AS similarity
-                    FROM langchain_pg_embedding
-                    WHERE collection_id = %s
-                    ORDER BY embedding <-> %s::vector
-                    LIMIT %s
-                    """,
-                    (query_vector, collection_id, query_vector, request.top_k)
-                )
-                results = cursor.fetchall()
+        # 1-2. 获取知识库ID并向量检索
+        results = vector_search(request)
 
         # 3. 结果重排
         if results and len(results) > 1:
@@ -0,0 +1,97 @@
+import logging
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+
+logger = logging.getLogger(__name__)
+
+# 每次从文件读取的字符数（文本模式读取，解码是增量进行的）
+READ_BLOCK_CHARS = 256 * 1024
+# 切分窗口至少容纳的块数：窗口越大，切分点越接近整篇一次切分的结果（但不保证相同），
+# 因此内存中的文本也按同样的窗口切分，见 iter_text_chunks
+WINDOW_CHUNKS = 16
+# 与 read_file 一致：先按UTF-8读取，失败时回退为latin-1
+ENCODINGS = ("utf-8", "latin-1")
+DEFAULT_SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", "，", "、", " "]
+
+
+def build_text_splitter(metadata: Dict, length_function: Callable[[str], int] = len) -> RecursiveCharacterTextSplitter:
+    """按入库参数（chunk_size、chunk_overlap、逗号分隔的 separators）创建文本分割器"""
+    # 获取自定义分割符或使用默认值
+    custom_separators = metadata.get("separators", "").split(',') if metadata.get("separators") else None
+    separators = custom_separators or DEFAULT_SEPARATORS
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=metadata.get("chunk_size", 1000),
+        chunk_overlap=metadata.get("chunk_overlap", 200),
+        separators=separators,  # 使用自定义分割符
+        length_function=length_function,
+        add_start_index=True  # 流式切分时据此确定窗口间的衔接位置
+    )
+
+
+def iter_text(file_path: str, encoding: str, block_chars: int = READ_BLOCK_CHARS) -> Iterator[str]:
+    """逐块读取文本文件，任一时刻只在内存中保留一块"""
+    with open(file_path, 'r', encoding=encoding) as f:
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                return
+            yield block
+
+
+def scan_text(file_path: str) -> Tuple[str, int]:
+    """流式扫描一遍文件，返回 (可用的编码, 文本字符数)
+
+    编码必须在切分前确定：边读边切时若读到一半才发现不是UTF-8，
+    已经产出的块无法撤回。
+    """
+    for encoding in ENCODINGS[:-1]:
+        try:
+            return encoding, sum(len(block) for block in iter_text(file_path, encoding))
+        except UnicodeDecodeError:
+            logger.info(f"{file_path} 不是合法的 {encoding} 文本，尝试其他编码")
+    encoding = ENCODINGS[-1]
+    return encoding, sum(len(block) for block in iter_text(file_path, encoding))
+
+
+def iter_chunks(blocks: Iterable[str], text_splitter: TextSplitter, window_chars: int) -> Iterator[str]:
+    """把连续的文本块切分为文档块，逐个产出
+
+    缓冲区攒够 window_chars 后整体切分，除最后一块外全部产出；最后一块
+    可能被窗口边界截断，从它的起始位置（已包含与上一块的重叠部分）开始
+    保留到下一个窗口，相邻块之间保留正常的重叠。窗口内的切分点可能与整篇
+    一次切分不同，所以同一内容必须始终经由本函数切分，增量入库才能按块哈希复用。
+    text_splitter 需要以 add_start_index=True 创建。
+    """
+    buffer = ""
+    for block in blocks:
+        buffer += block
+        if len(buffer) < window_chars:
+            continue
+        documents = text_splitter.create_documents([buffer])
+        if len(documents) < 2:
+            continue  # 窗口内找不到分隔符，继续读取
+        for document in documents[:-1]:
+            yield document.page_content
+        buffer = buffer[documents[-1].metadata["start_index"]:]
+    if buffer:
+        yield from text_splitter.split_text(buffer)
+
+
+def _window_chars(chunk_size: int) -> int:
+    return max(chunk_size * WINDOW_CHUNKS, READ_BLOCK_CHARS)
+
+
+def iter_file_chunks(file_path: str, text_splitter: TextSplitter, chunk_size: int, encoding: str) -> Iterator[str]:
+    """边读边切分文件，内存占用只与窗口大小有关，与文件大小无关"""
+    return iter_chunks(iter_text(file_path, encoding), text_splitter, _window_chars(chunk_size))
+
+
+def iter_text_chunks(text: str, text_splitter: TextSplitter, chunk_size: int) -> Iterator[str]:
+    """按与 iter_file_chunks 相同的读块和窗口切分内存中的文本
+
+    同一内容无论整篇提交还是以文件流式入库，得到的块完全相同，重新入库时不会因切分点不同而重复嵌入。
+    """
+    blocks = (text[start:start + READ_BLOCK_CHARS] for start in range(0, len(text), READ_BLOCK_CHARS))
+    return iter_chunks(blocks, text_splitter, _window_chars(chunk_size))
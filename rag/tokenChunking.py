@@ -0,0 +1,47 @@
+import logging
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# 块大小的单位：chars 按字符数（len）；tokens 按嵌入模型分词后的token数
+LENGTH_UNITS = ("chars", "tokens")
+# 递归切分会对同一段文本反复计算长度，缓存分词结果
+TOKEN_LENGTH_CACHE_SIZE = 16384
+
+
+def make_token_counter(tokenizer) -> Callable[[str], int]:
+    """返回使用模型分词器计算token数的函数（不含特殊token，带LRU缓存）"""
+    if not getattr(tokenizer, "is_fast", False):
+        logger.warning(f"{type(tokenizer).__name__} 不是fast tokenizer，按token切分会较慢")
+
+    @lru_cache(maxsize=TOKEN_LENGTH_CACHE_SIZE)
+    def count_tokens(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    return count_tokens
+
+
+class TokenLimitCheck:
+    """统计超过嵌入模型输入上限的文本块：模型会截断超出部分，这些内容检索不到"""
+
+    def __init__(self, count_tokens: Callable[[str], int], max_tokens: int):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.over_limit = 0
+        self.longest = 0
+
+    def filter(self, chunks: Iterable[Document]) -> Iterator[Document]:
+        for chunk in chunks:
+            tokens = self.count_tokens(chunk.page_content)
+            if tokens > self.max_tokens:
+                self.over_limit += 1
+                self.longest = max(self.longest, tokens)
+            yield chunk
+
+    def warn(self, source: str):
+        if self.over_limit:
+            logger.warning(f"{source}: {self.over_limit} 个文本块超过嵌入模型上限 {self.max_tokens} tokens"
+                           f"（最长 {self.longest}），超出部分不会被嵌入；可改用按token切分（length_unit=tokens）")
@@ -1,56 +1,182 @@
 from fastapi import APIRouter, UploadFile, Form, File, HTTPException, Request, Depends
 from fastapi.responses import HTMLResponse, StreamingResponse
+import asyncio
+import json
+from typing import Optional
 from uuid import UUID
-import os
+from pydantic import BaseModel
 import logging
 from sessionManage.sessionObj import SessionData
 from rag.queryRagInfo import get_knowledge_bases,QueryRequest,query_knowledge_base
-from rag.initRAGDB_local_model_wf import save_upload_file, read_file, process_content
+from rag.initRAGDB_local_model_wf import save_upload_file, finalize_upload_file, embedding_migrations, get_db_connection
+from rag.ingestJobs import ingest_jobs
+from rag.tokenChunking import LENGTH_UNITS
+from rag.model_manager import model_manager, config
+from rag.embeddingVersions import MIGRATION_ROWS_PER_SECOND
+from fileManage.uploadStore import UploadTooLarge
+from fileManage.resumableUpload import ResumableUploadError
 from llmWithContextManage.talkWithRagContext import stream_generator_rag_ctx
 
 # 配置日志
 logger = logging.getLogger("rag_routes")
+MODEL_CONFIG = config['model']
+
+
+class EmbeddingMigrationRequest(BaseModel):
+    knowledge_base_name: str
+    target_model: Optional[str] = None  # 默认为 config.json 中当前的 embedding_model
+    rows_per_second: float = MIGRATION_ROWS_PER_SECOND
 
 def create_rag_router(templates, get_session_data,verify_admin, cookie, backend):
     router = APIRouter()
 
+    async def submit_ingest_job(file_path: str, source: str, chunk_size: int, chunk_overlap: int,
+                                separators: str, user: str, knowledge_base: str, owner: str,
+                                length_unit: str = "chars") -> dict:
+        """提交后台入库任务，立即返回任务ID"""
+        job = await ingest_jobs.submit(file_path, {
+            "source": source,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "separators": separators,
+            "length_unit": length_unit,
+            "user": user,
+            "knowledge_base_name": knowledge_base
+        }, owner)
+        return {"status": "queued", "job_id": job["job_id"]}
+
+    async def get_job_or_404(job_id: str) -> dict:
+        job = await ingest_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="任务不存在或已过期")
+        return job
+
     @router.get("/create_rag", response_class=HTMLResponse)
     async def create_rag(request: Request,
             session_data: SessionData = Depends(verify_admin)):
         """创建RAG页面"""
         return templates.TemplateResponse("rag/createrag.html", {"request": request})
 
+    def check_length_unit(length_unit: str):
+        if length_unit not in LENGTH_UNITS:
+            raise HTTPException(status_code=400, detail=f"length_unit 只能是 {LENGTH_UNITS}")
+
     @router.post("/uploadragfile")
     async def uploadragfile(
             file: UploadFile = File(...),
             chunk_size: int = Form(1000),
             chunk_overlap: int = Form(200),
             separators: str = Form(""),
+            length_unit: str = Form("chars"),
             user: str = Form("anonymous"),
             knowledge_base: str = Form("default"),
+            session_id: UUID = Depends(cookie),
             session_data: SessionData = Depends(verify_admin)
     ):
-        """提交md文件，创建知识库"""
+        """提交md文件，创建知识库（后台执行，返回任务ID）"""
+        check_length_unit(length_unit)
         try:
-            file_path = save_upload_file(file)
-            content = read_file(file_path)
-
-            result = process_content(
-                content=content,
-                source=file.filename,
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap,
-                separators=separators,
-                user=user,
-                knowledge_base_name=knowledge_base
-            )
-
-            os.remove(file_path)
-            return result
+            file_path = await save_upload_file(file)
+            return await submit_ingest_job(file_path, file.filename, chunk_size, chunk_overlap,
+                                           separators, user, knowledge_base, str(session_id), length_unit)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         except Exception as e:
             logger.error(f"文件处理错误: {str(e)}")
             raise HTTPException(status_code=500, detail=f"文件处理错误: {str(e)}")
 
+    @router.post("/uploadragfile/finalize/{upload_id}")
+    async def finalize_rag_upload(
+            upload_id: str,
+            chunk_size: int = Form(1000),
+            chunk_overlap: int = Form(200),
+            separators: str = Form(""),
+            length_unit: str = Form("chars"),
+            user: str = Form("anonymous"),
+            knowledge_base: str = Form("default"),
+            session_id: UUID = Depends(cookie),
+            session_data: SessionData = Depends(verify_admin)
+    ):
+        """分片上传完成后组装文件，之后的处理与 /uploadragfile 相同"""
+        check_length_unit(length_unit)
+        try:
+            file_path, filename = await finalize_upload_file(upload_id, str(session_id))
+        except ResumableUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        return await submit_ingest_job(file_path, filename, chunk_size, chunk_overlap,
+                                       separators, user, knowledge_base, str(session_id), length_unit)
+
+    @router.get("/ingest_jobs/{job_id}")
+    async def get_ingest_job(job_id: str,
+            session_data: SessionData = Depends(verify_admin)):
+        """查询入库任务状态和进度"""
+        return await get_job_or_404(job_id)
+
+    @router.get("/ingest_jobs/{job_id}/events")
+    async def ingest_job_events(job_id: str,
+            session_data: SessionData = Depends(verify_admin)):
+        """以SSE推送入库任务进度，任务结束后关闭"""
+        await get_job_or_404(job_id)
+
+        async def event_stream():
+            async for job in ingest_jobs.events(job_id):
+                yield f"event: progress\ndata: {json.dumps(job, ensure_ascii=False, default=str)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    @router.post("/ingest_jobs/{job_id}/cancel")
+    async def cancel_ingest_job(job_id: str,
+            session_data: SessionData = Depends(verify_admin)):
+        """取消入库任务：排队中的直接取消，执行中的在下一个进度点中止，重试时跳过已写入的块"""
+        await get_job_or_404(job_id)
+        return await ingest_jobs.cancel(job_id)
+
+    @router.post("/ingest_jobs/{job_id}/retry")
+    async def retry_ingest_job(job_id: str,
+            session_data: SessionData = Depends(verify_admin)):
+        """重新执行失败或已取消的入库任务"""
+        job = await get_job_or_404(job_id)
+        if job["status"] not in ("failed", "cancelled"):
+            raise HTTPException(status_code=409, detail=f"任务状态为 {job['status']}，不能重试")
+        return await ingest_jobs.retry(job_id)
+
+    @router.get("/admin/embedding_cache")
+    async def embedding_cache_stats(session_data: SessionData = Depends(verify_admin)):
+        """嵌入缓存的命中率和占用空间（命中计数为本进程启动以来）"""
+        return model_manager.embedding_cache.stats()
+
+    @router.post("/admin/embedding_migrations")
+    async def start_embedding_migration(request: EmbeddingMigrationRequest,
+            session_data: SessionData = Depends(verify_admin)):
+        """后台把知识库的向量重新嵌入为目标模型，完成后自动切换（期间查询照常使用旧模型）"""
+        def collection_ids():
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT uuid::text FROM langchain_pg_collection WHERE name = %s",
+                                   (request.knowledge_base_name,))
+                    return [row[0] for row in cursor.fetchall()]
+
+        ids = await asyncio.to_thread(collection_ids)
+        if not ids:
+            raise HTTPException(status_code=404, detail="知识库不存在")
+        target_model = request.target_model or MODEL_CONFIG['embedding_model']
+        return [await asyncio.to_thread(embedding_migrations.start, collection_id, target_model,
+                                        request.rows_per_second)
+                for collection_id in ids]
+
+    @router.get("/admin/embedding_migrations")
+    async def list_embedding_migrations(session_data: SessionData = Depends(verify_admin)):
+        """嵌入模型迁移的进度：已完成/总行数、速率、预计剩余时间（其他进程执行的迁移只有状态）"""
+        return await asyncio.to_thread(embedding_migrations.status)
+
+    @router.post("/admin/embedding_migrations/{collection_id}/cancel")
+    async def cancel_embedding_migration(collection_id: str,
+            session_data: SessionData = Depends(verify_admin)):
+        """停止迁移，已计算的新向量保留，重新开始时继续"""
+        return await asyncio.to_thread(embedding_migrations.cancel, collection_id)
+
     @router.get("/knowledge-bases")
     async def api_get_knowledge_bases():
         """获取所有知识库名称列表"""
@@ -76,6 +76,12 @@ class RedisBackend(SessionBackend[UUID, SessionData]):
         )
         logger.info(f"更新会话: {session_id}")
 
+    async def exists(self, session_id: UUID) -> bool:
+        """会话是否仍然有效（不刷新过期时间）"""
+        await self.connect()
+        key = await self._get_key(session_id)
+        return bool(await self.redis_pool.exists(key))
+
     async def delete(self, session_id: UUID):
         """删除会话"""
         await self.connect()
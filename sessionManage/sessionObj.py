@@ -14,4 +14,6 @@ class SessionData(BaseModel):
     tool_calls: List[Dict] = []
     current_step: Annotated[int, lambda x, y: x + 1] = 0
     knowledge_base_name: Optional[str] = None
-    tmpfilepath: Optional[str] = None
\ No newline at end of file
+    tmpfilepath: Optional[str] = None
+    # 上传时预先生成的数据集结构摘要，直接注入首轮提示词
+    dataset_context: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,97 @@
+// 分片断点续传上传客户端
+// 用法: await resumableUpload(file, 'csv', {onProgress: (done, total) => ...})
+// 返回 upload_id，随后调用对应业务的 finalize 接口
+(function () {
+    const PARALLEL_CHUNKS = 3;
+    const MAX_RETRIES = 5;
+
+    function resumeKey(file, purpose) {
+        return `resumable:${purpose}:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    async function sha256Hex(blob) {
+        // crypto.subtle 仅在 https 或 localhost 下可用，否则跳过分片校验
+        if (!window.crypto || !window.crypto.subtle) {
+            return null;
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async function requestJson(url, options) {
+        const response = await fetch(url, options);
+        const result = await response.json().catch(() => ({}));
+        if (!response.ok) {
+            const error = new Error(result.detail || `HTTP ${response.status}`);
+            error.status = response.status;
+            throw error;
+        }
+        return result;
+    }
+
+    async function initOrResume(file, purpose) {
+        const key = resumeKey(file, purpose);
+        const savedId = localStorage.getItem(key);
+        if (savedId) {
+            try {
+                return await requestJson(`/uploads/${purpose}/${savedId}`);
+            } catch (error) {
+                localStorage.removeItem(key);  // 已过期或已完成，重新开始
+            }
+        }
+        const state = await requestJson(`/uploads/${purpose}/init`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({filename: file.name, size: file.size})
+        });
+        localStorage.setItem(key, state.upload_id);
+        state.missing = Array.from({length: state.total_chunks}, (_, i) => i);
+        return state;
+    }
+
+    async function sendChunk(file, purpose, state, index) {
+        const start = index * state.chunk_size;
+        const chunk = file.slice(start, Math.min(start + state.chunk_size, file.size));
+        const checksum = await sha256Hex(chunk);
+        for (let attempt = 1; ; attempt++) {
+            try {
+                const headers = checksum ? {'X-Chunk-Sha256': checksum} : {};
+                await requestJson(`/uploads/${purpose}/${state.upload_id}/chunks/${index}`, {
+                    method: 'PUT',
+                    headers: headers,
+                    body: chunk
+                });
+                return;
+            } catch (error) {
+                // 4xx（校验失败除外）重试无意义
+                if (attempt >= MAX_RETRIES || (error.status >= 400 && error.status < 500 && error.status !== 400)) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+            }
+        }
+    }
+
+    window.resumableUpload = async function (file, purpose, options = {}) {
+        const onProgress = options.onProgress || (() => {});
+        const state = await initOrResume(file, purpose);
+        const queue = state.missing.slice();
+        let done = state.total_chunks - queue.length;
+        onProgress(done, state.total_chunks);
+
+        async function worker() {
+            while (queue.length > 0) {
+                const index = queue.shift();
+                await sendChunk(file, purpose, state, index);
+                done += 1;
+                onProgress(done, state.total_chunks);
+            }
+        }
+        await Promise.all(Array.from({length: PARALLEL_CHUNKS}, worker));
+        return state.upload_id;
+    };
+
+    window.clearResumableUpload = function (file, purpose) {
+        localStorage.removeItem(resumeKey(file, purpose));
+    };
+})();
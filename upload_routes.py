@@ -0,0 +1,84 @@
+from fastapi import APIRouter, HTTPException, Request, Depends, Header
+from pydantic import BaseModel
+from typing import Optional
+import logging
+from sessionManage.sessionObj import SessionData
+from fileManage.resumableUpload import ResumableUploadError, DEFAULT_CHUNK_BYTES
+from mcptools.mcp import resumable_uploads as csv_uploads
+from rag.initRAGDB_local_model_wf import resumable_uploads as rag_uploads
+
+# 配置日志
+logger = logging.getLogger("upload_routes")
+
+
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+    chunk_size: int = DEFAULT_CHUNK_BYTES
+
+
+def create_upload_router(get_session_data, cookie):
+    """断点续传通用接口：init / chunk / status / abort；
+    finalize 由各业务路由提供（/uploadcsvfile/finalize、/uploadragfile/finalize）"""
+    router = APIRouter()
+
+    # purpose -> 对应业务的上传管理器
+    uploads = {"csv": csv_uploads, "rag": rag_uploads}
+
+    def get_uploads(purpose: str, session_data: SessionData):
+        if purpose not in uploads:
+            raise HTTPException(status_code=404, detail=f"未知的上传类型: {purpose}")
+        if purpose == "rag" and session_data.role != "admin":
+            raise HTTPException(status_code=403, detail="无权限访问该资源")
+        return uploads[purpose]
+
+    @router.post("/uploads/{purpose}/init")
+    async def init_upload(purpose: str, request: UploadInitRequest,
+                          session_id: str = Depends(cookie),
+                          session_data: SessionData = Depends(get_session_data)):
+        """登记一次分片上传，返回上传ID、分片大小和分片数"""
+        manager = get_uploads(purpose, session_data)
+        try:
+            return manager.init(request.filename, request.size, str(session_id),
+                                request.sha256, request.chunk_size)
+        except ResumableUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    @router.put("/uploads/{purpose}/{upload_id}/chunks/{index}")
+    async def upload_chunk(purpose: str, upload_id: str, index: int, request: Request,
+                           x_chunk_sha256: Optional[str] = Header(None),
+                           session_id: str = Depends(cookie),
+                           session_data: SessionData = Depends(get_session_data)):
+        """上传一个分片（请求体为分片原始字节），可并行、可重传"""
+        manager = get_uploads(purpose, session_data)
+        try:
+            return await manager.write_chunk(upload_id, index, str(session_id),
+                                             request.stream(), x_chunk_sha256)
+        except ResumableUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    @router.get("/uploads/{purpose}/{upload_id}")
+    async def upload_status(purpose: str, upload_id: str,
+                            session_id: str = Depends(cookie),
+                            session_data: SessionData = Depends(get_session_data)):
+        """查询已收到/缺失的分片，用于断点续传"""
+        manager = get_uploads(purpose, session_data)
+        try:
+            return manager.status(upload_id, str(session_id))
+        except ResumableUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    @router.delete("/uploads/{purpose}/{upload_id}")
+    async def abort_upload(purpose: str, upload_id: str,
+                           session_id: str = Depends(cookie),
+                           session_data: SessionData = Depends(get_session_data)):
+        """放弃一次上传并删除已收到的分片"""
+        manager = get_uploads(purpose, session_data)
+        try:
+            manager.abort(upload_id, str(session_id))
+            return {"status": "success"}
+        except ResumableUploadError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    return router